@@ -0,0 +1,265 @@
+"""
+Local stand-ins for the Shopify Admin REST API and the SP-API Feeds/Listings endpoints.
+
+Both servers run in a child process (see start_service), so generating and serving pages does
+not compete with the code under test for the GIL. Catalogs are synthetic and generated on the
+fly from the product index, so a million-product catalog costs no memory.
+"""
+import json
+import multiprocessing
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SHOPIFY_API_PREFIX = "/admin/api/2023-10"
+CATALOG_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+_DESCRIPTION = (
+    "<p>Soft, breathable <strong>organic cotton</strong> &amp; recycled polyester.</p>"
+    "<ul><li>Machine washable</li><li>Relaxed fit</li><li>Ethically made</li></ul>"
+)
+
+
+def synthetic_product(index: int) -> dict:
+    """Deterministic REST-shaped product number `index` (0-based) with 1-3 variants."""
+    product_id = index + 1
+    updated_at = (CATALOG_START + timedelta(seconds=index)).isoformat()
+    variants = [{
+        'id': product_id * 10 + v,
+        'product_id': product_id,
+        'title': ("Small", "Medium", "Large")[v],
+        'sku': f"SKU-{product_id:07d}-{v}",
+        'price': f"{9.99 + index % 500:.2f}",
+        'compare_at_price': None,
+        'barcode': f"{product_id:012d}{v}",
+        'inventory_quantity': (index * 7 + v) % 97,
+        'inventory_item_id': product_id * 10 + v,
+        'position': v + 1,
+    } for v in range(1 + index % 3)]
+    return {
+        'id': product_id,
+        'title': f"Synthetic Product {product_id}",
+        'body_html': _DESCRIPTION,
+        'vendor': "Bench Co",
+        'product_type': ("Shirts", "Mugs", "Posters")[index % 3],
+        'tags': "bench, synthetic",
+        'updated_at': updated_at,
+        'image': {'src': f"https://cdn.example.com/products/{product_id}.jpg"},
+        'variants': variants,
+    }
+
+
+class _LeakyBucket:
+    """Server side of Shopify's call limit: `capacity` calls leaking at `leak_rate` per second."""
+
+    def __init__(self, capacity, leak_rate):
+        self.capacity = capacity
+        self.leak_rate = leak_rate
+        self.level = 0.0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Return the fill level after this call, or None if the call is throttled."""
+        with self.lock:
+            now = time.monotonic()
+            if self.leak_rate:
+                self.level = max(0.0, self.level - (now - self.updated_at) * self.leak_rate)
+            else:
+                self.level = 0.0 # Unlimited
+            self.updated_at = now
+            if self.level + 1 > self.capacity:
+                return None
+            self.level += 1
+            return int(self.level)
+
+
+class _ShopifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real API
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        if url.path != f"{SHOPIFY_API_PREFIX}/products.json":
+            self._send(404, {"errors": "Not Found"})
+            return
+        if server.latency:
+            time.sleep(server.latency)
+        level = server.bucket.take()
+        if level is None:
+            self._send(429, {"errors": "Exceeded 2 calls per second for api client. Reduce request rates to resume uninterrupted service."},
+                       {"Retry-After": "1.0"})
+            return
+
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        limit = min(250, int(query.get("limit", 50)))
+        if "page_info" in query:
+            start = int(query["page_info"])
+        elif "updated_at_min" in query:
+            updated_at_min = datetime.fromisoformat(query["updated_at_min"])
+            start = max(0, int((updated_at_min - CATALOG_START).total_seconds()))
+        else:
+            start = 0
+        end = min(server.product_count, start + limit)
+        products = [synthetic_product(i) for i in range(start, end)]
+
+        headers = {"X-Shopify-Shop-Api-Call-Limit": f"{level}/{server.bucket.capacity}"}
+        if end < server.product_count:
+            host = self.headers.get("Host")
+            headers["Link"] = f'<http://{host}{url.path}?limit={limit}&page_info={end}>; rel="next"'
+        self._send(200, {"products": products}, headers)
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_shopify_server(product_count: int, host: str = "127.0.0.1", port: int = 0, bucket_size: int = 40,
+                        leak_rate: float = 0.0, latency: float = 0.0):
+    """
+    Fake store serving products.json with Link pagination and X-Shopify-Shop-Api-Call-Limit.
+
+    Args:
+        leak_rate (float): Calls per second the bucket drains (2.0 on standard plans); 0 disables throttling.
+        latency (float): Seconds added to every response to simulate the network round trip.
+    """
+    server = ThreadingHTTPServer((host, port), _ShopifyHandler)
+    server.daemon_threads = True
+    server.product_count = product_count
+    server.bucket = _LeakyBucket(bucket_size, leak_rate)
+    server.latency = latency
+    return server
+
+
+_FEED_PATH_RE = re.compile(r"^/feeds/2021-06-30/(documents|feeds)(?:/([^/?]+))?$")
+
+
+class _SPAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _base(self):
+        return f"http://{self.headers.get('Host')}"
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body=None):
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("x-amzn-RateLimit-Limit", self.server.rate_limit)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _delay(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def do_POST(self):
+        self._delay()
+        self._body()
+        stats = self.server.stats
+        match = _FEED_PATH_RE.match(urlparse(self.path).path)
+        if match and match.group(1) == "documents" and not match.group(2):
+            with self.server.lock:
+                stats["documents"] += 1
+                document_id = f"doc-{stats['documents']}"
+            self._send(201, {"feedDocumentId": document_id, "url": f"{self._base()}/upload/{document_id}"})
+        elif match and match.group(1) == "feeds" and not match.group(2):
+            with self.server.lock:
+                stats["feeds"] += 1
+                feed_id = f"feed-{stats['feeds']}"
+            self._send(202, {"feedId": feed_id})
+        else:
+            self._send(404, {"errors": [{"code": "NotFound"}]})
+
+    def do_PUT(self):
+        if not self.path.startswith("/upload/"):
+            self._send(404)
+            return
+        size = len(self._body())
+        with self.server.lock:
+            self.server.stats["uploaded_bytes"] += size
+        self._send(200)
+
+    def do_PATCH(self):
+        self._delay()
+        self._body()
+        with self.server.lock:
+            self.server.stats["patches"] += 1
+        sku = urlparse(self.path).path.rsplit("/", 1)[-1]
+        self._send(200, {"sku": sku, "status": "ACCEPTED", "submissionId": "bench", "issues": []})
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/stats":
+            with self.server.lock:
+                self._send(200, dict(self.server.stats))
+            return
+        if path.startswith("/download/"):
+            self._send(200, {"summary": {"messagesProcessed": 0, "messagesAccepted": 0, "messagesInvalid": 0}})
+            return
+        self._delay()
+        match = _FEED_PATH_RE.match(path)
+        if match and match.group(1) == "feeds" and match.group(2):
+            self._send(200, {"feedId": match.group(2), "processingStatus": "DONE",
+                             "resultFeedDocumentId": f"report-{match.group(2)}"})
+        elif match and match.group(1) == "documents" and match.group(2):
+            self._send(200, {"feedDocumentId": match.group(2), "url": f"{self._base()}/download/{match.group(2)}"})
+        else:
+            self._send(404, {"errors": [{"code": "NotFound"}]})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_sp_api_server(host: str = "127.0.0.1", port: int = 0, rate_limit: float = 100.0, latency: float = 0.0):
+    """
+    Fake SP-API: Feeds document/feed creation, pre-signed upload/download URLs, feed status
+    (always DONE) and patchListingsItem. GET /stats returns counts of what it received.
+
+    Args:
+        rate_limit (float): Value sent in x-amzn-RateLimit-Limit; keep it high so client-side
+            pacing does not dominate the benchmark.
+    """
+    server = ThreadingHTTPServer((host, port), _SPAPIHandler)
+    server.daemon_threads = True
+    server.rate_limit = str(rate_limit)
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.stats = {"documents": 0, "feeds": 0, "uploaded_bytes": 0, "patches": 0}
+    return server
+
+
+def _serve(factory, kwargs, ready):
+    server = factory(**kwargs)
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_service(factory, **kwargs):
+    """
+    Run make_shopify_server / make_sp_api_server in a child process.
+
+    Returns:
+        tuple: (process, base_url). Terminate the process when done.
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(factory, kwargs, ready), daemon=True)
+    process.start()
+    port = ready.get(timeout=30)
+    return process, f"http://127.0.0.1:{port}"
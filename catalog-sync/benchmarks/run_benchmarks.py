@@ -0,0 +1,193 @@
+"""
+Offline throughput benchmarks for catalog-sync.
+
+Runs against the local stand-ins in fake_services.py, so no credentials or network access are
+needed:
+
+    python benchmarks/run_benchmarks.py --products 100000
+    python benchmarks/run_benchmarks.py --products 1000000 --only fetch,upsert --json report.json
+    python benchmarks/run_benchmarks.py --latency-ms 80 --shopify-leak-rate 2   # realistic API limits
+
+Stages:
+    fetch       ShopifyAPIClient.iter_product_pages over the whole catalog (request + decode)
+    upsert      database.upsert_products with variants (parsing excluded from the timing)
+    feed_build  ListingsFeedBuilder + compiled mapping over every dirty product
+    end_to_end  SyncPipeline with push_dirty_products against the fake Feeds API
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from catalog_sync import database, metrics
+from catalog_sync.amazon_sp_api_client import AmazonSPAPIClient
+from catalog_sync.feed_builder import ListingsFeedBuilder, iter_dirty_product_rows, push_dirty_products
+from catalog_sync.mapping import compile_mapping
+from catalog_sync.shopify_client import ShopifyAPIClient, parse_product_data
+from catalog_sync.sync_engine import SyncPipeline
+from catalog_sync.throttling import SP_API_DEFAULT_RATE_LIMITS, ShopifyCallLimitThrottler, SPAPIRateLimiter
+from catalog_sync.token_cache import LWATokenCache
+from fake_services import SHOPIFY_API_PREFIX, make_shopify_server, make_sp_api_server, start_service, synthetic_product
+
+STAGES = ("fetch", "upsert", "feed_build", "end_to_end")
+MARKETPLACE_ID = "ATVPDKIKX0DER"
+UNTHROTTLED_LEAK_RATE = 1e6
+
+
+def make_shopify_client(base_url, leak_rate=0.0):
+    # Pace at the stand-in's leak rate; an unthrottled stand-in needs an unthrottled client
+    throttler = ShopifyCallLimitThrottler(leak_rate=leak_rate or UNTHROTTLED_LEAK_RATE)
+    client = ShopifyAPIClient(store_url="bench.myshopify.com", api_key="bench", api_password="bench",
+                              throttler=throttler, backoff_factor=0.1)
+    # The client always builds an https URL; point it at the local plain-HTTP stand-in
+    host = base_url.split("://", 1)[1]
+    client.base_url = f"http://bench:bench@{host}{SHOPIFY_API_PREFIX}"
+    return client
+
+
+def make_sp_api_client(base_url, work_dir):
+    # Published usage plans (e.g. createFeed at one call per two minutes) would turn the
+    # benchmark into a wait; the stand-in's own rate-limit header governs pacing instead
+    limiter = SPAPIRateLimiter(defaults={operation: (100.0, 100) for operation in SP_API_DEFAULT_RATE_LIMITS})
+    client = AmazonSPAPIClient(client_id="bench", client_secret="bench", refresh_token="bench", endpoint=base_url,
+                               token_cache=LWATokenCache(Path(work_dir) / "tokens.db"), rate_limiter=limiter)
+    client.access_token, client.access_token_expires_at = "bench-token", time.time() + 86400
+    return client
+
+
+def _result(items, seconds, **extra):
+    return dict(items=items, seconds=seconds, per_second=items / seconds if seconds else 0.0, **extra)
+
+
+def bench_fetch(shopify_url, page_size, leak_rate):
+    client = make_shopify_client(shopify_url, leak_rate)
+    products = pages = 0
+    started = time.perf_counter()
+    for body, _ in client.iter_product_pages(page_size=page_size):
+        products += len(json.loads(body)["products"])
+        pages += 1
+    return _result(products, time.perf_counter() - started, pages=pages)
+
+
+def bench_upsert(db_path, product_count, batch_size):
+    conn = database.initialize_db(db_path)
+    seconds = 0.0
+    for start in range(0, product_count, batch_size):
+        batch = [parse_product_data(synthetic_product(i)) for i in range(start, min(product_count, start + batch_size))]
+        started = time.perf_counter()
+        database.upsert_products(conn, batch, batch_size=batch_size, with_variants=True)
+        seconds += time.perf_counter() - started
+    conn.close()
+    return _result(product_count, seconds)
+
+
+def bench_feed_build(db_path):
+    conn = database.initialize_db(db_path)
+    builder = ListingsFeedBuilder("BENCH", MARKETPLACE_ID, mapping=compile_mapping(marketplace_id=MARKETPLACE_ID))
+    messages = size = documents = 0
+    started = time.perf_counter()
+    for document in builder.iter_documents(iter_dirty_product_rows(conn, with_raw_data=builder.uses_raw_data)):
+        messages += document.message_count
+        size += document.size
+        documents += 1
+        document.close()
+    seconds = time.perf_counter() - started
+    conn.close()
+    return _result(messages, seconds, documents=documents, megabytes=size / 1e6,
+                   megabytes_per_second=size / 1e6 / seconds if seconds else 0.0)
+
+
+def bench_end_to_end(shopify_url, sp_api_url, db_path, work_dir, page_size, transform_workers, leak_rate):
+    amazon = make_sp_api_client(sp_api_url, work_dir)
+    builder = ListingsFeedBuilder("BENCH", MARKETPLACE_ID, mapping=compile_mapping(marketplace_id=MARKETPLACE_ID))
+    pipeline = SyncPipeline(make_shopify_client(shopify_url, leak_rate), db_path, page_size=page_size,
+                            transform_workers=transform_workers,
+                            pusher=lambda conn: push_dirty_products(amazon, conn, builder, [MARKETPLACE_ID]))
+    started = time.perf_counter()
+    result = pipeline.run()
+    seconds = time.perf_counter() - started
+    feeds = sum(len(submissions) for submissions in result['pushes'])
+    return _result(result['totals']['inserted'] + result['totals']['updated'], seconds, pages=result['pages'],
+                   feeds=feeds, stage_seconds=result['stage_seconds'])
+
+
+def run(product_count=10000, page_size=250, batch_size=database.DEFAULT_BATCH_SIZE, stages=STAGES,
+        latency=0.0, shopify_leak_rate=0.0, transform_workers=2, work_dir=None):
+    """Run the selected stages and return {stage: {'items', 'seconds', 'per_second', ...}}."""
+    metrics.REGISTRY.reset()
+    results = {}
+    services = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        try:
+            shopify_url = sp_api_url = None
+            if {"fetch", "end_to_end"} & set(stages):
+                process, shopify_url = start_service(make_shopify_server, product_count=product_count,
+                                                     leak_rate=shopify_leak_rate, latency=latency)
+                services.append(process)
+            if "end_to_end" in stages:
+                process, sp_api_url = start_service(make_sp_api_server, latency=latency)
+                services.append(process)
+
+            if "fetch" in stages:
+                results["fetch"] = bench_fetch(shopify_url, page_size, shopify_leak_rate)
+            if "upsert" in stages or "feed_build" in stages:
+                db_path = str(Path(tmp) / "upsert.db")
+                upsert = bench_upsert(db_path, product_count, batch_size)
+                if "upsert" in stages:
+                    results["upsert"] = upsert
+                if "feed_build" in stages:
+                    results["feed_build"] = bench_feed_build(db_path)
+            if "end_to_end" in stages:
+                results["end_to_end"] = bench_end_to_end(shopify_url, sp_api_url, str(Path(tmp) / "e2e.db"), tmp,
+                                                         page_size, transform_workers, shopify_leak_rate)
+        finally:
+            for process in services:
+                process.terminate()
+                process.join()
+    return results
+
+
+def format_table(results) -> str:
+    lines = [f"{'stage':<12}{'items':>12}{'seconds':>10}{'items/s':>12}  details"]
+    for stage, result in results.items():
+        details = ", ".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                            for key, value in result.items()
+                            if key not in ("items", "seconds", "per_second", "stage_seconds"))
+        lines.append(f"{stage:<12}{result['items']:>12}{result['seconds']:>10.2f}{result['per_second']:>12.0f}  {details}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=10000, help="Synthetic catalog size (1k-1M)")
+    parser.add_argument("--page-size", type=int, default=250)
+    parser.add_argument("--batch-size", type=int, default=database.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--transform-workers", type=int, default=2)
+    parser.add_argument("--only", default=",".join(STAGES), help=f"Comma-separated subset of {', '.join(STAGES)}")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated round trip added by the stand-ins")
+    parser.add_argument("--shopify-leak-rate", type=float, default=0.0,
+                        help="Shopify call-limit leak rate (2 for standard plans); 0 disables throttling")
+    parser.add_argument("--work-dir", help="Where the temporary databases go (default: system temp)")
+    parser.add_argument("--json", help="Also write the results and the metrics snapshot to this file")
+    args = parser.parse_args(argv)
+
+    stages = [stage for stage in args.only.split(",") if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+
+    results = run(args.products, args.page_size, args.batch_size, stages, args.latency_ms / 1000.0,
+                  args.shopify_leak_rate, args.transform_workers, args.work_dir)
+    print(format_table(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"products": args.products, "results": results, "metrics": metrics.REGISTRY.snapshot()}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,24 @@
 import os
-import requests # We will likely need a more specific SP-API library or use Boto3 for request signing
+import random
+import sqlite3
+import requests
 from dotenv import load_dotenv
 import time
 import json
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from .database import record_feed_submission
+from .feed_builder import JSON_LISTINGS_FEED, ListingsFeedBuilder, patch_listing_message, submit_feed_document
+from .metrics import REGISTRY, normalize_endpoint
+from .throttling import SP_API_RATE_LIMIT_HEADER, get_sp_api_rate_limiter
+from .token_cache import LWATokenCache, token_cache_key
 
 # Load environment variables from .env file
 load_dotenv()
 
-# These are placeholders; actual SP-API auth is more complex
-# and involves LWA token exchange, STS for IAM roles, etc.
+# SP-API calls authenticate with an LWA access token exchanged from the refresh token.
+# The AWS/IAM values are only needed for the legacy SigV4 signing flow.
 SP_API_CLIENT_ID = os.getenv("SP_API_CLIENT_ID")
 SP_API_CLIENT_SECRET = os.getenv("SP_API_CLIENT_SECRET")
 SP_API_REFRESH_TOKEN = os.getenv("SP_API_REFRESH_TOKEN") # Long-lived LWA refresh token
@@ -17,15 +27,60 @@ SP_API_AWS_SECRET_KEY = os.getenv("SP_API_AWS_SECRET_KEY")
 SP_API_ROLE_ARN = os.getenv("SP_API_ROLE_ARN") # IAM Role ARN to assume
 SP_API_ENDPOINT = os.getenv("SP_API_ENDPOINT") # e.g., "https://sellingpartnerapi-na.amazon.com" for North America
 
+LWA_TOKEN_URL = "https://api.amazon.com/auth/o2/token"
+
+# Up to this many offer updates go out as individual patchListingsItem calls (seconds end to end);
+# larger batches are cheaper as one PATCH feed, even though a feed takes minutes to process
+DEFAULT_PATCH_FEED_THRESHOLD = 100
+DEFAULT_PATCH_CONCURRENCY = 5 # patchListingsItem default rate is 5 requests/second
+
+# Methods that can safely be sent twice, as in shopify_client.IDEMPOTENT_METHODS. POSTs such as
+# createFeed would submit a second feed, so they are only retried when the request certainly did
+# not run: a 429, or a connection that was never established. patchListingsItem only sends
+# "replace"/"delete" operations, so PATCH is safe here.
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "PATCH", "DELETE"})
+
+_REQUEST_SECONDS = REGISTRY.histogram("sp_api_request_seconds", "SP-API request latency", ("operation",))
+_REQUESTS = REGISTRY.counter("sp_api_requests_total", "SP-API responses by status", ("operation", "status"))
+_RETRIES = REGISTRY.counter("sp_api_retries_total", "SP-API requests retried, by reason", ("operation", "reason"))
+_RATE_LIMIT_WAIT = REGISTRY.counter("sp_api_rate_limit_wait_seconds_total",
+                                    "Time spent waiting for per-operation token buckets", ("operation",))
+_UPLOAD_SECONDS = REGISTRY.histogram("sp_api_feed_upload_seconds", "Feed document upload time")
+
+
+class AmazonSPAPIError(Exception):
+    """Raised when an SP-API call (or a pre-signed feed document transfer) fails."""
+
+    def __init__(self, message, status_code=None, response_text=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response_text = response_text
+
+
 class AmazonSPAPIClient:
-    def __init__(self):
-        self.client_id = SP_API_CLIENT_ID
-        self.client_secret = SP_API_CLIENT_SECRET
-        self.refresh_token = SP_API_REFRESH_TOKEN
+    def __init__(self, client_id=None, client_secret=None, refresh_token=None, endpoint=None,
+                 token_cache=None, session=None, rate_limiter=None, max_retries=5, backoff_factor=1.0,
+                 max_backoff=60.0, timeout=(5.0, 60.0)):
+        """
+        Args:
+            client_id, client_secret, refresh_token, endpoint: Override the SP_API_* values from .env.
+            token_cache (LWATokenCache, optional): Cross-process access-token cache. Defaults to the
+                shared cache file, so short-lived processes reuse a token another process obtained.
+            session (requests.Session, optional): Session used for LWA and SP-API calls.
+            rate_limiter (SPAPIRateLimiter, optional): Per-operation token buckets. Defaults to the
+                process-wide limiter for these credentials, shared by every client and thread using them.
+            max_retries (int): Retries for 429/5xx responses and connection errors.
+            backoff_factor (float): Base delay in seconds; retry n waits up to backoff_factor * 2**n (full jitter).
+            max_backoff (float): Upper bound for a single backoff delay.
+            timeout (tuple): (connect, read) timeout in seconds for SP-API calls.
+        """
+        self.client_id = client_id or SP_API_CLIENT_ID
+        self.client_secret = client_secret or SP_API_CLIENT_SECRET
+        self.refresh_token = refresh_token or SP_API_REFRESH_TOKEN
         self.aws_access_key = SP_API_AWS_ACCESS_KEY
         self.aws_secret_key = SP_API_AWS_SECRET_KEY
         self.role_arn = SP_API_ROLE_ARN
-        self.endpoint = SP_API_ENDPOINT
+        self.endpoint = endpoint or SP_API_ENDPOINT
 
         if not all([self.client_id, self.client_secret, self.refresh_token, self.endpoint]):
             raise ValueError("SP-API Client ID, Client Secret, Refresh Token, and Endpoint must be set in .env")
@@ -33,94 +88,181 @@ class AmazonSPAPIClient:
         self.access_token = None
         self.access_token_expires_at = 0
 
-        # TODO: Initialize a session for requests, potentially with custom signing logic
-        # For SP-API, requests need to be signed using AWS Signature Version 4.
-        # Libraries like `requests-aws4auth` or the official `python-amazon-sp-api` SDK handle this.
-        # For now, this is a simplified placeholder.
+        self.session = session or requests.Session()
+        self.token_cache = token_cache or LWATokenCache()
+        self._token_cache_key = token_cache_key(self.client_id, self.refresh_token)
+        self.rate_limiter = rate_limiter or get_sp_api_rate_limiter(self._token_cache_key)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+    def _request_lwa_token(self):
+        """Exchange the LWA refresh token for a new access token. Returns (access_token, expires_in)."""
+        payload = {
+            'grant_type': 'refresh_token',
+            'refresh_token': self.refresh_token,
+            'client_id': self.client_id,
+            'client_secret': self.client_secret
+        }
+        try:
+            response = self.session.post(LWA_TOKEN_URL, data=payload, timeout=(5, 30))
+            response.raise_for_status()
+            token_data = response.json()
+        except (requests.exceptions.RequestException, ValueError) as err:
+            raise AmazonSPAPIError(f"LWA token exchange failed: {err}") from err
+        return token_data['access_token'], token_data['expires_in']
 
     def _get_lwa_access_token(self):
         """
-        Placeholder: Exchanges the LWA refresh token for an access token.
-        This is a critical part of SP-API authentication.
-        """
-        # This is a simplified representation. Actual implementation requires an HTTP POST
-        # to https://api.amazon.com/auth/o2/token with grant_type, refresh_token, client_id, client_secret.
-        # The response contains access_token and expires_in.
-        # For now, we assume this is handled and self.access_token is populated.
-        
-        # Example (conceptual - actual implementation needed):
-        # if time.time() >= self.access_token_expires_at - 60: # Refresh if token is about to expire
-        #     payload = {
-        #         'grant_type': 'refresh_token',
-        #         'refresh_token': self.refresh_token,
-        #         'client_id': self.client_id,
-        #         'client_secret': self.client_secret
-        #     }
-        #     response = requests.post("https://api.amazon.com/auth/o2/token", data=payload)
-        #     response.raise_for_status()
-        #     token_data = response.json()
-        #     self.access_token = token_data['access_token']
-        #     self.access_token_expires_at = time.time() + token_data['expires_in']
-        #     print("LWA Access Token refreshed.")
-        # return self.access_token
-        
-        print("WARN: _get_lwa_access_token() is a placeholder and needs full implementation.")
-        # For initial development, one might manually get an access token and set it.
-        # self.access_token = "MANUALLY_OBTAINED_ACCESS_TOKEN" 
-        # self.access_token_expires_at = time.time() + 3600 # Assuming 1 hour validity
-        if not self.access_token:
-            raise NotImplementedError("LWA token exchange not implemented. Set a manual token for now or implement this method.")
+        Returns a valid LWA access token.
+
+        Order of lookups: this instance, then the shared cross-process cache, and only then an
+        actual exchange at the LWA endpoint. Concurrent workers that all miss coalesce on a
+        single exchange inside LWATokenCache.get_or_refresh.
+
+        Raises:
+            AmazonSPAPIError: If the exchange fails or the token cache stays locked past its lock_timeout.
+        """
+        if self.access_token and time.time() < self.access_token_expires_at - self.token_cache.expiry_skew:
+            return self.access_token
+
+        try:
+            self.access_token, self.access_token_expires_at = self.token_cache.get_or_refresh(
+                self._token_cache_key, self._request_lwa_token
+            )
+        except sqlite3.OperationalError as err:
+            # Another process held the refresh lock past lock_timeout, or the cache file is unusable
+            raise AmazonSPAPIError(f"LWA token cache unavailable: {err}") from err
         return self.access_token
 
-    def _make_request(self, http_method: str, path: str, params: dict = None, body: dict = None):
+    def invalidate_access_token(self):
+        """Forget the current token everywhere, e.g. after SP-API answered 401/403 for it."""
+        rejected = self.access_token
+        self.access_token = None
+        self.access_token_expires_at = 0
+        self.token_cache.invalidate(self._token_cache_key, rejected)
+
+    def _backoff_delay(self, attempt, operation=None):
+        """Full-jitter exponential backoff, never shorter than one token interval of the operation."""
+        delay = random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+        if operation:
+            delay = max(delay, 1.0 / self.rate_limiter.bucket(operation).rate)
+        return min(delay, self.max_backoff)
+
+    def _make_request(self, http_method: str, path: str, params: dict = None, body: dict = None,
+                      operation: str = None):
         """
-        Placeholder: Makes a signed request to the SP-API.
-        Requires AWS Signature Version 4 signing.
+        Makes a request to the SP-API, paced by the operation's token bucket.
+
+        SP-API authenticates with the LWA access token alone; AWS Signature Version 4 signing is
+        no longer required. 429 and 5xx responses are retried with backoff (a 429 also drains the
+        operation's bucket for every caller sharing it). A 401/403 is retried once with a freshly
+        exchanged token in case the cached one was revoked. Only idempotent methods are retried
+        after a timeout, a dropped connection or a 5xx; see IDEMPOTENT_METHODS.
+
+        Args:
+            operation: SP-API operation name (e.g. 'createFeed') used for rate limiting.
+        Returns:
+            dict: Decoded JSON response ({} for empty bodies).
+        Raises:
+            AmazonSPAPIError: On a non-retryable error or once max_retries is exhausted.
         """
-        access_token = self._get_lwa_access_token() # This might raise NotImplementedError first
-        # headers = { # Headers would be used with the actual request
-        #     \"x-amz-access-token\": access_token,
-        #     \"Content-Type\": \"application/json\",
-        # }
-        # url = f\"{self.endpoint}{path}\"
+        url = f"{self.endpoint}{path}"
+        label = operation or normalize_endpoint(path)
+        idempotent = http_method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        token_retried = False
+        while True:
+            if operation:
+                _RATE_LIMIT_WAIT.inc(self.rate_limiter.acquire(operation) or 0, operation=label)
+            headers = {
+                "x-amz-access-token": self._get_lwa_access_token(),
+                "Content-Type": "application/json",
+            }
+            started = time.perf_counter()
+            try:
+                response = self.session.request(http_method, url, params=params, json=body, headers=headers,
+                                                timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                _REQUESTS.inc(operation=label, status="error")
+                never_sent = isinstance(err, requests.exceptions.ConnectTimeout)
+                if attempt >= self.max_retries or not (idempotent or never_sent):
+                    raise AmazonSPAPIError(f"{http_method} {path} failed after {attempt + 1} attempts: {err}") from err
+                _RETRIES.inc(operation=label, reason="connection")
+                time.sleep(self._backoff_delay(attempt))
+                attempt += 1
+                continue
+            except requests.exceptions.RequestException as err:
+                _REQUESTS.inc(operation=label, status="error")
+                raise AmazonSPAPIError(f"{http_method} {path} failed: {err}") from err
+            _REQUEST_SECONDS.observe(time.perf_counter() - started, operation=label)
+            _REQUESTS.inc(operation=label, status=response.status_code)
 
-        # Actual SP-API request logic (including signing) is not implemented yet.
-        # The original try-except block was for the actual requests.request call.
-        raise NotImplementedError("SP-API request signing and actual call not implemented yet.")
+            if operation:
+                self.rate_limiter.update_from_header(operation, response.headers.get(SP_API_RATE_LIMIT_HEADER))
+                if response.status_code == 429:
+                    self.rate_limiter.record_throttled(operation)
 
-    # --- Feeds API Methods (Example Placeholders) ---
+            if response.status_code in (401, 403) and not token_retried:
+                _RETRIES.inc(operation=label, reason="token")
+                token_retried = True
+                self.invalidate_access_token()
+                continue
+            retryable = response.status_code == 429 or (response.status_code >= 500 and idempotent)
+            if retryable and attempt < self.max_retries:
+                _RETRIES.inc(operation=label, reason=response.status_code)
+                time.sleep(self._backoff_delay(attempt, operation))
+                attempt += 1
+                continue
+            if response.status_code >= 400:
+                raise AmazonSPAPIError(
+                    f"{http_method} {path} returned HTTP {response.status_code}",
+                    status_code=response.status_code,
+                    response_text=response.text,
+                )
+            return response.json() if response.content else {}
+
+    # --- Feeds API Methods ---
     def create_feed_document(self, content_type: str):
         """
         Step 1 (Feeds API): Creates a feed document specification.
         Args:
             content_type: The content type of the feed, e.g., 'application/json; charset=UTF-8', 'text/xml; charset=UTF-8'.
         Returns:
-            dict: Response containing feedDocumentId and upload URL, or None.
+            dict: Response containing feedDocumentId and upload URL.
         """
         path = "/feeds/2021-06-30/documents"
         body = {
             "contentType": content_type
         }
-        # return self._make_request("POST", path, body=body)
-        print("WARN: create_feed_document called (not fully implemented).")
-        return { # Mocked response for now
-            "feedDocumentId": "doc-id-placeholder-" + str(time.time()),
-            "url": "https://example.com/upload-url-placeholder"
-        }
+        return self._make_request("POST", path, body=body, operation="createFeedDocument")
 
-    def upload_feed_document(self, upload_url: str, feed_content: str, content_type: str):
+    def upload_feed_document(self, upload_url: str, feed_content, content_type: str, timeout: float = 300.0):
         """
         Step 2 (Feeds API): Uploads the feed content to the pre-signed URL.
-        This request does NOT use SP-API signing; it's a direct PUT to the S3 pre-signed URL.
+        This request does NOT use SP-API signing; it's a direct PUT to the S3 pre-signed URL,
+        sent through the client's session so uploads reuse its connection pool.
         Args:
             upload_url: The pre-signed URL from create_feed_document response.
-            feed_content: The actual feed data (e.g., JSON string, XML string).
+            feed_content: The actual feed data (e.g., JSON string, XML string), or a binary file object
+                positioned at the start, which is streamed from disk instead of loaded into memory.
             content_type: The content type of the feed data.
+        Returns:
+            bool: True once the document is uploaded.
+        Raises:
+            AmazonSPAPIError: If the upload fails.
         """
-        # headers = {\"Content-Type\": content_type} # Headers would be used with requests.put
-        # Actual upload logic is not implemented yet.
-        # The original try-except block was for the requests.put call.
-        raise NotImplementedError("Actual feed document upload not implemented.")
+        headers = {"Content-Type": content_type}
+        if isinstance(feed_content, str):
+            feed_content = feed_content.encode("utf-8")
+        try:
+            with _UPLOAD_SECONDS.time():
+                response = self.session.put(upload_url, data=feed_content, headers=headers, timeout=timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as err:
+            raise AmazonSPAPIError(f"Feed document upload failed: {err}") from err
+        return True
 
     def create_feed(self, feed_type: str, feed_document_id: str, marketplace_ids: list):
         """
@@ -130,7 +272,7 @@ class AmazonSPAPIClient:
             feed_document_id: The ID of the uploaded feed document.
             marketplace_ids: A list of marketplace IDs to target.
         Returns:
-            dict: Response containing feedId, or None.
+            dict: Response containing feedId.
         """
         path = "/feeds/2021-06-30/feeds"
         body = {
@@ -138,11 +280,7 @@ class AmazonSPAPIClient:
             "marketplaceIds": marketplace_ids,
             "inputFeedDocumentId": feed_document_id
         }
-        # return self._make_request("POST", path, body=body)
-        print("WARN: create_feed called (not fully implemented).")
-        return { # Mocked response for now
-            "feedId": "feed-id-placeholder-" + str(time.time())
-        }
+        return self._make_request("POST", path, body=body, operation="createFeed")
 
     def get_feed_status(self, feed_id: str):
         """
@@ -150,16 +288,144 @@ class AmazonSPAPIClient:
         Args:
             feed_id: The ID of the feed.
         Returns:
-            dict: Response containing feed status (e.g., PROCESSING, DONE, ERROR), or None.
+            dict: Response containing feed status (IN_QUEUE, IN_PROGRESS, DONE, CANCELLED or FATAL).
         """
         path = f"/feeds/2021-06-30/feeds/{feed_id}"
-        # return self._make_request("GET", path)
-        print("WARN: get_feed_status called (not fully implemented).")
-        return { # Mocked response for now
-            "feedId": feed_id,
-            "processingStatus": "DONE", # or "IN_PROGRESS", "CANCELLED", "FATAL"
-            "resultFeedDocumentId": "result-doc-id-placeholder-" + str(time.time()) if True else None
-        }
+        return self._make_request("GET", path, operation="getFeed")
+
+    def get_feed_document(self, feed_document_id: str):
+        """
+        Gets the download details for a feed document, e.g. a feed's processing report.
+        Args:
+            feed_document_id: The resultFeedDocumentId from get_feed_status.
+        Returns:
+            dict: Response containing feedDocumentId, url and optional compressionAlgorithm.
+        """
+        path = f"/feeds/2021-06-30/documents/{feed_document_id}"
+        return self._make_request("GET", path, operation="getFeedDocument")
+
+    def download_feed_document(self, url: str, compression_algorithm: str = None, timeout: float = 300.0) -> bytes:
+        """
+        Downloads a feed document (e.g. a processing report) from its pre-signed URL.
+        Like upload_feed_document, this is a plain GET without SP-API signing.
+        Args:
+            url: The pre-signed URL from get_feed_document.
+            compression_algorithm: 'GZIP' if the document is gzip-compressed.
+        Returns:
+            bytes: The (decompressed) document content.
+        """
+        try:
+            response = self.session.get(url, timeout=timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as err:
+            raise AmazonSPAPIError(f"Feed document download failed: {err}") from err
+        content = response.content
+        if compression_algorithm == "GZIP":
+            content = gzip.decompress(content)
+        return content
+
+    # --- Listings Items API Methods ---
+    def patch_listings_item(self, seller_id: str, sku: str, marketplace_ids: list, patches: list,
+                            product_type: str = "PRODUCT", issue_locale: str = None):
+        """
+        Applies JSON Patch operations to one listing (Listings Items API patchListingsItem).
+        Changes are usually live within minutes, without going through the Feeds processing queue.
+        Args:
+            seller_id: Selling partner (merchant) identifier.
+            sku: Seller SKU of the listing.
+            marketplace_ids: Marketplaces the patch applies to.
+            patches: JSON Patch operations, e.g. from feed_builder.offer_patches.
+            product_type: Amazon product type of the listing.
+            issue_locale: Locale for issue messages, e.g. 'en_US'.
+        Returns:
+            dict: Submission response with 'sku', 'status' (ACCEPTED or INVALID), 'submissionId' and 'issues'.
+        """
+        path = f"/listings/2021-08-01/items/{quote(seller_id, safe='')}/{quote(sku, safe='')}"
+        params = {"marketplaceIds": ",".join(marketplace_ids)}
+        if issue_locale:
+            params["issueLocale"] = issue_locale
+        body = {"productType": product_type, "patches": patches}
+        return self._make_request("PATCH", path, params=params, body=body, operation="patchListingsItem")
+
+    def patch_listings_items(self, seller_id: str, marketplace_ids: list, items, max_workers: int = DEFAULT_PATCH_CONCURRENCY):
+        """
+        Sends patchListingsItem for many listings over a bounded thread pool.
+
+        Every worker goes through the shared patchListingsItem token bucket, so max_workers only
+        hides request latency; it never pushes the call rate past the usage plan. A submission
+        Amazon answers with status INVALID (HTTP 200, but nothing was applied) counts as failed.
+        Args:
+            items (iterable): Dicts with 'sku', 'patches' and optional 'product_type'.
+            max_workers: Maximum requests in flight.
+        Returns:
+            list: One dict per item, in input order, with 'sku', 'response' (or None), 'error'
+                (AmazonSPAPIError or None) and 'issues' (the response's issues, if any).
+        """
+        items = list(items)
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+
+        def patch(item):
+            try:
+                response = self.patch_listings_item(seller_id, item["sku"], marketplace_ids, item["patches"],
+                                                    product_type=item.get("product_type") or "PRODUCT")
+            except AmazonSPAPIError as err:
+                return {'sku': item["sku"], 'response': None, 'error': err, 'issues': []}
+            issues = response.get("issues") or []
+            error = None
+            if response.get("status") == "INVALID":
+                details = "; ".join(f"{issue.get('code')}: {issue.get('message')}" for issue in issues)
+                error = AmazonSPAPIError(f"patchListingsItem rejected {item['sku']}: {details or 'no issues given'}",
+                                         status_code=200, response_text=json.dumps(response))
+            return {'sku': item["sku"], 'response': response, 'error': error, 'issues': issues}
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, max(1, len(items)))) as executor:
+            return list(executor.map(patch, items))
+
+    def update_offers(self, seller_id: str, marketplace_id: str, updates, feed_threshold: int = DEFAULT_PATCH_FEED_THRESHOLD,
+                      max_workers: int = DEFAULT_PATCH_CONCURRENCY, currency: str = "USD", conn=None):
+        """
+        Pushes price/quantity changes by whichever path is faster for the batch size.
+
+        Up to feed_threshold updates are sent as concurrent patchListingsItem calls, which take
+        effect within minutes; larger batches are written to JSON_LISTINGS_FEED documents of PATCH
+        messages and submitted through the Feeds API.
+        Args:
+            updates (iterable): Dicts with 'sku' and 'price' and/or 'quantity' (optional 'product_type').
+            feed_threshold: Largest batch sent through patchListingsItem.
+            max_workers: Concurrency of the patch path.
+            currency: Currency of the prices.
+            conn (sqlite3.Connection): Catalog database; feeds submitted on the feed path are
+                recorded in its feeds table so FeedStatusPoller tracks them. Required for that path.
+        Returns:
+            dict: {'mode': 'patch', 'results': [...]} as from patch_listings_items (check each
+                result's 'error', INVALID submissions included), or {'mode': 'feed', 'feeds': [...]}
+                with one submission per feed document.
+        """
+        messages = []
+        for update in updates:
+            message = patch_listing_message(update, marketplace_id, currency=currency)
+            if message is not None:
+                messages.append(message)
+
+        if len(messages) <= feed_threshold:
+            items = [{"sku": m["sku"], "patches": m["patches"], "product_type": m["productType"]} for m in messages]
+            return {'mode': 'patch', 'results': self.patch_listings_items(seller_id, [marketplace_id], items,
+                                                                          max_workers=max_workers)}
+
+        if conn is None:
+            raise ValueError(f"{len(messages)} updates go through the Feeds API; pass conn so the feeds are tracked")
+        # Messages are already built; the builder only serialises and splits them. Rows carry a
+        # content_hash for FeedDocument.pushed, which is meaningless for ad-hoc updates.
+        builder = ListingsFeedBuilder(seller_id, marketplace_id, message_builder=lambda row: dict(row["message"]))
+        rows = ({"sku": message["sku"], "content_hash": None, "message": message} for message in messages)
+        feeds = []
+        for document in builder.iter_documents(rows):
+            submission = submit_feed_document(self, document, [marketplace_id])
+            record_feed_submission(conn, submission["feedId"], JSON_LISTINGS_FEED, submission["feedDocumentId"],
+                                   [marketplace_id], submission["message_count"])
+            feeds.append(submission)
+        return {'mode': 'feed', 'feeds': feeds}
 
 # Example usage (for outlining and testing structure)
 if __name__ == "__main__":
@@ -180,7 +446,7 @@ if __name__ == "__main__":
     else:
         try:
             client = AmazonSPAPIClient()
-            print("AmazonSPAPIClient initialized (structure only).")
+            print("AmazonSPAPIClient initialized.")
 
             # --- This is a conceptual flow for using the Feeds API ---
             # 1. Create Feed Document Specification
@@ -192,6 +458,8 @@ if __name__ == "__main__":
 
             #     # 2. Prepare and Upload Feed Content (Example: Simple JSON product feed)
             #     # This content needs to match Amazon's expected format for the chosen feed_type.
+            #     # For a whole catalog use feed_builder.push_dirty_products, which streams dirty rows into
+            #     # spooled feed documents split at the SP-API size/message limits.
             #     sample_feed_content = json.dumps({
             #         "header": {"sellerId": "YOUR_SELLER_ID", "version": "2.0"},
             #         "messages": [
@@ -221,6 +489,7 @@ if __name__ == "__main__":
             #         #     feed_id = feed_submission['feedId']
 
             #         #     # 4. Get Feed Status (poll until done)
+            #         #     # (feed_poller.FeedStatusPoller polls many feeds at once with per-feed backoff)
             #         #     status = "IN_PROGRESS"
             #         #     while status not in ["DONE", "CANCELLED", "FATAL"]:
             #         #         time.sleep(30) # Wait before polling
@@ -0,0 +1,163 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from .database import DB_FILENAME, PERFORMANCE_PROFILE, initialize_db, open_reader
+
+_STOP = object()
+
+
+class CatalogDB:
+    """
+    Single-writer / many-reader access to catalog.db.
+
+    SQLite allows one writer at a time, so every write goes through a queue served by one
+    dedicated writer thread that owns the only read-write connection. Readers borrow one of a
+    fixed set of read-only connections; with WAL they read the last committed snapshot and
+    never wait for the bulk writer. When the writer is idle it runs periodic maintenance:
+    a passive wal_checkpoint so the WAL file does not grow without bound, and PRAGMA optimize
+    (which runs ANALYZE where the query planner's statistics are stale).
+
+    Usage:
+        with CatalogDB("catalog.db") as db:
+            db.write(database.upsert_products, products)  # runs on the writer thread
+            with db.reader() as conn:
+                conn.execute("SELECT COUNT(*) FROM products").fetchone()
+    """
+
+    def __init__(self, db_path: str = DB_FILENAME, profile: dict = None, readers: int = 4,
+                 checkpoint_interval: float = 30.0, optimize_interval: float = 3600.0,
+                 raw_data_encoding: str = None):
+        """
+        Args:
+            db_path (str): Database file; in-memory databases cannot be shared and are not supported.
+            profile (dict, optional): PRAGMA profile for all connections, PERFORMANCE_PROFILE by default.
+            readers (int): Number of read-only connections in the pool.
+            checkpoint_interval (float): Seconds between WAL checkpoints.
+            optimize_interval (float): Seconds between PRAGMA optimize runs.
+            raw_data_encoding (str, optional): Passed to initialize_db for the writer connection.
+        """
+        if db_path == ":memory:":
+            raise ValueError("CatalogDB needs a database file; ':memory:' cannot be shared between connections")
+        self.db_path = db_path
+        self.profile = PERFORMANCE_PROFILE if profile is None else profile
+        self.checkpoint_interval = checkpoint_interval
+        self.optimize_interval = optimize_interval
+
+        self._jobs = queue.Queue()
+        self._ready = Future()
+        self._writer_thread = threading.Thread(
+            target=self._run_writer, args=(raw_data_encoding,), name="catalog-db-writer", daemon=True
+        )
+        self._writer_thread.start()
+        self._ready.result() # Propagate schema/open errors from the writer thread
+
+        self._readers = queue.Queue()
+        self._reader_connections = [open_reader(db_path, self.profile) for _ in range(readers)]
+        for conn in self._reader_connections:
+            self._readers.put(conn)
+        self._closed = False
+
+    # --- Writer side ---
+
+    def _run_writer(self, raw_data_encoding):
+        try:
+            conn = initialize_db(self.db_path, raw_data_encoding=raw_data_encoding, profile=self.profile)
+        except Exception as err:
+            self._ready.set_exception(err)
+            return
+        self._ready.set_result(True)
+
+        now = time.monotonic()
+        next_checkpoint = now + self.checkpoint_interval
+        next_optimize = now + self.optimize_interval
+        try:
+            while True:
+                timeout = max(0.0, min(next_checkpoint, next_optimize) - time.monotonic())
+                try:
+                    job = self._jobs.get(timeout=timeout)
+                except queue.Empty:
+                    job = None
+
+                if job is _STOP:
+                    break
+                if job is not None:
+                    future, fn, args, kwargs = job
+                    if future.set_running_or_notify_cancel():
+                        try:
+                            future.set_result(fn(conn, *args, **kwargs))
+                        except BaseException as err:
+                            if conn.in_transaction:
+                                conn.rollback()
+                            future.set_exception(err)
+                    if not self._jobs.empty():
+                        continue # Maintenance waits until the queue drains
+
+                now = time.monotonic()
+                if now >= next_checkpoint:
+                    conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+                    next_checkpoint = now + self.checkpoint_interval
+                if now >= next_optimize:
+                    conn.execute("PRAGMA optimize")
+                    next_optimize = now + self.optimize_interval
+        finally:
+            try:
+                conn.execute("PRAGMA optimize")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                conn.close()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """
+        Queue fn(conn, *args, **kwargs) to run on the writer connection.
+
+        Jobs run one at a time in submission order; fn should use `with conn:` (as the
+        database helpers do) so each job commits its own transaction.
+        """
+        if self._closed:
+            raise RuntimeError("CatalogDB is closed")
+        future = Future()
+        self._jobs.put((future, fn, args, kwargs))
+        return future
+
+    def write(self, fn, *args, **kwargs):
+        """Run fn on the writer connection and wait for its result."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    # --- Reader side ---
+
+    @contextmanager
+    def reader(self, timeout: float = None):
+        """Borrow a read-only connection; blocks if every reader is in use."""
+        conn = self._readers.get(timeout=timeout)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    def read(self, fn, *args, **kwargs):
+        """Run fn(conn, *args, **kwargs) on a pooled reader connection."""
+        with self.reader() as conn:
+            return fn(conn, *args, **kwargs)
+
+    # --- Lifecycle ---
+
+    def close(self):
+        """Finish queued writes, checkpoint the WAL and close every connection."""
+        if self._closed:
+            return
+        self._closed = True
+        self._jobs.put(_STOP)
+        self._writer_thread.join()
+        for conn in self._reader_connections:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
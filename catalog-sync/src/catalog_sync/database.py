@@ -2,9 +2,23 @@ import sqlite3
 from sqlite3 import Connection
 from pathlib import Path
 import json # Added for storing raw_shopify_data
+import hashlib
+from itertools import islice
+from typing import Iterable
+
+from . import raw_data_codec
+from .metrics import REGISTRY
 
 DB_FILENAME = "catalog.db"
 
+DEFAULT_BATCH_SIZE = 500
+# Stay well below SQLITE_MAX_VARIABLE_NUMBER (999 on older SQLite builds)
+_MAX_SQL_PARAMS = 900
+
+_WRITE_SECONDS = REGISTRY.histogram("db_write_seconds", "Duration of write transactions, including the commit",
+                                    ("operation",))
+_ROWS_WRITTEN = REGISTRY.counter("db_rows_total", "Rows passed to upserts, by table and outcome", ("table", "outcome"))
+
 SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS products (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -15,46 +29,430 @@ CREATE TABLE IF NOT EXISTS products (
     price REAL,
     quantity INTEGER,
     main_image_url TEXT,
-    raw_shopify_data TEXT -- Storing the full JSON from Shopify for this product
+    raw_shopify_data TEXT, -- Full Shopify JSON: TEXT, or a zlib BLOB when raw_data_encoding is 'zlib'
+    content_hash TEXT, -- Fingerprint of the Amazon-relevant fields, see product_content_hash()
+    needs_push INTEGER NOT NULL DEFAULT 1 -- 1 until the current content has been pushed to Amazon
 );
 CREATE INDEX IF NOT EXISTS idx_products_shopify_product_id ON products(shopify_product_id);
 CREATE INDEX IF NOT EXISTS idx_products_sku ON products(sku); -- SKU is already UNIQUE, but index can help lookups if not PK
+
+CREATE TABLE IF NOT EXISTS variants (
+    sku TEXT PRIMARY KEY, -- Variant SKU is the Amazon seller SKU
+    shopify_variant_id TEXT,
+    shopify_product_id TEXT NOT NULL, -- Parent row in products is keyed by shopify_product_id
+    inventory_item_id TEXT, -- inventory_levels/update payloads only carry this id
+    title TEXT,
+    price REAL,
+    compare_at_price REAL,
+    barcode TEXT,
+    quantity INTEGER,
+    position INTEGER,
+    needs_push INTEGER NOT NULL DEFAULT 1, -- 1 until the current price/quantity has been pushed to Amazon
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_variants_shopify_product_id ON variants(shopify_product_id);
+CREATE INDEX IF NOT EXISTS idx_variants_inventory_item_id ON variants(inventory_item_id);
+CREATE INDEX IF NOT EXISTS idx_variants_needs_push ON variants(sku) WHERE needs_push = 1;
+
+CREATE TABLE IF NOT EXISTS inventory_levels (
+    inventory_item_id TEXT NOT NULL,
+    location_id TEXT NOT NULL,
+    available INTEGER, -- NULL when the item is not stocked/tracked at the location
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (inventory_item_id, location_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS db_settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS raw_data_dictionaries (
+    digest TEXT PRIMARY KEY, -- Content address, embedded in every BLOB compressed with this dictionary
+    dictionary BLOB NOT NULL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    store_id TEXT PRIMARY KEY, -- Shopify store URL
+    last_synced_at TEXT, -- UTC ISO 8601 watermark, used as updated_at_min for the next incremental sync
+    resume_page_info TEXT, -- Cursor of the next page of an interrupted pipelined sync
+    resume_newest_updated_at TEXT, -- Newest updated_at committed by that interrupted sync
+    resume_started_at TEXT, -- Watermark ceiling of that sync (its start time), kept across resumes
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS feeds (
+    feed_id TEXT PRIMARY KEY, -- SP-API feedId
+    feed_type TEXT NOT NULL,
+    feed_document_id TEXT,
+    marketplace_ids TEXT, -- JSON list
+    message_count INTEGER,
+    status TEXT NOT NULL DEFAULT 'IN_QUEUE', -- SP-API processingStatus
+    result_document_id TEXT,
+    result_fetched INTEGER NOT NULL DEFAULT 0, -- 1 once the processing report has been downloaded
+    result_summary TEXT, -- JSON summary of the processing report
+    poll_count INTEGER NOT NULL DEFAULT 0,
+    poll_interval REAL, -- Current backoff in seconds
+    next_poll_at REAL NOT NULL DEFAULT 0, -- Unix time the feed is due to be polled
+    submitted_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_feeds_pending ON feeds(next_poll_at) WHERE result_fetched = 0;
+
+CREATE TABLE IF NOT EXISTS feed_items (
+    feed_id TEXT NOT NULL, -- Submitted feed that has not been settled yet (see settle_feed_items)
+    message_id INTEGER NOT NULL, -- messageId inside the feed document; processing report issues refer to it
+    sku TEXT NOT NULL,
+    content_hash TEXT, -- products.content_hash that the message was built from
+    PRIMARY KEY (feed_id, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_feed_items_sku ON feed_items(sku);
+
+CREATE TABLE IF NOT EXISTS amazon_listings (
+    sku TEXT PRIMARY KEY, -- Seller SKU, matched against products.sku
+    asin TEXT,
+    status TEXT, -- From the merchant listings report, e.g. 'Active', 'Inactive', 'Incomplete'
+    price REAL,
+    quantity INTEGER,
+    last_pushed_hash TEXT, -- products.content_hash of the last feed that carried this SKU
+    pushed_at TEXT,
+    listed_at TEXT, -- open-date from the report
+    seen_at TEXT, -- Load time of the last report that contained the SKU; NULL if only pushed so far
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+) WITHOUT ROWID;
 """
 
+# Columns added after the initial schema; applied with ALTER TABLE to databases created before them
+COLUMN_MIGRATIONS = {
+    'products': [
+        ("content_hash", "TEXT"),
+        ("needs_push", "INTEGER NOT NULL DEFAULT 1"),
+    ],
+    'sync_state': [
+        ("resume_page_info", "TEXT"),
+        ("resume_newest_updated_at", "TEXT"),
+        ("resume_started_at", "TEXT"),
+    ],
+}
+
+# Indexes that depend on migrated columns, so they are created after COLUMN_MIGRATIONS run
+POST_MIGRATION_SQL = """
+CREATE INDEX IF NOT EXISTS idx_products_needs_push ON products(sku) WHERE needs_push = 1;
+"""
+
+# Fields that end up in an Amazon listing; changes to anything else in the Shopify payload
+# (updated_at, admin_graphql_api_id, ...) do not make a product dirty
+CONTENT_HASH_FIELDS = ('id', 'sku', 'title', 'body_html', 'price', 'inventory_quantity', 'main_image_url')
+
+
+def _apply_column_migrations(conn: Connection):
+    for table, columns in COLUMN_MIGRATIONS.items():
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name, definition in columns:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
 
-def initialize_db(db_path: str = DB_FILENAME) -> Connection:
-    """Initialize the SQLite database and return the connection."""
+class CatalogConnection(sqlite3.Connection):
+    """sqlite3 connection that carries the raw_shopify_data codec and hash fields configured for its database."""
+
+    raw_data_codec = raw_data_codec.JsonCodec()
+    content_hash_raw_fields = ()
+
+
+# PRAGMAs applied to every connection opened by initialize_db (journal_mode must come first).
+# WAL lets readers run alongside the single writer; synchronous=NORMAL is durable in WAL mode
+# except for the last transactions before a power loss, which the next sync rewrites anyway.
+PERFORMANCE_PROFILE = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000, # ms to wait on a lock instead of failing with "database is locked"
+    'cache_size': -65536, # Negative values are KiB: 64 MiB page cache
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# sqlite3 defaults (rollback journal, synchronous=FULL); the behaviour before profiles existed
+LEGACY_PROFILE = {}
+
+# PRAGMAs that are per-database rather than per-connection, and so only set by the writer
+_DATABASE_PRAGMAS = ('journal_mode',)
+
+
+def apply_profile(conn: Connection, profile: dict, read_only: bool = False):
+    """Apply a PRAGMA profile to a connection; read_only connections skip database-wide settings."""
+    for name, value in profile.items():
+        if read_only and name in _DATABASE_PRAGMAS:
+            continue
+        conn.execute(f"PRAGMA {name} = {value}")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+
+
+def initialize_db(db_path: str = DB_FILENAME, raw_data_encoding: str = None, profile: dict = None,
+                  check_same_thread: bool = True) -> Connection:
+    """
+    Initialize the SQLite database and return the connection.
+
+    Args:
+        db_path (str): Database file.
+        raw_data_encoding (str, optional): 'json' or 'zlib'. Persisted in db_settings, so it only needs
+            to be passed once; existing rows keep their encoding until migrate_raw_data_encoding runs.
+        profile (dict, optional): PRAGMA profile, PERFORMANCE_PROFILE by default. Pass LEGACY_PROFILE
+            for sqlite3's defaults.
+        check_same_thread (bool): Passed to sqlite3.connect; False lets a connection manager
+            hand the connection to a dedicated thread.
+    """
     path = Path(db_path)
     # Ensure the parent directory exists if db_path includes directories
     path.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(path)
+    conn = sqlite3.connect(path, factory=CatalogConnection, check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row # Access columns by name
+    apply_profile(conn, PERFORMANCE_PROFILE if profile is None else profile)
     with conn:
         conn.executescript(SCHEMA_SQL)
+        _apply_column_migrations(conn)
+        conn.executescript(POST_MIGRATION_SQL)
+    if raw_data_encoding is not None:
+        set_raw_data_encoding(conn, raw_data_encoding)
+    else:
+        _load_raw_data_codec(conn)
+    _load_content_hash_raw_fields(conn)
     return conn
 
-def upsert_product(conn: Connection, product_data: dict):
+
+def open_reader(db_path: str = DB_FILENAME, profile: dict = None) -> Connection:
     """
-    Insert or update a product in the database based on SKU.
-    product_data is expected to be a dict similar to what _parse_product_data from shopify_client returns.
+    Open a read-only connection to an existing database.
+
+    In WAL mode a reader sees the last committed snapshot and never blocks, or is blocked by, the writer.
+    """
+    uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, factory=CatalogConnection, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    apply_profile(conn, PERFORMANCE_PROFILE if profile is None else profile, read_only=True)
+    _load_raw_data_codec(conn)
+    _load_content_hash_raw_fields(conn)
+    return conn
+
+
+def get_setting(conn: Connection, key: str, default=None):
+    row = conn.execute("SELECT value FROM db_settings WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def _set_setting(conn: Connection, key: str, value):
+    conn.execute(
+        "INSERT INTO db_settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, value),
+    )
+
+
+_dictionary_cache = {}
+
+
+def _load_dictionary(conn: Connection, digest: str) -> bytes:
+    """Fetch a preset dictionary by digest; dictionaries are immutable so they are cached process-wide."""
+    dictionary = _dictionary_cache.get(digest)
+    if dictionary is None:
+        row = conn.execute("SELECT dictionary FROM raw_data_dictionaries WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            raise LookupError(f"raw_shopify_data dictionary {digest} is missing from raw_data_dictionaries")
+        dictionary = _dictionary_cache[digest] = bytes(row[0])
+    return dictionary
+
+
+def _load_raw_data_codec(conn: Connection):
+    """Attach the codec stored in db_settings to conn (only possible on a CatalogConnection)."""
+    encoding = get_setting(conn, 'raw_data_encoding', 'json')
+    if encoding == 'zlib':
+        digest = get_setting(conn, 'raw_data_dictionary')
+        codec = raw_data_codec.ZlibCodec(dictionary=_load_dictionary(conn, digest) if digest else None)
+    else:
+        codec = raw_data_codec.JsonCodec()
+    if isinstance(conn, CatalogConnection):
+        conn.raw_data_codec = codec
+    return codec
+
+
+def _raw_data_codec(conn: Connection):
+    # Plain sqlite3 connections (not opened through initialize_db) keep writing JSON text
+    return getattr(conn, 'raw_data_codec', None) or raw_data_codec.JsonCodec()
+
+
+def _load_content_hash_raw_fields(conn: Connection):
+    """Attach the raw_shopify_data paths stored in db_settings to conn (only possible on a CatalogConnection)."""
+    fields = tuple(json.loads(get_setting(conn, 'content_hash_raw_fields') or '[]'))
+    if isinstance(conn, CatalogConnection):
+        conn.content_hash_raw_fields = fields
+    return fields
+
+
+def _content_hash_raw_fields(conn: Connection):
+    return getattr(conn, 'content_hash_raw_fields', None) or ()
+
+
+def register_content_hash_raw_fields(conn: Connection, fields: Iterable[str]) -> bool:
+    """
+    Add raw_shopify_data paths (e.g. 'vendor', 'options.0.name') to every product's content hash.
+
+    Mappings with raw.* sources (CompiledMapping.raw_fields) must register them, or a Shopify edit
+    that only touches such a field would leave the fingerprint unchanged and the upsert would skip
+    the row. Persisted in db_settings and picked up by connections opened afterwards; stored
+    products get a new fingerprint, and so one more push, the next time they are synced.
+
+    Returns:
+        bool: True if any path was new.
+    """
+    current = set(_load_content_hash_raw_fields(conn))
+    merged = sorted(current | set(fields))
+    if len(merged) == len(current):
+        return False
+    with conn:
+        _set_setting(conn, 'content_hash_raw_fields', json.dumps(merged))
+    if isinstance(conn, CatalogConnection):
+        conn.content_hash_raw_fields = tuple(merged)
+    return True
+
+
+def set_raw_data_encoding(conn: Connection, encoding: str, dictionary: bytes = None):
+    """
+    Choose how new raw_shopify_data values are written: 'json' (plain text) or 'zlib'.
+
+    Args:
+        dictionary (bytes, optional): zlib preset dictionary (see train_raw_data_dictionary).
+            Stored content-addressed so rows written with an older dictionary stay decodable.
+    """
+    if encoding not in ('json', 'zlib'):
+        raise ValueError(f"Unknown raw_shopify_data encoding: {encoding}")
+    with conn:
+        _set_setting(conn, 'raw_data_encoding', encoding)
+        if dictionary:
+            digest = raw_data_codec.dictionary_digest(dictionary)
+            conn.execute("INSERT OR IGNORE INTO raw_data_dictionaries (digest, dictionary) VALUES (?, ?)",
+                         (digest, dictionary))
+            _dictionary_cache[digest] = dictionary
+            _set_setting(conn, 'raw_data_dictionary', digest)
+        elif encoding == 'json':
+            _set_setting(conn, 'raw_data_dictionary', None)
+    return _load_raw_data_codec(conn)
+
+
+def decode_raw_shopify_data(conn: Connection, value):
+    """Decode a raw_shopify_data column value (plain JSON or zlib, with or without a dictionary)."""
+    return raw_data_codec.decode(value, lambda digest: _load_dictionary(conn, digest))
+
+
+def get_product_raw_data(conn: Connection, sku: str):
+    """Return the decoded Shopify payload stored for a SKU, or None."""
+    row = conn.execute("SELECT raw_shopify_data FROM products WHERE sku = ?", (sku,)).fetchone()
+    return decode_raw_shopify_data(conn, row[0]) if row else None
+
+
+def train_raw_data_dictionary(conn: Connection, sample_size: int = 2000,
+                              dictionary_size: int = raw_data_codec.MAX_DICTIONARY_SIZE) -> bytes:
     """
-    sql = """
-    INSERT INTO products (shopify_product_id, sku, title, description, price, quantity, main_image_url, raw_shopify_data)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ON CONFLICT(sku) DO UPDATE SET
-        shopify_product_id = excluded.shopify_product_id,
-        title = excluded.title,
-        description = excluded.description,
-        price = excluded.price,
-        quantity = excluded.quantity,
-        main_image_url = excluded.main_image_url,
-        raw_shopify_data = excluded.raw_shopify_data;
-    """
-    
-    # Ensure raw_shopify_data is stored as a JSON string
-    raw_data_json = json.dumps(product_data.get('raw_shopify_data'))
-
-    params = (
+    Train a zlib preset dictionary on a random sample of stored products and switch new writes to it.
+
+    Small JSON documents compress poorly on their own because every row repeats the same keys;
+    a shared dictionary lets each row reference them instead.
+
+    Returns:
+        bytes: The trained dictionary (empty if there were not enough rows to learn from).
+    """
+    rows = conn.execute(
+        "SELECT raw_shopify_data FROM products WHERE raw_shopify_data IS NOT NULL ORDER BY RANDOM() LIMIT ?",
+        (sample_size,),
+    ).fetchall()
+    samples = [json.dumps(decode_raw_shopify_data(conn, row[0]), separators=(',', ':')) for row in rows]
+    dictionary = raw_data_codec.train_dictionary(samples, dictionary_size)
+    set_raw_data_encoding(conn, 'zlib', dictionary or None)
+    return dictionary
+
+
+def migrate_raw_data_encoding(conn: Connection, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Re-encode existing raw_shopify_data values with the connection's current codec.
+
+    Rows are rewritten in rowid order, one transaction per batch, so the migration can be
+    interrupted and rerun. Run VACUUM afterwards to hand the freed pages back to the filesystem.
+
+    Returns:
+        int: Number of rows rewritten.
+    """
+    codec = _raw_data_codec(conn)
+    rewritten = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, raw_shopify_data FROM products WHERE id > ? AND raw_shopify_data IS NOT NULL ORDER BY id LIMIT ?",
+            (last_id, batch_size),
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = []
+        for row_id, value in rows:
+            encoded = codec.encode(decode_raw_shopify_data(conn, value))
+            if encoded != value:
+                updates.append((encoded, row_id))
+        if updates:
+            with conn:
+                conn.executemany("UPDATE products SET raw_shopify_data = ? WHERE id = ?", updates)
+            rewritten += len(updates)
+    return rewritten
+
+
+def product_content_hash(product_data: dict, raw_fields: Iterable[str] = ()) -> str:
+    """
+    Return a stable fingerprint of the Amazon-relevant fields of a parsed product.
+
+    Prices are normalised to two decimals so that "19.9", "19.90" and 19.9 hash the same.
+
+    Args:
+        raw_fields: Dotted paths into raw_shopify_data that a mapping reads as raw.* sources,
+            see register_content_hash_raw_fields.
+    """
+    values = []
+    for field in CONTENT_HASH_FIELDS:
+        value = product_data.get(field)
+        if field == 'price' and value is not None:
+            value = f"{float(value):.2f}"
+        values.append(value)
+    for path in raw_fields:
+        value = product_data.get('raw_shopify_data')
+        for key in path.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        values.append(value)
+    encoded = json.dumps(values, separators=(',', ':'), default=str).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+UPSERT_PRODUCT_SQL = """
+INSERT INTO products (shopify_product_id, sku, title, description, price, quantity, main_image_url, raw_shopify_data,
+                      content_hash, needs_push)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+ON CONFLICT(sku) DO UPDATE SET
+    shopify_product_id = excluded.shopify_product_id,
+    title = excluded.title,
+    description = excluded.description,
+    price = excluded.price,
+    quantity = excluded.quantity,
+    main_image_url = excluded.main_image_url,
+    raw_shopify_data = excluded.raw_shopify_data,
+    content_hash = excluded.content_hash,
+    needs_push = 1
+-- Same fingerprint means nothing Amazon cares about changed: skip the write and leave needs_push alone
+WHERE products.content_hash IS NOT excluded.content_hash;
+"""
+
+
+def _product_params(product_data: dict, codec=None, raw_fields=()) -> tuple:
+    """Map a parsed Shopify product dict onto the column order used by UPSERT_PRODUCT_SQL."""
+    # raw_shopify_data is stored as JSON text, or compressed when the database uses the zlib codec
+    raw_data_json = (codec or raw_data_codec.JsonCodec()).encode(product_data.get('raw_shopify_data'))
+
+    return (
         product_data.get('id'), # This is shopify_product_id from the parser
         product_data.get('sku'),
         product_data.get('title'),
@@ -62,12 +460,521 @@ def upsert_product(conn: Connection, product_data: dict):
         product_data.get('price'),
         product_data.get('inventory_quantity'), # Mapped to quantity
         product_data.get('main_image_url'),
-        raw_data_json
+        raw_data_json,
+        product_content_hash(product_data, raw_fields)
     )
-    
+
+
+def upsert_product(conn: Connection, product_data: dict) -> bool:
+    """
+    Insert or update a product in the database based on SKU.
+    product_data is expected to be a dict similar to what _parse_product_data from shopify_client returns.
+
+    Returns:
+        bool: True if the row was inserted or changed, False if the content hash matched the stored row.
+    """
+    changes_before = conn.total_changes
+    with conn:
+        conn.execute(UPSERT_PRODUCT_SQL, _product_params(product_data, _raw_data_codec(conn),
+                                                         _content_hash_raw_fields(conn)))
+    # total_changes is cumulative for the connection, so compare against the value before this call
+    return conn.total_changes > changes_before
+
+
+def _existing_skus(conn: Connection, skus: list, table: str = 'products') -> set:
+    """Return the subset of skus that already have a row in table."""
+    found = set()
+    for start in range(0, len(skus), _MAX_SQL_PARAMS):
+        chunk = skus[start:start + _MAX_SQL_PARAMS]
+        placeholders = ",".join("?" * len(chunk))
+        cursor = conn.execute(f"SELECT sku FROM {table} WHERE sku IN ({placeholders})", chunk)
+        found.update(row[0] for row in cursor)
+    return found
+
+
+def _write_rows(conn: Connection, table: str, sql: str, rows: list, sku_index: int) -> tuple:
+    """
+    executemany an upsert inside the caller's transaction and classify what happened.
+
+    Returns:
+        tuple: (inserted, updated) row counts; rows neither inserted nor updated were unchanged.
+    """
+    seen = _existing_skus(conn, list({row[sku_index] for row in rows}), table)
+    inserted = 0
+    for row in rows:
+        if row[sku_index] not in seen:
+            inserted += 1
+            seen.add(row[sku_index])
+    changes_before = conn.total_changes
+    conn.executemany(sql, rows)
+    updated = conn.total_changes - changes_before - inserted
+    _ROWS_WRITTEN.inc(inserted, table=table, outcome='inserted')
+    _ROWS_WRITTEN.inc(updated, table=table, outcome='updated')
+    _ROWS_WRITTEN.inc(len(rows) - inserted - updated, table=table, outcome='unchanged')
+    return inserted, updated
+
+
+def upsert_products(conn: Connection, products: Iterable[dict], batch_size: int = DEFAULT_BATCH_SIZE,
+                    with_variants: bool = False) -> list:
+    """
+    Bulk insert or update products, committing once per batch instead of once per product.
+
+    products can be any iterable (e.g. a generator of parsed products from ShopifyAPIClient);
+    it is consumed lazily, so only one batch is held in memory at a time.
+    Products without a SKU cannot be keyed and are counted as skipped.
+
+    Args:
+        conn: Open database connection.
+        products: Iterable of dicts shaped like ShopifyAPIClient._parse_product_data output.
+        batch_size (int): Number of products written per executemany/transaction.
+        with_variants (bool): Also write every variant of each product to the variants table,
+            in the same transaction as its product batch.
+
+    Returns:
+        list: One dict per committed batch with 'inserted', 'updated', 'unchanged' and 'skipped' counts
+            (for products; variant counts are under 'variants' when with_variants is set).
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    codec = _raw_data_codec(conn)
+    raw_fields = _content_hash_raw_fields(conn)
+    results = []
+    iterator = iter(products)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            break
+
+        rows = [_product_params(p, codec, raw_fields) for p in batch if p.get('sku')]
+        with _WRITE_SECONDS.time(operation='upsert_products'), conn:
+            inserted, updated = _write_rows(conn, 'products', UPSERT_PRODUCT_SQL, rows, 1)
+            if with_variants:
+                variant_rows = [row for p in batch for row in _variant_rows(p)]
+                variants_inserted, variants_updated = _write_rows(conn, 'variants', UPSERT_VARIANT_SQL, variant_rows, 0)
+
+        result = {
+            'inserted': inserted,
+            'updated': updated,
+            'unchanged': len(rows) - inserted - updated,
+            'skipped': len(batch) - len(rows),
+        }
+        if with_variants:
+            result['variants'] = {
+                'inserted': variants_inserted,
+                'updated': variants_updated,
+                'unchanged': len(variant_rows) - variants_inserted - variants_updated,
+            }
+        results.append(result)
+    return results
+
+
+UPSERT_VARIANT_SQL = """
+INSERT INTO variants (sku, shopify_variant_id, shopify_product_id, inventory_item_id, title, price,
+                      compare_at_price, barcode, quantity, position, needs_push, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, CURRENT_TIMESTAMP)
+ON CONFLICT(sku) DO UPDATE SET
+    shopify_variant_id = excluded.shopify_variant_id,
+    shopify_product_id = excluded.shopify_product_id,
+    inventory_item_id = excluded.inventory_item_id,
+    title = excluded.title,
+    price = excluded.price,
+    compare_at_price = excluded.compare_at_price,
+    barcode = excluded.barcode,
+    quantity = excluded.quantity,
+    position = excluded.position,
+    needs_push = 1,
+    updated_at = excluded.updated_at
+WHERE variants.shopify_variant_id IS NOT excluded.shopify_variant_id
+    OR variants.shopify_product_id IS NOT excluded.shopify_product_id
+    OR variants.inventory_item_id IS NOT excluded.inventory_item_id
+    OR variants.title IS NOT excluded.title
+    OR variants.price IS NOT excluded.price
+    OR variants.compare_at_price IS NOT excluded.compare_at_price
+    OR variants.barcode IS NOT excluded.barcode
+    OR variants.quantity IS NOT excluded.quantity
+    OR variants.position IS NOT excluded.position;
+"""
+
+
+def _optional_str(value):
+    return None if value is None else str(value)
+
+
+def _variant_rows(product_data: dict) -> list:
+    """Rows for UPSERT_VARIANT_SQL from the raw Shopify variants of a parsed product; SKU-less variants are dropped."""
+    product_id = _optional_str(product_data.get('id'))
+    rows = []
+    for variant in product_data.get('variants') or []:
+        if not variant.get('sku'):
+            continue
+        rows.append((
+            variant['sku'],
+            _optional_str(variant.get('id')),
+            _optional_str(variant.get('product_id')) or product_id,
+            _optional_str(variant.get('inventory_item_id')),
+            variant.get('title'),
+            variant.get('price'),
+            variant.get('compare_at_price'),
+            variant.get('barcode'),
+            variant.get('inventory_quantity'),
+            variant.get('position'),
+        ))
+    return rows
+
+
+def upsert_variants(conn: Connection, products: Iterable[dict], batch_size: int = DEFAULT_BATCH_SIZE) -> list:
+    """
+    Bulk write the variants of parsed products, one transaction per batch of products.
+
+    Returns:
+        list: One dict per committed batch with 'inserted', 'updated' and 'unchanged' variant counts.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    results = []
+    iterator = iter(products)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            break
+        rows = [row for p in batch for row in _variant_rows(p)]
+        with _WRITE_SECONDS.time(operation='upsert_variants'), conn:
+            inserted, updated = _write_rows(conn, 'variants', UPSERT_VARIANT_SQL, rows, 0)
+        results.append({'inserted': inserted, 'updated': updated, 'unchanged': len(rows) - inserted - updated})
+    return results
+
+
+def apply_variant_deltas(conn: Connection, deltas: Iterable[dict]) -> int:
+    """
+    Apply price and/or inventory changes to individual variant rows in one transaction.
+
+    Only the touched variant columns change; the parent products row and its
+    raw_shopify_data blob are left alone. Rows whose values already match are not rewritten.
+
+    Args:
+        deltas: Iterable of dicts with 'sku' and any of 'price' and 'quantity'.
+
+    Returns:
+        int: Number of variant rows that changed.
+    """
+    params = [(d.get('price'), d.get('quantity'), d['sku']) for d in deltas]
+    changes_before = conn.total_changes
+    with _WRITE_SECONDS.time(operation='apply_variant_deltas'), conn:
+        conn.executemany(
+            """
+            UPDATE variants SET
+                price = COALESCE(?1, price),
+                quantity = COALESCE(?2, quantity),
+                needs_push = 1,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE sku = ?3
+                AND (price IS NOT COALESCE(?1, price) OR quantity IS NOT COALESCE(?2, quantity))
+            """,
+            params,
+        )
+    return conn.total_changes - changes_before
+
+
+def get_variant_by_sku(conn: Connection, sku: str):
+    """Return the variants row for a SKU, or None."""
+    return conn.execute("SELECT * FROM variants WHERE sku = ?", (sku,)).fetchone()
+
+
+def get_variants_for_product(conn: Connection, shopify_product_id) -> list:
+    """Return all variant rows of a Shopify product, in Shopify's position order."""
+    return conn.execute(
+        "SELECT * FROM variants WHERE shopify_product_id = ? ORDER BY position, sku",
+        (_optional_str(shopify_product_id),),
+    ).fetchall()
+
+
+def apply_inventory_levels(conn: Connection, levels: Iterable[dict], replace: bool = False) -> int:
+    """
+    Store per-location inventory levels and set each affected variant's quantity to its total.
+
+    Shopify reports inventory per (inventory item, location), while variants carry a single
+    quantity: the sum of the item's levels over every location known here.
+
+    Args:
+        levels: Dicts with 'inventory_item_id', 'location_id' and 'available', e.g.
+            inventory_levels/update payloads or ShopifyAPIClient.get_inventory_levels results.
+        replace (bool): The levels are complete for their items (a fresh fetch), so stored
+            locations of those items that are not among them are dropped.
+
+    Returns:
+        int: Number of variant rows whose quantity changed.
+    """
+    rows = [(str(level['inventory_item_id']), str(level['location_id']), level.get('available')) for level in levels]
+    item_ids = sorted({row[0] for row in rows})
+    with _WRITE_SECONDS.time(operation='apply_inventory_levels'), conn:
+        if replace:
+            conn.executemany("DELETE FROM inventory_levels WHERE inventory_item_id = ?", [(item_id,) for item_id in item_ids])
+        conn.executemany(
+            """
+            INSERT INTO inventory_levels (inventory_item_id, location_id, available) VALUES (?, ?, ?)
+            ON CONFLICT(inventory_item_id, location_id) DO UPDATE SET
+                available = excluded.available,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            rows,
+        )
+    totals = []
+    for start in range(0, len(item_ids), _MAX_SQL_PARAMS):
+        chunk = item_ids[start:start + _MAX_SQL_PARAMS]
+        placeholders = ",".join("?" * len(chunk))
+        totals.extend(conn.execute(
+            f"""
+            SELECT v.sku, SUM(l.available) AS quantity
+            FROM variants AS v JOIN inventory_levels AS l ON l.inventory_item_id = v.inventory_item_id
+            WHERE v.inventory_item_id IN ({placeholders})
+            GROUP BY v.sku
+            HAVING COUNT(l.available) > 0
+            """,
+            chunk,
+        ))
+    return apply_variant_deltas(conn, ({'sku': row['sku'], 'quantity': row['quantity']} for row in totals))
+
+
+def get_variants_by_inventory_item(conn: Connection, inventory_item_ids: Iterable) -> list:
+    """Return variant rows for Shopify inventory item IDs (inventory_levels/update only carries these)."""
+    ids = [str(item_id) for item_id in inventory_item_ids]
+    rows = []
+    for start in range(0, len(ids), _MAX_SQL_PARAMS):
+        chunk = ids[start:start + _MAX_SQL_PARAMS]
+        placeholders = ",".join("?" * len(chunk))
+        rows.extend(conn.execute(f"SELECT * FROM variants WHERE inventory_item_id IN ({placeholders})", chunk))
+    return rows
+
+
+def delete_product(conn: Connection, shopify_product_id) -> list:
+    """
+    Remove a Shopify product and its variants.
+
+    Returns:
+        list: The SKUs that were removed (product and variant rows), e.g. to delist them on Amazon.
+    """
+    product_id = _optional_str(shopify_product_id)
+    with conn:
+        skus = [row[0] for row in conn.execute(
+            "SELECT sku FROM products WHERE shopify_product_id = ? UNION SELECT sku FROM variants WHERE shopify_product_id = ?",
+            (product_id, product_id),
+        )]
+        conn.execute("DELETE FROM variants WHERE shopify_product_id = ?", (product_id,))
+        conn.execute("DELETE FROM products WHERE shopify_product_id = ?", (product_id,))
+    return skus
+
+
+def get_products_needing_push(conn: Connection, limit: int = None) -> list:
+    """Return product rows whose current content has not been pushed to Amazon yet."""
+    sql = "SELECT * FROM products WHERE needs_push = 1 ORDER BY sku"
+    params = ()
+    if limit is not None:
+        sql += " LIMIT ?"
+        params = (limit,)
+    return conn.execute(sql, params).fetchall()
+
+
+def mark_products_pushed(conn: Connection, pushed: Iterable[tuple]) -> int:
+    """
+    Clear needs_push for products that were successfully pushed to Amazon.
+
+    Args:
+        pushed: Iterable of (sku, content_hash) pairs as they were read when building the push.
+            A row whose hash changed since then keeps needs_push = 1 so the newer content is pushed too.
+
+    Returns:
+        int: Number of rows cleared.
+    """
+    pushed = list(pushed)
+    with _WRITE_SECONDS.time(operation='mark_products_pushed'), conn:
+        changes_before = conn.total_changes
+        conn.executemany(
+            "UPDATE products SET needs_push = 0 WHERE sku = ? AND content_hash IS ?",
+            pushed,
+        )
+        cleared = conn.total_changes - changes_before
+        # Remember what Amazon was sent, for the listing diff (see reconciliation.py)
+        conn.executemany(
+            """
+            INSERT INTO amazon_listings (sku, last_pushed_hash, pushed_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(sku) DO UPDATE SET
+                last_pushed_hash = excluded.last_pushed_hash,
+                pushed_at = excluded.pushed_at,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            pushed,
+        )
+    return cleared
+
+def get_sync_watermark(conn: Connection, store_id: str):
+    """Return the last_synced_at watermark for a store, or None if it has never been synced."""
+    row = conn.execute("SELECT last_synced_at FROM sync_state WHERE store_id = ?", (store_id,)).fetchone()
+    return row[0] if row else None
+
+
+def advance_sync_watermark(conn: Connection, store_id: str, last_synced_at: str) -> bool:
+    """
+    Move a store's watermark forward in a single statement.
+
+    The watermark never moves backwards, so a slow run that finishes after a newer one
+    cannot rewind it. last_synced_at must be a UTC ISO 8601 string so values compare correctly as text.
+
+    Returns:
+        bool: True if the stored watermark changed.
+    """
+    changes_before = conn.total_changes
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO sync_state (store_id, last_synced_at, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(store_id) DO UPDATE SET
+                last_synced_at = excluded.last_synced_at,
+                updated_at = excluded.updated_at
+            WHERE sync_state.last_synced_at IS NULL OR sync_state.last_synced_at < excluded.last_synced_at;
+            """,
+            (store_id, last_synced_at),
+        )
+    return conn.total_changes > changes_before
+
+def get_sync_checkpoint(conn: Connection, store_id: str):
+    """Return (page_info, newest_updated_at, started_at) of an interrupted pipelined sync, or None."""
+    row = conn.execute(
+        "SELECT resume_page_info, resume_newest_updated_at, resume_started_at FROM sync_state WHERE store_id = ?",
+        (store_id,),
+    ).fetchone()
+    if row is None or row[0] is None:
+        return None
+    return row[0], row[1], row[2]
+
+
+def save_sync_checkpoint(conn: Connection, store_id: str, page_info: str, newest_updated_at: str = None,
+                         started_at: str = None):
+    """
+    Record the cursor of the next page to fetch once every earlier page has been committed.
+
+    started_at is the watermark ceiling of the interrupted walk; a resumed run must keep it,
+    since products edited after the walk began may sit on pages fetched before the interruption.
+    """
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO sync_state (store_id, resume_page_info, resume_newest_updated_at, resume_started_at, updated_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(store_id) DO UPDATE SET
+                resume_page_info = excluded.resume_page_info,
+                resume_newest_updated_at = excluded.resume_newest_updated_at,
+                resume_started_at = excluded.resume_started_at,
+                updated_at = excluded.updated_at;
+            """,
+            (store_id, page_info, newest_updated_at, started_at),
+        )
+
+
+def clear_sync_checkpoint(conn: Connection, store_id: str):
+    """Forget the resume cursor, e.g. after the sync completed or the cursor expired."""
+    with conn:
+        conn.execute(
+            "UPDATE sync_state SET resume_page_info = NULL, resume_newest_updated_at = NULL, resume_started_at = NULL "
+            "WHERE store_id = ?",
+            (store_id,),
+        )
+
+FEED_TERMINAL_STATUSES = ('DONE', 'CANCELLED', 'FATAL')
+
+
+def record_feed_submission(conn: Connection, feed_id: str, feed_type: str, feed_document_id: str = None,
+                           marketplace_ids: list = None, message_count: int = None, next_poll_at: float = 0,
+                           items: Iterable[tuple] = None):
+    """
+    Persist a submitted feed so its status is tracked (and polling survives a restart).
+
+    Args:
+        items: Optional (message_id, sku, content_hash) of every product message in the feed.
+            They stay in feed_items, and out of iter_dirty_product_rows, until the feed is
+            settled with settle_feed_items.
+    """
+    with conn:
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO feeds (feed_id, feed_type, feed_document_id, marketplace_ids, message_count, next_poll_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (feed_id, feed_type, feed_document_id, json.dumps(marketplace_ids or []), message_count, next_poll_at),
+        )
+        if items:
+            conn.executemany(
+                "INSERT OR IGNORE INTO feed_items (feed_id, message_id, sku, content_hash) VALUES (?, ?, ?, ?)",
+                [(feed_id, message_id, sku, content_hash) for message_id, sku, content_hash in items],
+            )
+
+
+def get_pending_feeds(conn: Connection, due_before: float = None) -> list:
+    """
+    Return feeds that still need work: not finished, or finished without a downloaded report.
+
+    Args:
+        due_before (float, optional): Only feeds whose next_poll_at is at or before this Unix time.
+    """
+    sql = "SELECT * FROM feeds WHERE result_fetched = 0"
+    params = ()
+    if due_before is not None:
+        sql += " AND next_poll_at <= ?"
+        params = (due_before,)
+    return conn.execute(sql + " ORDER BY next_poll_at", params).fetchall()
+
+
+def update_feed_status(conn: Connection, feed_id: str, status: str, next_poll_at: float = None,
+                       poll_interval: float = None, result_document_id: str = None):
+    """Store the outcome of one getFeed poll."""
+    with conn:
+        conn.execute(
+            """
+            UPDATE feeds SET
+                status = ?,
+                result_document_id = COALESCE(?, result_document_id),
+                next_poll_at = COALESCE(?, next_poll_at),
+                poll_interval = COALESCE(?, poll_interval),
+                poll_count = poll_count + 1,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE feed_id = ?
+            """,
+            (status, result_document_id, next_poll_at, poll_interval, feed_id),
+        )
+
+
+def settle_feed_items(conn: Connection, feed_id: str, status: str, failed_message_ids: Iterable[int] = ()) -> dict:
+    """
+    Resolve the products of a finished feed once Amazon has processed it.
+
+    For a DONE feed every message without an error in the processing report is marked pushed
+    (mark_products_pushed, which also records amazon_listings.last_pushed_hash); the failed ones,
+    and every message of a FATAL or CANCELLED feed, get needs_push = 1 so the next push sends
+    them again. The feed's feed_items rows are removed either way.
+
+    Returns:
+        dict: 'pushed' (products cleared) and 'failed' (SKUs left dirty).
+    """
+    items = conn.execute("SELECT message_id, sku, content_hash FROM feed_items WHERE feed_id = ?", (feed_id,)).fetchall()
+    failed_message_ids = set(failed_message_ids) if status == 'DONE' else {item["message_id"] for item in items}
+    succeeded = [(item["sku"], item["content_hash"]) for item in items if item["message_id"] not in failed_message_ids]
+    failed = sorted({item["sku"] for item in items if item["message_id"] in failed_message_ids})
+
+    pushed = mark_products_pushed(conn, succeeded) if succeeded else 0
+    with _WRITE_SECONDS.time(operation='settle_feed_items'), conn:
+        conn.executemany("UPDATE products SET needs_push = 1 WHERE sku = ?", [(sku,) for sku in failed])
+        conn.execute("DELETE FROM feed_items WHERE feed_id = ?", (feed_id,))
+    return {'pushed': pushed, 'failed': failed}
+
+
+def record_feed_result(conn: Connection, feed_id: str, summary: dict = None):
+    """Mark a feed's processing report as fetched (or as having none) and keep its summary."""
     with conn:
-        conn.execute(sql, params)
-    return conn.total_changes > 0 # Return True if a change was made (insert or update)
+        conn.execute(
+            "UPDATE feeds SET result_fetched = 1, result_summary = ?, updated_at = CURRENT_TIMESTAMP WHERE feed_id = ?",
+            (json.dumps(summary) if summary is not None else None, feed_id),
+        )
 
 # Example of how to fetch a product (can be expanded later)
 # def get_product_by_sku(conn: Connection, sku: str) -> sqlite3.Row | None:
@@ -0,0 +1,289 @@
+import json
+import tempfile
+from sqlite3 import Connection
+
+from .database import decode_raw_shopify_data, record_feed_submission, register_content_hash_raw_fields
+from .metrics import FEED_SIZE_BUCKETS, REGISTRY
+
+JSON_LISTINGS_FEED = "JSON_LISTINGS_FEED"
+JSON_CONTENT_TYPE = "application/json; charset=UTF-8"
+
+# SP-API limits for a single JSON_LISTINGS_FEED document
+MAX_MESSAGES_PER_FEED = 10000
+MAX_FEED_BYTES = 10 * 1024 * 1024
+
+# Feed documents smaller than this stay in memory; larger ones spill to a temp file
+DEFAULT_SPOOL_SIZE = 8 * 1024 * 1024
+
+_FEED_BYTES = REGISTRY.histogram("feed_document_bytes", "Size of submitted feed documents", buckets=FEED_SIZE_BUCKETS)
+_FEED_MESSAGES = REGISTRY.histogram("feed_document_messages", "Messages per submitted feed document",
+                                    buckets=(10, 100, 1000, 2500, 5000, 10000))
+
+# Products whose current content is already in a submitted, unsettled feed are skipped
+_DIRTY_PRODUCTS_SQL = """
+SELECT sku, content_hash, title, description, price, quantity, main_image_url{extra_columns}
+FROM products
+WHERE needs_push = 1 AND sku > ?
+  AND NOT EXISTS (SELECT 1 FROM feed_items AS f WHERE f.sku = products.sku AND f.content_hash IS products.content_hash)
+ORDER BY sku
+LIMIT ?
+"""
+
+
+def iter_dirty_product_rows(conn: Connection, page_size: int = 1000, with_raw_data: bool = False):
+    """
+    Stream products with needs_push = 1 in SKU order, one page per query, leaving out those
+    whose current content is waiting in a submitted feed.
+
+    Keyset pagination (sku > last seen) keeps each read short, so the rows consumed so far
+    can be recorded as in flight between pages without disturbing an open cursor.
+
+    Args:
+        with_raw_data (bool): Also load raw_shopify_data, decoded to the Shopify payload dict,
+            for mappings with raw.* sources (see ListingsFeedBuilder.uses_raw_data). Rows are
+            then plain dicts instead of sqlite3.Row.
+    """
+    sql = _DIRTY_PRODUCTS_SQL.format(extra_columns=", raw_shopify_data" if with_raw_data else "")
+    last_sku = ""
+    while True:
+        rows = conn.execute(sql, (last_sku, page_size)).fetchall()
+        if not rows:
+            return
+        if with_raw_data:
+            for row in rows:
+                row = dict(row)
+                row["raw_shopify_data"] = decode_raw_shopify_data(conn, row["raw_shopify_data"])
+                yield row
+        else:
+            yield from rows
+        last_sku = rows[-1]["sku"]
+
+
+def default_listing_message(row, marketplace_id: str, product_type: str = "PRODUCT", currency: str = "USD"):
+    """Basic JSON_LISTINGS_FEED message from a products row; mapping.compile_mapping builds configurable ones."""
+    attributes = {
+        "item_name": [{"value": row["title"], "language_tag": "en_US", "marketplace_id": marketplace_id}],
+        "fulfillment_availability": [{"fulfillment_channel_code": "DEFAULT", "quantity": max(0, row["quantity"] or 0)}],
+    }
+    if row["description"]:
+        attributes["product_description"] = [
+            {"value": row["description"], "language_tag": "en_US", "marketplace_id": marketplace_id}
+        ]
+    if row["price"] is not None:
+        attributes["purchasable_offer"] = [{
+            "currency": currency,
+            "marketplace_id": marketplace_id,
+            "our_price": [{"schedule": [{"value_with_tax": round(row["price"], 2)}]}],
+        }]
+    if row["main_image_url"]:
+        attributes["main_product_image_locator"] = [{"media_location": row["main_image_url"], "marketplace_id": marketplace_id}]
+    return {"sku": row["sku"], "operationType": "UPDATE", "productType": product_type, "attributes": attributes}
+
+
+def offer_patches(update, marketplace_id: str, currency: str = "USD") -> list:
+    """
+    JSON Patch operations for the price and/or quantity of one listing.
+
+    Args:
+        update (dict): 'sku' plus 'price' and/or 'quantity'; keys that are absent or None are left alone.
+
+    Returns:
+        list: Patch operations for patchListingsItem or a PATCH feed message (empty if nothing changes).
+    """
+    patches = []
+    if update.get("price") is not None:
+        patches.append({
+            "op": "replace",
+            "path": "/attributes/purchasable_offer",
+            "value": [{
+                "currency": currency,
+                "marketplace_id": marketplace_id,
+                "our_price": [{"schedule": [{"value_with_tax": round(float(update["price"]), 2)}]}],
+            }],
+        })
+    if update.get("quantity") is not None:
+        patches.append({
+            "op": "replace",
+            "path": "/attributes/fulfillment_availability",
+            "value": [{"fulfillment_channel_code": "DEFAULT", "quantity": max(0, int(update["quantity"]))}],
+        })
+    return patches
+
+
+def patch_listing_message(update, marketplace_id: str, product_type: str = "PRODUCT", currency: str = "USD"):
+    """PATCH message for a price/quantity update, or None if the update changes nothing."""
+    patches = offer_patches(update, marketplace_id, currency)
+    if not patches:
+        return None
+    return {
+        "sku": update["sku"],
+        "operationType": "PATCH",
+        "productType": update.get("product_type") or product_type,
+        "patches": patches,
+    }
+
+
+class FeedDocument:
+    """One finished feed document, held in a spooled temp file until it is uploaded."""
+
+    def __init__(self, file, message_count: int, size: int, pushed: list):
+        self.file = file
+        self.message_count = message_count
+        self.size = size
+        # (sku, content_hash) of every message in messageId order, recorded as the feed's feed_items
+        self.pushed = pushed
+
+    def close(self):
+        self.file.close()
+
+
+class ListingsFeedBuilder:
+    """
+    Writes JSON_LISTINGS_FEED documents incrementally and splits them at the SP-API limits.
+
+    Messages are serialised one at a time into a SpooledTemporaryFile, so memory use is bounded
+    by spool_size no matter how many products are dirty. A new document is started whenever
+    the next message would exceed max_messages or max_bytes.
+    """
+
+    def __init__(self, seller_id: str, marketplace_id: str, message_builder=None,
+                 max_messages: int = MAX_MESSAGES_PER_FEED, max_bytes: int = MAX_FEED_BYTES,
+                 spool_size: int = DEFAULT_SPOOL_SIZE, mapping=None, mapping_batch_size: int = 1000):
+        """
+        Args:
+            seller_id (str): Merchant token placed in the feed header.
+            marketplace_id (str): Marketplace the listing attributes apply to.
+            message_builder (callable, optional): row -> message dict (without messageId).
+                Defaults to default_listing_message for marketplace_id.
+            max_messages (int): Message limit per document.
+            max_bytes (int): Size limit per document, including header and closing brackets.
+            spool_size (int): Bytes kept in memory before a document spills to disk.
+            mapping (mapping.CompiledMapping, optional): Builds messages mapping_batch_size rows at
+                a time instead of calling message_builder per row.
+            mapping_batch_size (int): Rows per CompiledMapping.map_batch call.
+        """
+        self.seller_id = seller_id
+        self.mapping = mapping
+        self.mapping_batch_size = mapping_batch_size
+        self.message_builder = message_builder or (lambda row: default_listing_message(row, marketplace_id))
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.spool_size = spool_size
+        self._prefix = (
+            json.dumps({"header": {"sellerId": seller_id, "version": "2.0", "issueLocale": "en_US"}})[:-1]
+            + ', "messages": ['
+        ).encode("utf-8")
+        self._suffix = b"]}"
+
+    @property
+    def uses_raw_data(self) -> bool:
+        """True if the mapping reads raw.* sources, which need iter_dirty_product_rows(with_raw_data=True)."""
+        return self.mapping is not None and self.mapping.uses_raw_data
+
+    def _start(self):
+        file = tempfile.SpooledTemporaryFile(max_size=self.spool_size, mode="w+b")
+        file.write(self._prefix)
+        return file
+
+    def _finish(self, file, count, size, pushed):
+        file.write(self._suffix)
+        file.seek(0)
+        return FeedDocument(file, count, size + len(self._suffix), pushed)
+
+    def _iter_messages(self, rows):
+        if self.mapping is not None:
+            return self.mapping.iter_messages(rows, batch_size=self.mapping_batch_size)
+        return ((row, self.message_builder(row)) for row in rows)
+
+    def iter_documents(self, rows):
+        """
+        Serialise rows into as many feed documents as the limits require.
+
+        Yields:
+            FeedDocument: Each finished document, rewound and ready to upload. The caller owns
+                it and should close() it after uploading.
+        """
+        file = None
+        count = size = 0
+        pushed = []
+        for row, message in self._iter_messages(rows):
+            if message is None:
+                continue
+            if file is None:
+                file, count, size, pushed = self._start(), 0, len(self._prefix), []
+
+            message["messageId"] = count + 1
+            encoded = json.dumps(message, separators=(",", ":")).encode("utf-8")
+            if count and (count >= self.max_messages
+                          or size + 1 + len(encoded) + len(self._suffix) > self.max_bytes):
+                yield self._finish(file, count, size, pushed)
+                file, count, size, pushed = self._start(), 0, len(self._prefix), []
+                # messageIds restart at 1 in every document
+                message["messageId"] = 1
+                encoded = json.dumps(message, separators=(",", ":")).encode("utf-8")
+
+            separator = b"," if count else b""
+            if size + len(separator) + len(encoded) + len(self._suffix) > self.max_bytes:
+                raise ValueError(f"Message for SKU {row['sku']} alone exceeds the {self.max_bytes} byte feed limit")
+            file.write(separator + encoded)
+            size += len(separator) + len(encoded)
+            count += 1
+            pushed.append((row["sku"], row["content_hash"]))
+        if file is not None:
+            yield self._finish(file, count, size, pushed)
+
+
+def submit_feed_document(client, document: FeedDocument, marketplace_ids: list,
+                         feed_type: str = JSON_LISTINGS_FEED) -> dict:
+    """
+    Upload one finished document and create its feed (create_feed_document -> upload -> create_feed).
+
+    The document is closed afterwards, whether or not the submission succeeded.
+
+    Returns:
+        dict: 'feedId', 'feedDocumentId', 'message_count' and 'size'.
+    """
+    try:
+        spec = client.create_feed_document(content_type=JSON_CONTENT_TYPE)
+        client.upload_feed_document(spec["url"], document.file, content_type=JSON_CONTENT_TYPE)
+        feed = client.create_feed(feed_type=feed_type, feed_document_id=spec["feedDocumentId"],
+                                  marketplace_ids=marketplace_ids)
+    finally:
+        document.close()
+    _FEED_BYTES.observe(document.size)
+    _FEED_MESSAGES.observe(document.message_count)
+    return {
+        "feedId": feed["feedId"],
+        "feedDocumentId": spec["feedDocumentId"],
+        "message_count": document.message_count,
+        "size": document.size,
+    }
+
+
+def push_dirty_products(client, conn: Connection, builder: ListingsFeedBuilder, marketplace_ids: list,
+                        feed_type: str = JSON_LISTINGS_FEED, page_size: int = 1000) -> list:
+    """
+    Build feeds from every dirty product and submit each one as soon as it is complete.
+
+    Each document goes through create_feed_document -> upload_feed_document -> create_feed,
+    then the feed and its products are recorded for FeedStatusPoller. The products stay dirty
+    until the poller sees the feed DONE and settles them (database.settle_feed_items); until
+    then, iter_dirty_product_rows skips them so they are not sent twice.
+
+    Returns:
+        list: One dict per submitted feed with 'feedId', 'feedDocumentId', 'message_count' and 'size'.
+    """
+    if builder.uses_raw_data:
+        # Normally registered before the sync; from now on edits to these fields make products dirty
+        register_content_hash_raw_fields(conn, builder.mapping.raw_fields)
+    submissions = []
+    rows = iter_dirty_product_rows(conn, page_size=page_size, with_raw_data=builder.uses_raw_data)
+    for document in builder.iter_documents(rows):
+        submission = submit_feed_document(client, document, marketplace_ids, feed_type)
+        # Track the feed so FeedStatusPoller picks it up, even from another process
+        record_feed_submission(conn, submission["feedId"], feed_type, submission["feedDocumentId"],
+                               marketplace_ids, submission["message_count"],
+                               items=[(index + 1, sku, content_hash) for index, (sku, content_hash)
+                                      in enumerate(document.pushed)])
+        submissions.append(submission)
+    return submissions
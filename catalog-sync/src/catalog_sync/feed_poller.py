@@ -0,0 +1,172 @@
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlite3 import Connection
+
+from .database import (FEED_TERMINAL_STATUSES, get_pending_feeds, record_feed_result, record_feed_submission,
+                       settle_feed_items, update_feed_status)
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+_POLL_ERRORS = REGISTRY.counter("feed_poll_errors_total", "Feed polls that failed and were retried later",
+                                ("reason",))
+
+
+def failed_message_ids(report) -> set:
+    """messageIds with an ERROR issue in a JSON_LISTINGS_FEED processing report (warnings do not fail a message)."""
+    if not isinstance(report, dict):
+        return set()
+    return {issue["messageId"] for issue in report.get("issues") or []
+            if issue.get("severity") == "ERROR" and issue.get("messageId") is not None}
+
+
+class FeedStatusPoller:
+    """
+    Tracks many submitted feeds at once and downloads each processing report as soon as it is ready.
+
+    Feeds live in the feeds table, so a restarted process picks up where the last one stopped.
+    Every feed has its own poll interval that starts short and grows by backoff_factor (with
+    jitter) each time the feed is still queued or processing, so quick feeds finish quickly and
+    slow ones stop burning the getFeed budget. Status checks and report downloads run on a
+    worker pool; AmazonSPAPIClient paces them with its per-operation getFeed/getFeedDocument
+    token buckets. All database writes stay on the calling thread.
+
+    Products sent by push_dirty_products are settled once their feed finishes: those the
+    processing report accepted are marked pushed, those it rejected (or all of them, for a
+    FATAL or CANCELLED feed) are flagged needs_push again.
+    """
+
+    def __init__(self, client, conn: Connection, max_workers: int = 4, initial_interval: float = 15.0,
+                 max_interval: float = 300.0, backoff_factor: float = 1.5, get_feed_limiter=None,
+                 get_feed_document_limiter=None, on_result=None):
+        """
+        Args:
+            client (AmazonSPAPIClient): Client used for getFeed / getFeedDocument.
+            conn: Database connection holding the feeds table (used only from the calling thread).
+            max_workers (int): Concurrent SP-API calls.
+            initial_interval (float): Seconds before the first poll of a new feed.
+            max_interval (float): Upper bound of a feed's poll interval.
+            backoff_factor (float): Growth of a feed's poll interval after each unfinished poll.
+            get_feed_limiter, get_feed_document_limiter (TokenBucket, optional): Extra rate budgets, only
+                needed for clients that do not rate limit getFeed/getFeedDocument themselves.
+            on_result (callable, optional): on_result(feed_row, report) for every finished feed; report
+                is the parsed JSON processing report, raw bytes for non-JSON reports, or None. Exceptions
+                it raises are logged and do not affect the other feeds.
+        """
+        self.client = client
+        self.conn = conn
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.get_feed_limiter = get_feed_limiter
+        self.get_feed_document_limiter = get_feed_document_limiter
+        self.on_result = on_result
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="feed-poller")
+
+    def track(self, feed_id: str, feed_type: str, feed_document_id: str = None, marketplace_ids: list = None,
+              message_count: int = None):
+        """Start tracking a submitted feed; its first poll is due after initial_interval."""
+        record_feed_submission(self.conn, feed_id, feed_type, feed_document_id, marketplace_ids, message_count,
+                               next_poll_at=time.time() + self.initial_interval)
+
+    def _next_interval(self, feed_row, failed=False):
+        interval = feed_row["poll_interval"] or self.initial_interval
+        factor = 2.0 if failed else self.backoff_factor
+        interval = min(self.max_interval, interval * factor)
+        return interval * random.uniform(0.9, 1.1)
+
+    def _fetch_report(self, result_document_id):
+        if self.get_feed_document_limiter:
+            self.get_feed_document_limiter.acquire()
+        document = self.client.get_feed_document(result_document_id)
+        content = self.client.download_feed_document(document["url"], document.get("compressionAlgorithm"))
+        try:
+            return json.loads(content)
+        except ValueError:
+            return content
+
+    def _check(self, feed_row):
+        """Worker task: poll one feed and, once it has finished, fetch its report."""
+        status = feed_row["status"]
+        result_document_id = feed_row["result_document_id"]
+        if status not in FEED_TERMINAL_STATUSES:
+            if self.get_feed_limiter:
+                self.get_feed_limiter.acquire()
+            response = self.client.get_feed_status(feed_row["feed_id"])
+            status = response["processingStatus"]
+            result_document_id = response.get("resultFeedDocumentId")
+
+        report = None
+        if status in FEED_TERMINAL_STATUSES and result_document_id:
+            report = self._fetch_report(result_document_id)
+        return status, result_document_id, report
+
+    def poll_once(self) -> int:
+        """
+        Poll every feed that is due, concurrently, and record the outcomes.
+
+        Returns:
+            int: Number of feeds checked.
+        """
+        due = get_pending_feeds(self.conn, due_before=time.time())
+        futures = [(row, self._executor.submit(self._check, row)) for row in due]
+        for row, future in futures:
+            try:
+                status, result_document_id, report = future.result()
+            except Exception as err:
+                # SP-API errors, network errors from the report download, a corrupt gzip report...:
+                # whatever it was, only this feed is affected and it is tried again after a back-off
+                _POLL_ERRORS.inc(reason=type(err).__name__)
+                logger.warning("Polling feed %s failed: %r", row["feed_id"], err)
+                interval = self._next_interval(row, failed=True)
+                update_feed_status(self.conn, row["feed_id"], row["status"], next_poll_at=time.time() + interval,
+                                   poll_interval=interval)
+                continue
+
+            if status in FEED_TERMINAL_STATUSES:
+                update_feed_status(self.conn, row["feed_id"], status, result_document_id=result_document_id)
+                settle_feed_items(self.conn, row["feed_id"], status, failed_message_ids(report))
+                summary = report.get("summary") if isinstance(report, dict) else None
+                record_feed_result(self.conn, row["feed_id"], summary)
+                if self.on_result:
+                    # The feed is already recorded as finished; a failing callback must not strand
+                    # the feeds still waiting in this batch
+                    try:
+                        self.on_result(row, report)
+                    except Exception:
+                        logger.exception("on_result for feed %s failed", row["feed_id"])
+            else:
+                interval = self._next_interval(row)
+                update_feed_status(self.conn, row["feed_id"], status, next_poll_at=time.time() + interval,
+                                   poll_interval=interval)
+        return len(due)
+
+    def run(self, timeout: float = None) -> bool:
+        """
+        Poll until every tracked feed has finished and its report has been fetched.
+
+        Returns:
+            bool: True if all feeds finished, False if timeout was reached first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.poll_once()
+            pending = get_pending_feeds(self.conn)
+            if not pending:
+                return True
+            wait = max(0.0, pending[0]["next_poll_at"] - time.time())
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,302 @@
+import html
+import json
+import re
+
+# --- body_html -> plain text ---
+
+_SCRIPT_STYLE_RE = re.compile(r"<(script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r"<[^>]*>")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def strip_html(value):
+    """Plain text from Shopify body_html: tags dropped, entities decoded, whitespace collapsed."""
+    if not value:
+        return value
+    if "<" in value:
+        value = _TAG_RE.sub(" ", _SCRIPT_STYLE_RE.sub(" ", value))
+    if "&" in value:
+        # Decode after removing tags, so an escaped "&lt;b&gt;" stays text
+        value = html.unescape(value)
+    return _WHITESPACE_RE.sub(" ", value).strip()
+
+
+def _collapse_whitespace(value):
+    return _WHITESPACE_RE.sub(" ", value).strip() if value else value
+
+
+# --- Transforms: name -> factory(*args) -> callable(value) ---
+
+def _truncate(limit):
+    limit = int(limit)
+    return lambda value: value[:limit].rstrip() if value and len(value) > limit else value
+
+
+def _price(multiplier=1.0):
+    multiplier = float(multiplier)
+
+    def price(value):
+        if value is None or value == "":
+            return None
+        return round(float(value) * multiplier, 2)
+    return price
+
+
+def _non_negative_int():
+    return lambda value: max(0, int(value or 0))
+
+
+def _default(default):
+    return lambda value: default if value is None or value == "" else value
+
+
+def _lookup(table, default=None):
+    """Translate values through a table; unknown values map to default (or stay as they are)."""
+    table = dict(table)
+    if default is None:
+        return lambda value: table.get(value, value)
+    return lambda value: table.get(value, default)
+
+
+# Transforms that substitute a value for None/""; all others are skipped for missing values
+_MISSING_VALUE_TRANSFORMS = {'default', 'non_negative_int'}
+
+TRANSFORMS = {
+    'strip_html': lambda: strip_html,
+    'collapse_whitespace': lambda: _collapse_whitespace,
+    'truncate': _truncate,
+    'price': _price,
+    'non_negative_int': _non_negative_int,
+    'default': _default,
+    'lookup': _lookup,
+}
+
+
+# --- Shapes: wrap a final value in the JSON_LISTINGS_FEED attribute structure ---
+
+def _shape_factories(marketplace_id, language_tag, currency):
+    return {
+        'text': lambda v: [{"value": v, "language_tag": language_tag, "marketplace_id": marketplace_id}],
+        'value': lambda v: [{"value": v, "marketplace_id": marketplace_id}],
+        'offer': lambda v: [{
+            "currency": currency,
+            "marketplace_id": marketplace_id,
+            "our_price": [{"schedule": [{"value_with_tax": v}]}],
+        }],
+        'quantity': lambda v: [{"fulfillment_channel_code": "DEFAULT", "quantity": v}],
+        'image': lambda v: [{"media_location": v, "marketplace_id": marketplace_id}],
+    }
+
+
+# Equivalent of feed_builder.default_listing_message, with descriptions converted to plain text
+DEFAULT_MAPPING = {
+    "language_tag": "en_US",
+    "currency": "USD",
+    "product_type": "PRODUCT",
+    "templates": {
+        "PRODUCT": {
+            "attributes": {
+                "item_name": {"source": "title", "transforms": ["collapse_whitespace", ["truncate", 200]], "shape": "text"},
+                "product_description": {"source": "body_html", "transforms": ["strip_html", ["truncate", 2000]],
+                                        "shape": "text"},
+                "purchasable_offer": {"source": "price", "transforms": ["price"], "shape": "offer"},
+                "fulfillment_availability": {"source": "inventory_quantity", "transforms": ["non_negative_int"],
+                                             "shape": "quantity"},
+                "main_product_image_locator": {"source": "main_image_url", "shape": "image"},
+            },
+        },
+    },
+}
+
+# products table columns holding the parsed-product fields of the same meaning
+_ROW_ALIASES = {'body_html': 'description', 'inventory_quantity': 'quantity'}
+
+
+def load_mapping(path: str) -> dict:
+    """Read a mapping spec (same structure as DEFAULT_MAPPING) from a JSON file."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _compile_pipeline(transforms):
+    """Parse transform specs ("name" or ["name", *args]) into (callable, handles_missing) steps."""
+    steps = []
+    for transform in transforms or []:
+        name, args = (transform, ()) if isinstance(transform, str) else (transform[0], transform[1:])
+        if name not in TRANSFORMS:
+            raise ValueError(f"Unknown mapping transform '{name}'")
+        steps.append((TRANSFORMS[name](*args), name in _MISSING_VALUE_TRANSFORMS))
+    return steps
+
+
+def _fuse(steps, final=None):
+    """Fold a rule's steps (and its shape) into one callable; missing values short-circuit to None."""
+    if final is not None:
+        steps = steps + [(final, False)]
+
+    def convert(value):
+        for step, handles_missing in steps:
+            if (value is None or value == "") and not handles_missing:
+                return None
+            value = step(value)
+        return value
+    return convert
+
+
+def _resolve_template(templates, name, seen=()):
+    if name in seen:
+        raise ValueError(f"Mapping template '{name}' extends itself")
+    template = templates[name]
+    attributes = {}
+    if template.get("extends"):
+        attributes.update(_resolve_template(templates, template["extends"], seen + (name,)))
+    for attribute, rule in (template.get("attributes") or {}).items():
+        if rule is None:
+            attributes.pop(attribute, None) # A category can drop an inherited attribute
+        else:
+            attributes[attribute] = rule
+    return attributes
+
+
+def _column(rows, source):
+    """
+    All values of one source field, read from a batch of parsed products or products rows.
+
+    raw.* sources resolve against a decoded raw_shopify_data dict, as on parsed products and on
+    iter_dirty_product_rows(with_raw_data=True) rows; without one they are None.
+    """
+    if source.startswith("raw."):
+        path = source[4:].split(".")
+        if "raw_shopify_data" not in rows[0].keys():
+            return [None] * len(rows)
+        values = []
+        for row in rows:
+            value = row["raw_shopify_data"]
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            values.append(value)
+        return values
+    keys = rows[0].keys()
+    if source not in keys:
+        source = _ROW_ALIASES.get(source, source)
+        if source not in keys:
+            return [None] * len(rows)
+    return [row[source] for row in rows]
+
+
+class CompiledMapping:
+    """
+    Shopify -> Amazon attribute mapping, compiled once and applied a batch at a time.
+
+    Every rule of a spec becomes a single fused callable (transforms + attribute shape).
+    map_batch() reads each source field as one column, runs each rule over its whole column
+    and only then assembles the messages, so per-product work is a few list lookups rather
+    than walking the spec for every product. Products are grouped by product type first, and
+    each group is mapped with its category template.
+    """
+
+    def __init__(self, spec: dict, marketplace_id: str):
+        self.marketplace_id = marketplace_id
+        language_tag = spec.get("language_tag", "en_US")
+        currency = spec.get("currency", "USD")
+        shapes = _shape_factories(marketplace_id, language_tag, currency)
+        templates = spec.get("templates") or {}
+
+        product_type = spec.get("product_type", "PRODUCT")
+        if isinstance(product_type, str):
+            self._type_source, self._type_convert, self._default_type = None, None, product_type
+        else:
+            self._type_source = product_type["source"]
+            self._type_convert = _fuse(_compile_pipeline(product_type.get("transforms")))
+            self._default_type = product_type.get("default", "PRODUCT")
+        if self._default_type not in templates:
+            raise ValueError(f"Mapping has no template for default product type '{self._default_type}'")
+
+        # name -> [(attribute, source, convert, constant)]
+        self._templates = {}
+        for name in templates:
+            rules = []
+            for attribute, rule in _resolve_template(templates, name).items():
+                shape = shapes.get(rule.get("shape", "value"))
+                if shape is None:
+                    raise ValueError(f"Unknown shape '{rule.get('shape')}' for attribute '{attribute}'")
+                convert = _fuse(_compile_pipeline(rule.get("transforms")), shape)
+                if "value" in rule:
+                    # Constants are converted once; every message shares the (read-only) result
+                    rules.append((attribute, None, None, convert(rule["value"])))
+                else:
+                    rules.append((attribute, rule["source"], convert, None))
+            self._templates[name] = rules
+
+        # raw.* sources need the stored Shopify payload, which products rows only carry on request,
+        # and a product's content hash must cover them (database.register_content_hash_raw_fields)
+        sources = [self._type_source] + [rule[1] for rules in self._templates.values() for rule in rules]
+        self.raw_fields = tuple(sorted({source[4:] for source in sources if source and source.startswith("raw.")}))
+        self.uses_raw_data = bool(self.raw_fields)
+
+    def _product_types(self, columns, count):
+        if self._type_source is None:
+            return [self._default_type] * count
+        types = map(self._type_convert, columns(self._type_source))
+        return [t if t in self._templates else self._default_type for t in types]
+
+    def map_batch(self, rows) -> list:
+        """
+        Map a batch of parsed products (or products table rows) to JSON_LISTINGS_FEED messages.
+
+        Returns:
+            list: One message dict (without messageId) per input row, in input order.
+        """
+        rows = list(rows)
+        if not rows:
+            return []
+        cache = {}
+
+        def columns(source):
+            if source not in cache:
+                cache[source] = _column(rows, source)
+            return cache[source]
+
+        skus = columns("sku")
+        types = self._product_types(columns, len(rows))
+        groups = {}
+        for index, product_type in enumerate(types):
+            groups.setdefault(product_type, []).append(index)
+
+        messages = [None] * len(rows)
+        for product_type, indexes in groups.items():
+            converted = []
+            for attribute, source, convert, constant in self._templates[product_type]:
+                if convert is None:
+                    converted.append((attribute, None, constant))
+                    continue
+                column = columns(source)
+                if len(indexes) != len(rows):
+                    column = [column[i] for i in indexes]
+                converted.append((attribute, list(map(convert, column)), None))
+
+            for position, index in enumerate(indexes):
+                attributes = {}
+                for attribute, values, constant in converted:
+                    value = constant if values is None else values[position]
+                    if value is not None:
+                        attributes[attribute] = value
+                messages[index] = {"sku": skus[index], "operationType": "UPDATE", "productType": product_type,
+                                   "attributes": attributes}
+        return messages
+
+    def iter_messages(self, rows, batch_size: int = 1000):
+        """Stream (row, message) pairs, mapping rows batch_size at a time."""
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield from zip(batch, self.map_batch(batch))
+                batch = []
+        if batch:
+            yield from zip(batch, self.map_batch(batch))
+
+
+def compile_mapping(spec: dict = None, marketplace_id: str = "ATVPDKIKX0DER") -> CompiledMapping:
+    """Compile a mapping spec (DEFAULT_MAPPING when omitted) for one marketplace."""
+    return CompiledMapping(DEFAULT_MAPPING if spec is None else spec, marketplace_id)
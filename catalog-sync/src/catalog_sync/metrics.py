@@ -0,0 +1,274 @@
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Request latency in seconds
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Feed document sizes in bytes, up to the 10 MB JSON_LISTINGS_FEED limit
+FEED_SIZE_BUCKETS = (16e3, 64e3, 256e3, 1e6, 2.5e6, 5e6, 10e6)
+
+_ID_SEGMENT_RE = re.compile(r"/\d+(?=[/.]|$)")
+
+
+def normalize_endpoint(endpoint: str) -> str:
+    """Endpoint label with numeric IDs replaced, e.g. 'products/123.json' -> 'products/{id}.json'."""
+    return _ID_SEGMENT_RE.sub("/{id}", endpoint)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help_text, labelnames):
+        self._lock = registry._lock
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    """Monotonic total, e.g. requests or retries."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+    def _render(self):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(self._series.items())]
+
+    def _snapshot(self):
+        return [{'labels': dict(zip(self.labelnames, key)), 'value': value} for key, value in sorted(self._series.items())]
+
+
+class Gauge(Counter):
+    """Current value that can go up and down, e.g. queue depth."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+class Histogram(_Metric):
+    """Distribution with fixed buckets, e.g. request latency; reports count, sum and estimated quantiles."""
+
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labelnames, buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the with-block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _quantile(self, counts, total, q):
+        """Linear interpolation inside the bucket holding the q-th observation (like histogram_quantile)."""
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, counts):
+            if count and cumulative + count >= rank:
+                if bound == float("inf"):
+                    return lower # Above the largest finite bucket: report its bound
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound if bound != float("inf") else lower
+        return lower
+
+    def _render(self):
+        lines = []
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+    def _snapshot(self):
+        result = []
+        for key, series in sorted(self._series.items()):
+            total = series['count']
+            result.append({
+                'labels': dict(zip(self.labelnames, key)),
+                'count': total,
+                'sum': series['sum'],
+                'mean': series['sum'] / total if total else None,
+                'p50': self._quantile(series['counts'], total, 0.5),
+                'p95': self._quantile(series['counts'], total, 0.95),
+                'p99': self._quantile(series['counts'], total, 0.99),
+            })
+        return result
+
+
+class MetricsRegistry:
+    """
+    Process-wide collection of counters, gauges and histograms.
+
+    Metrics are created once (get-or-create by name) at import time of the module that records
+    them; recording is a dict update under one lock, cheap next to the HTTP and SQLite calls
+    being measured. State that lives elsewhere (e.g. throttler fill levels) is copied into
+    gauges by collectors, which run just before every render or snapshot.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _get_or_create(self, cls, name, help_text, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(self, name, help_text, labelnames, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered with a different type or labels")
+            return metric
+
+    def counter(self, name, help_text, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def register_collector(self, collector):
+        """Call collector() before every render_prometheus/snapshot, to refresh gauges it owns."""
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def _collect(self):
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:
+            collector()
+
+    def reset(self):
+        """Drop every recorded value (the metric definitions stay), e.g. between sync runs."""
+        with self._lock:
+            for metric in self._metrics.values():
+                metric._series.clear()
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        self._collect()
+        lines = []
+        with self._lock:
+            for name, metric in sorted(self._metrics.items()):
+                lines.append(f"# HELP {name} {metric.help}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+                lines.extend(metric._render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """JSON-serialisable report: every metric's series, with count/sum/mean/p50/p95/p99 for histograms."""
+        self._collect()
+        with self._lock:
+            return {
+                name: {'type': metric.kind, 'help': metric.help, 'series': metric._snapshot()}
+                for name, metric in sorted(self._metrics.items())
+            }
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = self.server.registry.render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = json.dumps(self.server.registry.snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes every few seconds would flood stderr
+
+
+def serve_metrics(port: int = 9108, host: str = "0.0.0.0", registry: MetricsRegistry = REGISTRY):
+    """
+    Serve /metrics (Prometheus text) and /metrics.json from a background thread.
+
+    Returns:
+        ThreadingHTTPServer: Call shutdown() to stop it; server_address holds the bound port.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
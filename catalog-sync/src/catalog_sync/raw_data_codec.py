@@ -0,0 +1,110 @@
+import hashlib
+import json
+import re
+import zlib
+from collections import Counter
+
+# Compressed values are stored as BLOBs starting with this marker, followed by the 8-byte digest
+# of the preset dictionary (all zero bytes when none was used) and the zlib stream.
+# Plain JSON text can never start with a NUL byte, so legacy TEXT rows stay readable as-is.
+ZLIB_MAGIC = b"\x00zl1"
+_NO_DICTIONARY = b"\x00" * 8
+DICTIONARY_DIGEST_SIZE = 8
+# zlib only looks back 32 KiB, so a larger preset dictionary would never be referenced
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+# "key":value pairs and bare keys that repeat across Shopify product payloads
+_JSON_FRAGMENT_RE = re.compile(
+    r'"[^"\\]{1,64}":(?:"[^"\\]{0,64}"|-?\d+(?:\.\d+)?|true|false|null|\[\]|\{\})?'
+)
+
+
+def dictionary_digest(dictionary: bytes) -> str:
+    """Content address of a preset dictionary, used as its key in raw_data_dictionaries."""
+    return hashlib.blake2b(dictionary, digest_size=DICTIONARY_DIGEST_SIZE).hexdigest()
+
+
+class JsonCodec:
+    """The original encoding: raw_shopify_data stored as uncompressed JSON text."""
+
+    name = "json"
+    dictionary_digest = None
+
+    def encode(self, raw_data) -> str:
+        return json.dumps(raw_data)
+
+
+class ZlibCodec:
+    """zlib-compressed compact JSON, optionally primed with a dictionary trained on the catalog."""
+
+    name = "zlib"
+
+    def __init__(self, level: int = 6, dictionary: bytes = None):
+        self.level = level
+        self.dictionary = dictionary or None
+        self.dictionary_digest = dictionary_digest(dictionary) if dictionary else None
+        self._header = ZLIB_MAGIC + (bytes.fromhex(self.dictionary_digest) if dictionary else _NO_DICTIONARY)
+
+    def encode(self, raw_data) -> bytes:
+        text = json.dumps(raw_data, separators=(',', ':')).encode('utf-8')
+        if self.dictionary:
+            compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+        else:
+            compressor = zlib.compressobj(self.level)
+        return self._header + compressor.compress(text) + compressor.flush()
+
+
+def is_compressed(value) -> bool:
+    return isinstance(value, (bytes, memoryview)) and bytes(value[:len(ZLIB_MAGIC)]) == ZLIB_MAGIC
+
+
+def decode(value, load_dictionary=None):
+    """
+    Decode a stored raw_shopify_data value, whichever encoding it was written with.
+
+    Args:
+        value: TEXT (plain JSON) or BLOB (zlib) column value.
+        load_dictionary (callable, optional): digest -> dictionary bytes, for dictionary-compressed rows.
+    """
+    if value is None:
+        return None
+    if not is_compressed(value):
+        return json.loads(value)
+
+    value = bytes(value)
+    offset = len(ZLIB_MAGIC)
+    digest = value[offset:offset + DICTIONARY_DIGEST_SIZE]
+    payload = value[offset + DICTIONARY_DIGEST_SIZE:]
+    if digest == _NO_DICTIONARY:
+        decompressor = zlib.decompressobj()
+    else:
+        if load_dictionary is None:
+            raise ValueError("raw_shopify_data was compressed with a dictionary but no loader was given")
+        decompressor = zlib.decompressobj(zdict=load_dictionary(digest.hex()))
+    return json.loads(decompressor.decompress(payload) + decompressor.flush())
+
+
+def train_dictionary(samples, size: int = MAX_DICTIONARY_SIZE) -> bytes:
+    """
+    Build a zlib preset dictionary from sample JSON documents.
+
+    Fragments that occur in more than one sample are ranked by the bytes they would save
+    (occurrences x length). zlib encodes matches closer to the end of the dictionary more
+    cheaply, so the most valuable fragments are placed last.
+    """
+    size = min(size, MAX_DICTIONARY_SIZE)
+    counts = Counter()
+    for sample in samples:
+        # Count each fragment once per document so one huge product cannot dominate
+        counts.update(set(_JSON_FRAGMENT_RE.findall(sample)))
+
+    ranked = sorted((f for f, c in counts.items() if c > 1), key=lambda f: counts[f] * len(f), reverse=True)
+    chosen = []
+    total = 0
+    for fragment in ranked:
+        encoded = fragment.encode('utf-8')
+        if total + len(encoded) > size:
+            continue
+        chosen.append(encoded)
+        total += len(encoded)
+    return b"".join(reversed(chosen))
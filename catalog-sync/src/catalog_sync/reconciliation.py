@@ -0,0 +1,243 @@
+import csv
+import gzip
+import io
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+from sqlite3 import Connection
+
+from .database import _ROWS_WRITTEN, _WRITE_SECONDS
+
+# Tab-separated flat file listing every offer of the seller, active or not
+MERCHANT_LISTINGS_REPORT = "GET_MERCHANT_LISTINGS_ALL_DATA"
+# Flat-file reports for the NA and EU marketplaces are Windows-1252 encoded
+DEFAULT_REPORT_ENCODING = "cp1252"
+DEFAULT_LOAD_BATCH_SIZE = 5000
+
+# Report column -> amazon_listings column
+_REPORT_COLUMNS = {
+    'seller-sku': 'sku',
+    'asin1': 'asin',
+    'status': 'status',
+    'price': 'price',
+    'quantity': 'quantity',
+    'open-date': 'listed_at',
+}
+
+_STAGING_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS amazon_listings_staging (
+    sku TEXT PRIMARY KEY,
+    asin TEXT,
+    status TEXT,
+    price REAL,
+    quantity INTEGER,
+    listed_at TEXT
+) WITHOUT ROWID
+"""
+
+_MERGE_SQL = """
+INSERT INTO amazon_listings (sku, asin, status, price, quantity, listed_at, seen_at)
+SELECT sku, asin, status, price, quantity, listed_at, :loaded_at FROM amazon_listings_staging WHERE true
+ON CONFLICT(sku) DO UPDATE SET
+    asin = excluded.asin,
+    status = excluded.status,
+    price = excluded.price,
+    quantity = excluded.quantity,
+    listed_at = excluded.listed_at,
+    seen_at = excluded.seen_at,
+    updated_at = CASE
+        WHEN amazon_listings.asin IS excluded.asin AND amazon_listings.status IS excluded.status
+             AND amazon_listings.price IS excluded.price AND amazon_listings.quantity IS excluded.quantity
+        THEN amazon_listings.updated_at ELSE CURRENT_TIMESTAMP END
+"""
+
+# Staged rows that are new to amazon_listings, or whose listing data changed
+_COUNT_CHANGES_SQL = """
+SELECT
+    SUM(a.sku IS NULL),
+    SUM(a.sku IS NOT NULL AND (a.asin IS NOT s.asin OR a.status IS NOT s.status
+                               OR a.price IS NOT s.price OR a.quantity IS NOT s.quantity))
+FROM amazon_listings_staging AS s
+LEFT JOIN amazon_listings AS a ON a.sku = s.sku
+"""
+
+# One pass over each side, both joined on their SKU primary keys:
+#   new      - in products, never pushed nor seen in a report
+#   changed  - on both sides, but the current content hash is not the one last pushed
+#   deleted  - known on Amazon, gone from Shopify
+LISTING_DIFF_SQL = """
+SELECT p.sku, CASE WHEN a.sku IS NULL THEN 'new' ELSE 'changed' END AS action,
+       a.asin, a.status, p.content_hash, a.last_pushed_hash
+FROM products AS p
+LEFT JOIN amazon_listings AS a ON a.sku = p.sku
+WHERE a.sku IS NULL OR a.last_pushed_hash IS NOT p.content_hash
+UNION ALL
+SELECT a.sku, 'deleted', a.asin, a.status, NULL, a.last_pushed_hash
+FROM amazon_listings AS a
+WHERE NOT EXISTS (SELECT 1 FROM products AS p WHERE p.sku = a.sku)
+"""
+
+_DIFF_SUMMARY_SQL = """
+SELECT
+    SUM(a.sku IS NULL),
+    SUM(a.sku IS NOT NULL AND a.last_pushed_hash IS NOT p.content_hash),
+    SUM(a.sku IS NOT NULL AND a.last_pushed_hash IS p.content_hash),
+    (SELECT COUNT(*) FROM amazon_listings AS a2 WHERE NOT EXISTS (SELECT 1 FROM products AS p2 WHERE p2.sku = a2.sku))
+FROM products AS p
+LEFT JOIN amazon_listings AS a ON a.sku = p.sku
+"""
+
+
+def _number(value, cast):
+    if not value:
+        return None # FBA offers have no merchant quantity, inactive ones may have no price
+    try:
+        return cast(float(value))
+    except ValueError:
+        return None
+
+
+def _open_report(source, encoding):
+    """Text stream over a report given as a path (optionally .gz), bytes or a file object."""
+    if isinstance(source, (str, Path)):
+        path = Path(source)
+        opener = gzip.open if path.suffix == ".gz" else open
+        return opener(path, "rt", encoding=encoding, errors="replace", newline="")
+    if isinstance(source, bytes):
+        source = io.BytesIO(gzip.decompress(source) if source[:2] == b"\x1f\x8b" else source)
+    if isinstance(source, io.TextIOBase):
+        return source
+    return io.TextIOWrapper(source, encoding=encoding, errors="replace", newline="")
+
+
+def iter_merchant_listings_report(stream):
+    """
+    Parse a GET_MERCHANT_LISTINGS_ALL_DATA report row by row.
+
+    Yields:
+        tuple: (sku, asin, status, price, quantity, listed_at); rows without a SKU are skipped.
+
+    Raises:
+        ValueError: If the report is empty, the header has no seller-sku column, or a row has
+            fewer fields than the header (the download was cut off mid-row).
+    """
+    # Fields are never quoted; item names can contain stray quote characters
+    reader = csv.reader(stream, delimiter="\t", quoting=csv.QUOTE_NONE)
+    header = next(reader, None)
+    if not header:
+        raise ValueError("Empty merchant listings report: no header row")
+    positions = {name.strip().lower(): index for index, name in enumerate(header)}
+    if 'seller-sku' not in positions:
+        raise ValueError("Not a merchant listings report: no seller-sku column")
+    columns = [positions.get(name) for name in _REPORT_COLUMNS]
+
+    for row in reader:
+        if not row:
+            continue # Blank line, e.g. a trailing newline
+        if len(row) < len(header):
+            raise ValueError(f"Truncated merchant listings report: line {reader.line_num} has {len(row)} "
+                             f"of {len(header)} fields")
+        values = [row[index].strip() if index is not None and index < len(row) else "" for index in columns]
+        sku, asin, status, price, quantity, listed_at = values
+        if not sku:
+            continue
+        yield (sku, asin or None, status or None, _number(price, float), _number(quantity, int), listed_at or None)
+
+
+def load_merchant_listings_report(conn: Connection, source, encoding: str = DEFAULT_REPORT_ENCODING,
+                                  batch_size: int = DEFAULT_LOAD_BATCH_SIZE, allow_empty: bool = False) -> dict:
+    """
+    Replace the Amazon side of amazon_listings with a full merchant listings report.
+
+    The report is streamed into a temporary staging table batch_size rows at a time, then
+    merged with a single INSERT ... SELECT ... ON CONFLICT and a single DELETE, all in one
+    transaction, so memory use does not grow with the report and readers never see a half
+    loaded snapshot. last_pushed_hash and pushed_at survive the load. SKUs missing from the
+    report are removed, except those that have been pushed but never appeared in any report
+    yet (Amazon may still be processing them).
+
+    Nothing is removed unless the whole report parsed: an empty, headerless or cut-off download
+    raises and rolls the load back, leaving amazon_listings as it was.
+
+    Args:
+        source: Report path (.gz is decompressed), bytes, or a binary/text file object.
+        encoding (str): Report character set (UTF-8 for e.g. the JP marketplace).
+        allow_empty (bool): Accept a report without listings even though earlier reports had
+            some, i.e. really delist everything. Refused by default, as it usually means a bad download.
+
+    Returns:
+        dict: 'rows' (SKUs in the report), 'inserted', 'updated', 'unchanged' and 'removed'.
+
+    Raises:
+        ValueError: If the report is malformed or truncated, or has no listings while the table has.
+    """
+    loaded_at = datetime.now(timezone.utc).isoformat() # Microseconds: back-to-back loads must differ
+    stream = _open_report(source, encoding)
+    conn.execute(_STAGING_SQL)
+    try:
+        with _WRITE_SECONDS.time(operation='load_merchant_listings_report'), conn:
+            conn.execute("DELETE FROM amazon_listings_staging")
+            rows = iter_merchant_listings_report(stream)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                # A SKU listed twice (e.g. once per fulfilment channel) keeps its last row
+                conn.executemany("INSERT OR REPLACE INTO amazon_listings_staging VALUES (?, ?, ?, ?, ?, ?)", batch)
+
+            total = conn.execute("SELECT COUNT(*) FROM amazon_listings_staging").fetchone()[0]
+            if not total and not allow_empty and conn.execute(
+                    "SELECT 1 FROM amazon_listings WHERE seen_at IS NOT NULL LIMIT 1").fetchone():
+                raise ValueError("Merchant listings report has no listings but earlier reports had; "
+                                 "pass allow_empty=True to remove them all")
+            inserted, updated = (value or 0 for value in conn.execute(_COUNT_CHANGES_SQL).fetchone())
+            conn.execute(_MERGE_SQL, {'loaded_at': loaded_at})
+            removed = conn.execute(
+                "DELETE FROM amazon_listings WHERE seen_at IS NOT NULL AND seen_at <> ?", (loaded_at,)
+            ).rowcount
+            conn.execute("DELETE FROM amazon_listings_staging")
+    finally:
+        if stream is not source:
+            stream.close()
+
+    _ROWS_WRITTEN.inc(inserted, table='amazon_listings', outcome='inserted')
+    _ROWS_WRITTEN.inc(updated, table='amazon_listings', outcome='updated')
+    _ROWS_WRITTEN.inc(total - inserted - updated, table='amazon_listings', outcome='unchanged')
+    return {'rows': total, 'inserted': inserted, 'updated': updated, 'unchanged': total - inserted - updated,
+            'removed': removed}
+
+
+def iter_listing_diff(conn: Connection, actions=('new', 'changed', 'deleted')):
+    """
+    Stream the SKUs where Shopify and Amazon disagree, see LISTING_DIFF_SQL.
+
+    Yields:
+        sqlite3.Row: sku, action ('new', 'changed' or 'deleted'), asin, status, content_hash, last_pushed_hash.
+    """
+    actions = set(actions)
+    for row in conn.execute(LISTING_DIFF_SQL):
+        if row['action'] in actions:
+            yield row
+
+
+def summarize_listing_diff(conn: Connection) -> dict:
+    """Counts of 'new', 'changed', 'deleted' and 'in_sync' SKUs, computed entirely in SQLite."""
+    new, changed, in_sync, deleted = conn.execute(_DIFF_SUMMARY_SQL).fetchone()
+    return {'new': new or 0, 'changed': changed or 0, 'deleted': deleted or 0, 'in_sync': in_sync or 0}
+
+
+def flag_listing_diff(conn: Connection) -> int:
+    """
+    Set needs_push on every new or changed product so the next push_dirty_products sends it.
+
+    Returns:
+        int: Number of products newly flagged.
+    """
+    with _WRITE_SECONDS.time(operation='flag_listing_diff'), conn:
+        return conn.execute(
+            """
+            UPDATE products SET needs_push = 1
+            WHERE needs_push = 0 AND content_hash IS NOT
+                (SELECT a.last_pushed_hash FROM amazon_listings AS a WHERE a.sku = products.sku)
+            """
+        ).rowcount
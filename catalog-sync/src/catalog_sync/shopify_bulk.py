@@ -0,0 +1,243 @@
+import json
+import time
+
+import requests
+
+from .shopify_client import ShopifyAPIError
+
+# Product fields pulled by the bulk export. Variants come back as separate JSONL lines
+# carrying a __parentId, each one following the product it belongs to.
+BULK_PRODUCTS_QUERY = """
+{
+  products {
+    edges {
+      node {
+        id
+        legacyResourceId
+        title
+        handle
+        bodyHtml
+        vendor
+        productType
+        status
+        tags
+        createdAt
+        updatedAt
+        featuredImage { url }
+        variants {
+          edges {
+            node {
+              id
+              legacyResourceId
+              sku
+              price
+              compareAtPrice
+              barcode
+              inventoryQuantity
+              position
+              inventoryItem { legacyResourceId }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+RUN_BULK_QUERY_MUTATION = """
+mutation bulkOperationRunQuery($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+CURRENT_BULK_OPERATION_QUERY = """
+{
+  currentBulkOperation {
+    id
+    status
+    errorCode
+    objectCount
+    url
+    partialDataUrl
+  }
+}
+"""
+
+BULK_FINISHED_STATUSES = frozenset({"COMPLETED", "FAILED", "CANCELED", "EXPIRED"})
+
+
+class ShopifyBulkOperationError(ShopifyAPIError):
+    """Raised when a bulk operation cannot be started or does not complete successfully."""
+
+
+def _legacy_id(node):
+    """Numeric REST id for a GraphQL node, from legacyResourceId or the tail of its gid."""
+    legacy = node.get("legacyResourceId")
+    if legacy is None and node.get("id"):
+        legacy = node["id"].rsplit("/", 1)[-1]
+    try:
+        return int(legacy)
+    except (TypeError, ValueError):
+        return legacy
+
+
+def _rest_variant(node):
+    inventory_item = node.get("inventoryItem") or {}
+    return {
+        "id": _legacy_id(node),
+        "sku": node.get("sku"),
+        "price": node.get("price"),
+        "compare_at_price": node.get("compareAtPrice"),
+        "barcode": node.get("barcode"),
+        "inventory_quantity": node.get("inventoryQuantity"),
+        "position": node.get("position"),
+        # inventory_levels/update webhooks only carry this id
+        "inventory_item_id": _legacy_id(inventory_item) if inventory_item else None,
+    }
+
+
+def _rest_product(node):
+    """Reshape a bulk product line so it looks like a products.json entry."""
+    image = node.get("featuredImage") or {}
+    tags = node.get("tags")
+    return {
+        "id": _legacy_id(node),
+        "admin_graphql_api_id": node.get("id"),
+        "title": node.get("title"),
+        "handle": node.get("handle"),
+        "body_html": node.get("bodyHtml"),
+        "vendor": node.get("vendor"),
+        "product_type": node.get("productType"),
+        "status": (node.get("status") or "").lower() or None,
+        "tags": ", ".join(tags) if isinstance(tags, list) else tags,
+        "created_at": node.get("createdAt"),
+        "updated_at": node.get("updatedAt"),
+        "image": {"src": image["url"]} if image.get("url") else None,
+        "variants": [],
+    }
+
+
+def iter_bulk_products(lines):
+    """
+    Stream-parse a bulk operation JSONL export into products.json-shaped dicts.
+
+    Child lines always follow their parent in a bulk export, so only the product currently
+    being assembled is held in memory; each one is yielded as soon as the next product starts.
+
+    Args:
+        lines (iterable): JSONL lines (str or bytes), e.g. from response.iter_lines() or an open file.
+
+    Yields:
+        dict: Raw product dicts with 'variants' attached, ready for _parse_product_data.
+    """
+    current = None
+    for line in lines:
+        if not line or not line.strip():
+            continue
+        node = json.loads(line)
+        parent_id = node.get("__parentId")
+        if parent_id is None:
+            if current is not None:
+                yield current
+            current = _rest_product(node)
+        elif current is not None and parent_id == current["admin_graphql_api_id"]:
+            if "/ProductVariant/" in node.get("id", ""):
+                current["variants"].append(_rest_variant(node))
+    if current is not None:
+        yield current
+
+
+class ShopifyBulkOperationClient:
+    """
+    Alternative ingestion engine to ShopifyAPIClient.iter_all_products for large stores.
+
+    Runs a GraphQL bulkOperationRunQuery, polls until Shopify has written the export, then
+    streams the JSONL result line by line. Requests go through the given ShopifyAPIClient, so
+    they share its pooled session, retry policy and rate-limit throttler.
+    """
+
+    def __init__(self, client, poll_interval=2.0, max_poll_interval=30.0, timeout=6 * 60 * 60):
+        """
+        Args:
+            client (ShopifyAPIClient): Client for the store to export.
+            poll_interval (float): Initial seconds between status polls.
+            max_poll_interval (float): Poll interval cap; the interval doubles up to this value.
+            timeout (float): Seconds to wait for the bulk operation before giving up.
+        """
+        self.client = client
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+
+    def _graphql(self, query, variables=None):
+        payload = {"query": query}
+        if variables:
+            payload["variables"] = variables
+        result = self.client._request("POST", "graphql.json", json_data=payload)
+        if result.get("errors"):
+            raise ShopifyBulkOperationError(f"GraphQL errors: {result['errors']}")
+        return result.get("data") or {}
+
+    def submit(self, query=BULK_PRODUCTS_QUERY):
+        """Start a bulk export and return its operation id."""
+        data = self._graphql(RUN_BULK_QUERY_MUTATION, {"query": query})
+        result = data.get("bulkOperationRunQuery") or {}
+        if result.get("userErrors"):
+            raise ShopifyBulkOperationError(f"bulkOperationRunQuery rejected: {result['userErrors']}")
+        return result["bulkOperation"]["id"]
+
+    def wait_for_completion(self, operation_id=None):
+        """
+        Poll currentBulkOperation until it finishes.
+
+        Returns:
+            dict: The finished operation, including the result 'url' (None when the export is empty).
+
+        Raises:
+            ShopifyBulkOperationError: If the operation fails, is cancelled/expired, or times out.
+        """
+        deadline = time.monotonic() + self.timeout
+        interval = self.poll_interval
+        while True:
+            operation = self._graphql(CURRENT_BULK_OPERATION_QUERY).get("currentBulkOperation") or {}
+            if operation_id and operation.get("id") not in (None, operation_id):
+                raise ShopifyBulkOperationError(f"Bulk operation {operation_id} was superseded by {operation.get('id')}")
+            status = operation.get("status")
+            if status in BULK_FINISHED_STATUSES:
+                if status != "COMPLETED":
+                    raise ShopifyBulkOperationError(
+                        f"Bulk operation {operation.get('id')} ended with {status} ({operation.get('errorCode')})"
+                    )
+                return operation
+            if time.monotonic() + interval > deadline:
+                raise ShopifyBulkOperationError(f"Bulk operation {operation_id} did not finish within {self.timeout}s")
+            time.sleep(interval)
+            interval = min(self.max_poll_interval, interval * 2)
+
+    def iter_result_lines(self, url):
+        """Stream the JSONL export from its signed URL without buffering the whole file."""
+        try:
+            with self.client.session.get(url, stream=True, timeout=self.client.timeout) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if line:
+                        yield line
+        except requests.exceptions.RequestException as err:
+            raise ShopifyBulkOperationError(f"Downloading bulk result failed: {err}") from err
+
+    def iter_all_products(self, query=BULK_PRODUCTS_QUERY):
+        """
+        Run a full bulk export and yield parsed products one at a time.
+
+        Yields:
+            dict: Parsed products in the same shape as ShopifyAPIClient._parse_product_data.
+        """
+        operation = self.wait_for_completion(self.submit(query))
+        if not operation.get("url"):
+            return # Shopify returns no url when the export matched nothing
+        for raw_product in iter_bulk_products(self.iter_result_lines(operation["url"])):
+            yield self.client._parse_product_data(raw_product)
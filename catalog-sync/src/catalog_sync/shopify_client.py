@@ -1,7 +1,16 @@
+import json
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qs, urlparse
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from .database import initialize_db, upsert_product
+from .metrics import REGISTRY, normalize_endpoint
+from .throttling import SHOPIFY_CALL_LIMIT_HEADER, get_shopify_throttler
 
 # Load environment variables from .env file
 load_dotenv()
@@ -10,8 +19,129 @@ SHOPIFY_STORE_URL = os.getenv("SHOPIFY_STORE_URL") # e.g., "your-store-name.mysh
 SHOPIFY_API_KEY = os.getenv("SHOPIFY_API_KEY")
 SHOPIFY_API_PASSWORD = os.getenv("SHOPIFY_API_PASSWORD") # This is the App Password or Access Token
 
+# Statuses worth retrying: rate limited or a transient server-side failure
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+# Methods that are safe to send twice. Other methods (POST, e.g. GraphQL mutations such as a bulk
+# operation submit) are only retried when the request certainly did not run: a 429, or a
+# connection that was never established
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+_REQUEST_SECONDS = REGISTRY.histogram("shopify_request_seconds", "Shopify Admin API request latency", ("endpoint",))
+_REQUESTS = REGISTRY.counter("shopify_requests_total", "Shopify Admin API responses by status", ("endpoint", "status"))
+_RETRIES = REGISTRY.counter("shopify_retries_total", "Shopify requests retried, by reason", ("endpoint", "reason"))
+_THROTTLE_WAIT = REGISTRY.counter("shopify_throttle_wait_seconds_total", "Time spent waiting for the call-limit bucket")
+
+
+class ShopifyAPIError(Exception):
+    """Raised when a Shopify request fails after all retries, or fails with a non-retryable status."""
+
+    def __init__(self, message, status_code=None, response_text=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response_text = response_text
+
+
+def _parse_retry_after(value):
+    """Return the delay in seconds from a Retry-After header (seconds or HTTP-date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _next_page_info(response):
+    """Extract the page_info cursor from the rel="next" entry of a Link header, if any."""
+    next_link = response.links.get("next", {}).get("url")
+    if not next_link:
+        return None
+    values = parse_qs(urlparse(next_link).query).get("page_info")
+    return values[0] if values else None
+
+
+def _json_body(response):
+    """Decode a response body, raising ShopifyAPIError if it is not JSON (e.g. an HTML error page)."""
+    try:
+        return response.json()
+    except ValueError as err: # requests' JSONDecodeError is a ValueError
+        raise ShopifyAPIError(f"Response is not valid JSON: {err}", status_code=response.status_code,
+                              response_text=response.text) from err
+
+
+def decode_products_page(body):
+    """
+    Decode one raw products.json page body into its list of raw products.
+
+    Raises:
+        ShopifyAPIError: If the body is not JSON or has no 'products' key, so a bad page fails the
+            walk instead of being read as an empty one.
+    """
+    try:
+        page = json.loads(body)
+    except ValueError as err:
+        raise ShopifyAPIError(f"products.json page is not valid JSON: {err}",
+                              response_text=body.decode("utf-8", "replace")) from err
+    if not isinstance(page, dict) or 'products' not in page:
+        raise ShopifyAPIError("products.json response has no 'products' key",
+                              response_text=body.decode("utf-8", "replace"))
+    return page['products']
+
+
+def parse_product_data(product_raw_data):
+    """Parse a raw REST product (API response or webhook payload) into a structured dict."""
+    # Default to None for fields that might be missing
+    sku = None
+    price = None
+    inventory_quantity = None
+
+    if product_raw_data.get('variants') and len(product_raw_data['variants']) > 0:
+        first_variant = product_raw_data['variants'][0]
+        sku = first_variant.get('sku')
+        price = first_variant.get('price')
+        inventory_quantity = first_variant.get('inventory_quantity')
+    
+    main_image_url = None
+    if product_raw_data.get('image') and product_raw_data['image'].get('src'):
+        main_image_url = product_raw_data['image'].get('src')
+    elif product_raw_data.get('images') and len(product_raw_data['images']) > 0:
+        main_image_url = product_raw_data['images'][0].get('src')
+
+    return {
+        'id': product_raw_data.get('id'),
+        'title': product_raw_data.get('title'),
+        'sku': sku,
+        'price': price,
+        'inventory_quantity': inventory_quantity,
+        'body_html': product_raw_data.get('body_html'), # Basic description
+        'main_image_url': main_image_url,
+        # Store the full variant data for now, might be useful for Task 1.1.3
+        'variants': product_raw_data.get('variants', []),
+        'raw_shopify_data': product_raw_data # Keep raw data for potential future needs/debugging
+    }
+
+
 class ShopifyAPIClient:
-    def __init__(self, store_url=None, api_key=None, api_password=None):
+    def __init__(self, store_url=None, api_key=None, api_password=None, pool_size=10,
+                 connect_timeout=5.0, read_timeout=30.0, max_retries=5, backoff_factor=0.5,
+                 max_backoff=60.0, session=None, throttler=None):
+        """
+        Args:
+            pool_size (int): Max keep-alive connections kept open to the store.
+            connect_timeout (float): Seconds to wait for the TCP/TLS connection.
+            read_timeout (float): Seconds to wait for response data.
+            max_retries (int): Retries for 429/5xx responses and connection errors before giving up.
+            backoff_factor (float): Base delay in seconds; retry n waits up to backoff_factor * 2**n (full jitter).
+            max_backoff (float): Upper bound for a single backoff delay.
+            session (requests.Session, optional): Pre-configured session, mainly for tests.
+            throttler (ShopifyCallLimitThrottler, optional): Rate budget to draw from. Defaults to the
+                process-wide throttler for store_url, so every client of the same store shares one budget.
+        """
         self.store_url = store_url or SHOPIFY_STORE_URL
         self.api_key = api_key or SHOPIFY_API_KEY
         self.api_password = api_password or SHOPIFY_API_PASSWORD
@@ -21,60 +151,100 @@ class ShopifyAPIClient:
 
         self.base_url = f"https://{self.api_key}:{self.api_password}@{self.store_url}/admin/api/2023-10" # Using 2023-10 API version, can be updated
 
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+        # One pooled session per client so repeated calls reuse the same keep-alive connections
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        session.headers.update({"Content-Type": "application/json"})
+        self.session = session
+        self.throttler = throttler or get_shopify_throttler(self.store_url)
+
+    def close(self):
+        """Close the pooled connections held by this client."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def _parse_product_data(self, product_raw_data):
-        """Helper function to parse raw product data into a structured dict."""
-        # Default to None for fields that might be missing
-        sku = None
-        price = None
-        inventory_quantity = None
-
-        if product_raw_data.get('variants') and len(product_raw_data['variants']) > 0:
-            first_variant = product_raw_data['variants'][0]
-            sku = first_variant.get('sku')
-            price = first_variant.get('price')
-            inventory_quantity = first_variant.get('inventory_quantity')
-        
-        main_image_url = None
-        if product_raw_data.get('image') and product_raw_data['image'].get('src'):
-            main_image_url = product_raw_data['image'].get('src')
-        elif product_raw_data.get('images') and len(product_raw_data['images']) > 0:
-            main_image_url = product_raw_data['images'][0].get('src')
+        """Helper function to parse raw product data into a structured dict, see parse_product_data."""
+        return parse_product_data(product_raw_data)
 
-        return {
-            'id': product_raw_data.get('id'),
-            'title': product_raw_data.get('title'),
-            'sku': sku,
-            'price': price,
-            'inventory_quantity': inventory_quantity,
-            'body_html': product_raw_data.get('body_html'), # Basic description
-            'main_image_url': main_image_url,
-            # Store the full variant data for now, might be useful for Task 1.1.3
-            'variants': product_raw_data.get('variants', []),
-            'raw_shopify_data': product_raw_data # Keep raw data for potential future needs/debugging
-        }
+    def _backoff_delay(self, attempt, response=None):
+        """Seconds to wait before retry number attempt (0-based); Retry-After wins when the server sends it."""
+        if response is not None:
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return retry_after
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
 
-    def _request(self, method, endpoint, params=None, json_data=None):
+    def _send(self, method, endpoint, params=None, json_data=None):
+        """
+        Send a request through the pooled session, retrying 429/5xx and connection errors.
+
+        Only idempotent methods are retried after a timeout or a 5xx, since the store may have
+        acted on the first attempt; see IDEMPOTENT_METHODS.
+
+        Returns:
+            requests.Response: The successful response (headers are needed for pagination and rate limits).
+
+        Raises:
+            ShopifyAPIError: On a non-retryable error or once max_retries is exhausted.
+        """
         url = f"{self.base_url}/{endpoint}"
-        headers = {
-            "Content-Type": "application/json",
-        }
-        try:
-            response = requests.request(method, url, params=params, json=json_data, headers=headers)
-            response.raise_for_status()  # Raises an HTTPError for bad responses (4XX or 5XX)
-            return response.json()
-        except requests.exceptions.HTTPError as errh:
-            print(f"Http Error: {errh} - {response.text}")
-            # TODO: Add more robust error logging/handling
-            return None
-        except requests.exceptions.ConnectionError as errc:
-            print(f"Error Connecting: {errc}")
-            return None
-        except requests.exceptions.Timeout as errt:
-            print(f"Timeout Error: {errt}")
-            return None
-        except requests.exceptions.RequestException as err:
-            print(f"Oops: Something Else: {err}")
-            return None
+        label = normalize_endpoint(endpoint)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            _THROTTLE_WAIT.inc(self.throttler.acquire() or 0)
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, params=params, json=json_data, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                _REQUESTS.inc(endpoint=label, status="error")
+                never_sent = isinstance(err, requests.exceptions.ConnectTimeout)
+                if attempt >= self.max_retries or not (idempotent or never_sent):
+                    raise ShopifyAPIError(f"{method} {endpoint} failed after {attempt + 1} attempts: {err}") from err
+                _RETRIES.inc(endpoint=label, reason="connection")
+                time.sleep(self._backoff_delay(attempt))
+                attempt += 1
+                continue
+            except requests.exceptions.RequestException as err:
+                _REQUESTS.inc(endpoint=label, status="error")
+                raise ShopifyAPIError(f"{method} {endpoint} failed: {err}") from err
+            _REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=label)
+            _REQUESTS.inc(endpoint=label, status=response.status_code)
+
+            self.throttler.update_from_header(response.headers.get(SHOPIFY_CALL_LIMIT_HEADER))
+            if response.status_code == 429:
+                self.throttler.record_throttled()
+            retryable = response.status_code in RETRYABLE_STATUS_CODES and (idempotent or response.status_code == 429)
+            if retryable and attempt < self.max_retries:
+                _RETRIES.inc(endpoint=label, reason=response.status_code)
+                time.sleep(self._backoff_delay(attempt, response))
+                attempt += 1
+                continue
+            if response.status_code >= 400:
+                raise ShopifyAPIError(
+                    f"{method} {endpoint} returned HTTP {response.status_code}",
+                    status_code=response.status_code,
+                    response_text=response.text,
+                )
+            return response
+
+    def _request(self, method, endpoint, params=None, json_data=None):
+        """Send a request and return the decoded JSON body. Raises ShopifyAPIError on failure."""
+        return _json_body(self._send(method, endpoint, params=params, json_data=json_data))
 
     def get_products(self, limit=50, page_info=None):
         """
@@ -85,24 +255,78 @@ class ShopifyAPIClient:
             page_info (str, optional): Page info token for fetching next/previous page.
         
         Returns:
-            dict: JSON response containing products and pagination info, or None on error.
+            dict: 'products' (parsed; empty when the page has none), 'raw_response' and
+                'next_page_info' (cursor for the following page, None on the last page).
+
+        Raises:
+            ShopifyAPIError: If the request fails or the response has no 'products' key.
         """
         params = {"limit": limit}
         if page_info:
             params["page_info"] = page_info
-            
-        # Example: Fetching products (actual endpoint might vary based on what's needed)
-        # Shopify uses cursor-based pagination. The response will contain link headers for next/prev.
-        # For simplicity, this initial version doesn't fully implement link header parsing.
-        # We will need to enhance this for robust pagination.
-        
-        raw_response = self._request("GET", "products.json", params=params)
-        if raw_response and 'products' in raw_response:
-            parsed_products = [self._parse_product_data(p) for p in raw_response['products']]
-            # Pass along pagination info if present in raw_response (e.g. Link headers for Shopify)
-            # For now, returning parsed products and the raw response for pagination handling later
-            return {'products': parsed_products, 'raw_response': raw_response}
-        return None
+
+        response = self._send("GET", "products.json", params=params)
+        raw_response = _json_body(response)
+        if not raw_response or 'products' not in raw_response:
+            raise ShopifyAPIError("products.json response has no 'products' key", status_code=response.status_code,
+                                  response_text=response.text)
+        return {
+            'products': [self._parse_product_data(p) for p in raw_response['products']],
+            'raw_response': raw_response,
+            'next_page_info': _next_page_info(response),
+        }
+
+    def iter_all_products(self, page_size=250, params=None):
+        """
+        Walk the whole catalog, following the Link header rel="next" cursors.
+
+        Products are yielded one at a time as each page arrives, so memory stays bounded by a
+        single page regardless of catalog size. The generator can be passed straight to
+        database.upsert_products to stream the catalog into SQLite.
+
+        Args:
+            page_size (int): Products per request (Shopify allows at most 250).
+            params (dict, optional): Extra filters for the first request (e.g. updated_at_min).
+                Shopify rejects filters alongside page_info, so later pages only send the cursor.
+
+        Yields:
+            dict: Parsed products, see _parse_product_data.
+
+        Raises:
+            ShopifyAPIError: If a page cannot be fetched; the walk is not silently truncated.
+        """
+        for body, _ in self.iter_product_pages(page_size=page_size, params=params):
+            for product in decode_products_page(body):
+                yield self._parse_product_data(product)
+
+    def iter_product_pages(self, page_size=250, params=None, page_info=None):
+        """
+        Walk the catalog page by page without decoding the responses.
+
+        Used by the sync pipeline, which decodes pages on separate worker threads so the next
+        request is already in flight while earlier pages are parsed.
+
+        Args:
+            page_size (int): Products per request (Shopify allows at most 250).
+            params (dict, optional): Filters for the first request, see iter_all_products.
+            page_info (str, optional): Cursor to resume from instead of starting at the first page.
+
+        Yields:
+            tuple: (body, next_page_info) where body is the raw JSON bytes of one products.json
+                page and next_page_info is the cursor of the following page (None on the last page).
+        """
+        if page_info:
+            request_params = {"limit": page_size, "page_info": page_info}
+        else:
+            request_params = dict(params or {})
+            request_params["limit"] = page_size
+        while True:
+            response = self._send("GET", "products.json", params=request_params)
+            page_info = _next_page_info(response)
+            yield response.content, page_info
+            if not page_info:
+                return
+            request_params = {"limit": page_size, "page_info": page_info}
 
     def get_product_details(self, product_id):
         """
@@ -112,12 +336,76 @@ class ShopifyAPIClient:
             product_id (int or str): The ID of the Shopify product.
             
         Returns:
-            dict: Parsed product details, or None on error.
+            dict: Parsed product details.
+
+        Raises:
+            ShopifyAPIError: If the request fails (e.g. status_code 404 for an unknown product).
         """
+        return self._fetch_product(product_id)
+
+    def _fetch_product(self, product_id):
         raw_product = self._request("GET", f"products/{product_id}.json")
-        if raw_product and 'product' in raw_product:
-            return self._parse_product_data(raw_product['product'])
-        return None
+        if not raw_product or 'product' not in raw_product:
+            raise ShopifyAPIError(f"Response for product {product_id} has no 'product' key")
+        return self._parse_product_data(raw_product['product'])
+
+    def get_product_details_many(self, product_ids, concurrency=8):
+        """
+        Fetch details for many products concurrently over a bounded thread pool.
+
+        All workers share this client's pooled session and the store's throttler, so the
+        fan-out never exceeds the store's rate budget; concurrency only hides network latency.
+
+        Args:
+            product_ids (iterable): Shopify product IDs.
+            concurrency (int): Maximum requests in flight. Keep it at or below pool_size so
+                every worker gets a keep-alive connection.
+
+        Returns:
+            list: One dict per input ID, in input order, with 'id', 'product' (parsed product
+                or None) and 'error' (ShopifyAPIError or None).
+        """
+        product_ids = list(product_ids)
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        def fetch(product_id):
+            try:
+                return {'id': product_id, 'product': self._fetch_product(product_id), 'error': None}
+            except ShopifyAPIError as err:
+                return {'id': product_id, 'product': None, 'error': err}
+
+        with ThreadPoolExecutor(max_workers=min(concurrency, max(1, len(product_ids)))) as executor:
+            # executor.map preserves input order regardless of completion order
+            return list(executor.map(fetch, product_ids))
+
+    def get_inventory_levels(self, inventory_item_ids, page_size=250):
+        """
+        Fetch the levels of inventory items at every location.
+
+        Args:
+            inventory_item_ids (iterable): Shopify inventory item IDs; requested 50 at a time,
+                the most inventory_levels.json accepts per call.
+            page_size (int): Levels per request (Shopify allows at most 250).
+
+        Returns:
+            list: Level dicts with 'inventory_item_id', 'location_id' and 'available'.
+
+        Raises:
+            ShopifyAPIError: If a request fails.
+        """
+        item_ids = [str(item_id) for item_id in inventory_item_ids]
+        levels = []
+        for start in range(0, len(item_ids), 50):
+            params = {"inventory_item_ids": ",".join(item_ids[start:start + 50]), "limit": page_size}
+            while True:
+                response = self._send("GET", "inventory_levels.json", params=params)
+                levels.extend(_json_body(response).get("inventory_levels", []))
+                page_info = _next_page_info(response)
+                if not page_info:
+                    break
+                params = {"limit": page_size, "page_info": page_info}
+        return levels
 
 # Example usage (for testing purposes, will be removed or moved to a test file)
 if __name__ == "__main__":
@@ -0,0 +1,387 @@
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlite3 import Connection
+
+from .database import (DEFAULT_BATCH_SIZE, advance_sync_watermark, clear_sync_checkpoint, get_sync_checkpoint,
+                       get_sync_watermark, initialize_db, save_sync_checkpoint, upsert_products)
+from .feed_builder import MAX_MESSAGES_PER_FEED
+from .metrics import REGISTRY
+from .shopify_client import ShopifyAPIError, decode_products_page, parse_product_data
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+# Subtracted from the walk's start time before it caps the watermark, to absorb clock skew
+# between this host and Shopify
+WATERMARK_OVERLAP_SECONDS = 300
+
+_STAGE_SECONDS = REGISTRY.counter("sync_stage_seconds_total", "Busy time of each SyncPipeline stage", ("stage",))
+_PAGES_WRITTEN = REGISTRY.counter("sync_pages_total", "Shopify pages committed by SyncPipeline")
+
+
+def _to_utc_iso(timestamp):
+    """Normalise a Shopify timestamp (e.g. "2024-01-05T10:00:00-05:00") to a sortable UTC ISO string."""
+    if not timestamp:
+        return None
+    try:
+        parsed = datetime.fromisoformat(timestamp)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat(timespec="seconds")
+
+
+def _walk_started_at():
+    """Watermark ceiling for a walk starting now: UTC now minus WATERMARK_OVERLAP_SECONDS."""
+    started = datetime.now(timezone.utc) - timedelta(seconds=WATERMARK_OVERLAP_SECONDS)
+    return started.isoformat(timespec="seconds")
+
+
+def _next_watermark(newest, started_at):
+    """
+    The watermark a completed walk may advance to: the newest updated_at seen, but never past
+    the walk's start. A product edited mid-walk on a page that was already fetched gets an
+    updated_at below the newest one seen on later pages; the cap makes the next run fetch it.
+    """
+    if not newest:
+        return None
+    return min(newest, started_at) if started_at else newest
+
+
+def _summarize(batches):
+    totals = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+    for batch in batches:
+        for key in totals:
+            totals[key] += batch[key]
+    return totals
+
+
+def run_incremental_sync(client, conn: Connection, store_id: str = None, page_size: int = 250,
+                         batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    """
+    Pull only the products updated since the store's last watermark and upsert them.
+
+    The first run for a store (no watermark yet) walks the full catalog. The watermark is set
+    to the newest updated_at seen, capped at the time the walk started (see _next_watermark),
+    and only advances after every batch has committed, so a run that fails part-way is simply
+    repeated from the old watermark next time. updated_at_min is inclusive, so the boundary
+    products are fetched again; their unchanged content hash makes that re-upsert a no-op.
+
+    Args:
+        client (ShopifyAPIClient): Client for the store being synced.
+        conn: Open database connection.
+        store_id (str, optional): Key for the watermark; defaults to client.store_url.
+        page_size (int): Products per Shopify request.
+        batch_size (int): Products per database transaction.
+
+    Returns:
+        dict: 'mode' ('full' or 'incremental'), 'watermark_before', 'watermark_after',
+            'batches' (per-batch counts from upsert_products) and 'totals'.
+    """
+    store_id = store_id or client.store_url
+    started_at = _walk_started_at()
+    watermark = get_sync_watermark(conn, store_id)
+    params = {"updated_at_min": watermark} if watermark else None
+
+    newest = {'updated_at': watermark}
+
+    def track_updated_at(products):
+        for product in products:
+            updated_at = _to_utc_iso((product.get('raw_shopify_data') or {}).get('updated_at'))
+            if updated_at and (newest['updated_at'] is None or updated_at > newest['updated_at']):
+                newest['updated_at'] = updated_at
+            yield product
+
+    batches = upsert_products(conn, track_updated_at(client.iter_all_products(page_size=page_size, params=params)),
+                              batch_size=batch_size, with_variants=True)
+
+    next_watermark = _next_watermark(newest['updated_at'], started_at)
+    if next_watermark and next_watermark != watermark:
+        advance_sync_watermark(conn, store_id, next_watermark)
+
+    return {
+        'mode': 'incremental' if watermark else 'full',
+        'watermark_before': watermark,
+        'watermark_after': get_sync_watermark(conn, store_id),
+        'batches': batches,
+        'totals': _summarize(batches),
+    }
+
+
+class SyncPipeline:
+    """
+    Incremental sync as overlapping fetch -> transform -> write -> push stages.
+
+    - fetch: one thread follows the Shopify cursor chain (pages can only be requested in order)
+      and passes the raw page bodies on without decoding them.
+    - transform: transform_workers threads decode the JSON and parse the products.
+    - write: the calling thread is the only SQLite writer. It commits pages in fetch order and
+      checkpoints the cursor of the next page after each one.
+    - push (optional): a thread with its own connection calls pusher(conn) whenever
+      push_threshold products have changed, and once more at the end.
+
+    Stages are joined by bounded queues, so a slow stage blocks the ones before it instead of
+    buffering the catalog in memory, and throughput settles at the speed of the slowest stage
+    (normally the Shopify rate limit) rather than the sum of all of them.
+
+    stop() shuts down gracefully: no further pages are fetched, pages already fetched are still
+    written, and the checkpoint lets the next run() continue from the first unfetched page. A
+    failed request ends the run the same way and is then raised from run(); an error in a later
+    stage also discards the pages still in flight.
+    """
+
+    def __init__(self, client, db_path: str, store_id: str = None, page_size: int = 250, transform_workers: int = 2,
+                 queue_size: int = 4, batch_size: int = DEFAULT_BATCH_SIZE, pusher=None,
+                 push_threshold: int = MAX_MESSAGES_PER_FEED, profile: dict = None):
+        """
+        Args:
+            client (ShopifyAPIClient): Client for the store being synced.
+            db_path (str): Catalog database file; the push stage opens a second connection to it.
+            store_id (str, optional): Key for the watermark and checkpoint; defaults to client.store_url.
+            page_size (int): Products per Shopify request.
+            transform_workers (int): Threads decoding and parsing pages.
+            queue_size (int): Pages buffered between two stages before the producer blocks.
+            batch_size (int): Products per database transaction.
+            pusher (callable, optional): pusher(conn) pushes dirty products to Amazon, e.g.
+                lambda conn: push_dirty_products(amazon_client, conn, builder, marketplace_ids).
+            push_threshold (int): Changed products that trigger a push while the sync is running.
+            profile (dict, optional): PRAGMA profile for the connections, see initialize_db.
+        """
+        if transform_workers < 1:
+            raise ValueError("transform_workers must be at least 1")
+        self.client = client
+        self.db_path = db_path
+        self.store_id = store_id or client.store_url
+        self.page_size = page_size
+        self.transform_workers = transform_workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.pusher = pusher
+        self.push_threshold = push_threshold
+        self.profile = profile
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Ask a running sync to finish the pages already fetched and return."""
+        self._stop.set()
+
+    def _fail(self, err, discard=True):
+        """Record the first error and stop fetching; discard also drops pages still in flight."""
+        with self._lock:
+            if self._error is None:
+                self._error = err
+            if discard:
+                self._discard = True
+        self._stop.set()
+        with self._push_cond:
+            self._push_cond.notify_all()
+
+    def _add_time(self, stage, seconds):
+        _STAGE_SECONDS.inc(seconds, stage=stage)
+        with self._lock:
+            self._stage_seconds[stage] += seconds
+
+    # --- Stages ---
+
+    def _fetch(self, params, page_info):
+        seq = 0
+        try:
+            while True:
+                try:
+                    pages = self.client.iter_product_pages(page_size=self.page_size, params=params, page_info=page_info)
+                    while not self._stop.is_set():
+                        started = time.monotonic()
+                        page = next(pages, None)
+                        self._add_time('fetch', time.monotonic() - started)
+                        if page is None:
+                            self._complete = True
+                            break
+                        self._pages.put((seq, page[0], page[1])) # Blocks while transform is behind
+                        seq += 1
+                    return
+                except ShopifyAPIError as err:
+                    # Cursors expire; fall back to the watermark if the saved one is rejected
+                    if not (page_info and seq == 0 and err.status_code == 400):
+                        raise
+                    logger.warning("Resume cursor for %s was rejected (%s); restarting from the watermark",
+                                   self.store_id, err)
+                    page_info = None
+        except BaseException as err:
+            # Pages fetched before the failure are intact; commit them so the checkpoint covers them
+            self._fail(err, discard=False)
+        finally:
+            for _ in range(self.transform_workers):
+                self._pages.put(_DONE)
+
+    def _transform(self):
+        while True:
+            item = self._pages.get()
+            if item is _DONE:
+                self._parsed.put(_DONE)
+                return
+            if self._discard:
+                continue # Keep draining so the fetcher never blocks on a full queue
+            seq, body, next_page_info = item
+            started = time.monotonic()
+            try:
+                products = [parse_product_data(raw) for raw in decode_products_page(body)]
+            except BaseException as err:
+                self._fail(err)
+                continue
+            newest = max((_to_utc_iso(p['raw_shopify_data'].get('updated_at')) or '' for p in products),
+                         default='') or None
+            self._add_time('transform', time.monotonic() - started)
+            self._parsed.put((seq, products, newest, next_page_info))
+
+    def _write(self, conn):
+        """Writer loop (calling thread): commit pages in order and checkpoint after each."""
+        pending = {}
+        next_seq = 0
+        while self._transforms_finished < self.transform_workers:
+            item = self._parsed.get()
+            if item is _DONE:
+                self._transforms_finished += 1
+                continue
+            if self._discard:
+                continue
+            pending[item[0]] = item
+            # Transform workers finish out of order; hold pages back until the gap is filled
+            while next_seq in pending and not self._discard:
+                _, products, newest, next_page_info = pending.pop(next_seq)
+                started = time.monotonic()
+                try:
+                    batches = upsert_products(conn, products, self.batch_size, with_variants=True)
+                    if newest and (self._newest is None or newest > self._newest):
+                        self._newest = newest
+                    if next_page_info:
+                        save_sync_checkpoint(conn, self.store_id, next_page_info, self._newest, self._started_at)
+                except BaseException as err:
+                    self._fail(err)
+                    break
+                self._add_time('write', time.monotonic() - started)
+                self._batches.extend(batches)
+                self._pages_written += 1
+                _PAGES_WRITTEN.inc()
+                next_seq += 1
+
+                changed = sum(batch['inserted'] + batch['updated'] for batch in batches)
+                if changed and self.pusher:
+                    with self._push_cond:
+                        self._unpushed += changed
+                        if self._unpushed >= self.push_threshold:
+                            self._push_cond.notify_all()
+
+    def _push(self):
+        conn = None
+        try:
+            conn = initialize_db(self.db_path, profile=self.profile)
+            while True:
+                with self._push_cond:
+                    self._push_cond.wait_for(
+                        lambda: self._writes_done or self._discard or self._unpushed >= self.push_threshold
+                    )
+                    if self._discard or (self._writes_done and not self._unpushed):
+                        return
+                    self._unpushed = 0
+                started = time.monotonic()
+                self._pushes.append(self.pusher(conn))
+                self._add_time('push', time.monotonic() - started)
+        except BaseException as err:
+            self._fail(err)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    # --- Driver ---
+
+    def run(self) -> dict:
+        """
+        Sync the store, resuming from the checkpoint of an interrupted run if there is one.
+
+        Returns:
+            dict: 'mode' ('full', 'incremental' or 'resumed'), 'watermark_before', 'watermark_after',
+                'pages', 'batches', 'totals', 'pushes' (pusher return values), 'stopped' (True if
+                stop() ended the run early), 'elapsed_seconds', 'rows_per_second' (products processed
+                per second of wall time) and 'stage_seconds' (busy time per stage). The per-request
+                detail is in metrics.REGISTRY.
+
+        Raises:
+            Exception: The first error raised by any stage, after every stage has shut down.
+        """
+        self._lock = threading.Lock()
+        self._push_cond = threading.Condition()
+        self._pages = queue.Queue(maxsize=self.queue_size)
+        self._parsed = queue.Queue(maxsize=self.queue_size)
+        self._error = None
+        self._discard = False
+        self._complete = False
+        self._writes_done = False
+        self._unpushed = 0
+        self._batches, self._pushes = [], []
+        self._pages_written = 0
+        self._transforms_finished = 0
+        self._stage_seconds = {'fetch': 0.0, 'transform': 0.0, 'write': 0.0, 'push': 0.0}
+
+        started = time.monotonic()
+        conn = initialize_db(self.db_path, profile=self.profile)
+        try:
+            watermark = get_sync_watermark(conn, self.store_id)
+            checkpoint = get_sync_checkpoint(conn, self.store_id)
+            page_info, self._newest, self._started_at = checkpoint if checkpoint else (None, None, None)
+            # A resumed walk keeps the ceiling of the run that fetched its first pages
+            self._started_at = self._started_at or _walk_started_at()
+            params = {"updated_at_min": watermark} if watermark else None
+
+            threads = [threading.Thread(target=self._fetch, args=(params, page_info), name="sync-fetch", daemon=True)]
+            threads += [threading.Thread(target=self._transform, name=f"sync-transform-{i}", daemon=True)
+                        for i in range(self.transform_workers)]
+            if self.pusher:
+                threads.append(threading.Thread(target=self._push, name="sync-push", daemon=True))
+            for thread in threads:
+                thread.start()
+
+            try:
+                self._write(conn)
+            except BaseException as err:
+                # e.g. KeyboardInterrupt: let the other stages wind down before re-raising
+                self._fail(err)
+                while self._transforms_finished < self.transform_workers:
+                    if self._parsed.get() is _DONE:
+                        self._transforms_finished += 1
+            finally:
+                with self._push_cond:
+                    self._writes_done = True
+                    self._push_cond.notify_all()
+                for thread in threads:
+                    thread.join()
+
+            if self._error is not None:
+                raise self._error
+            if self._complete:
+                next_watermark = _next_watermark(self._newest, self._started_at)
+                if next_watermark and next_watermark != watermark:
+                    advance_sync_watermark(conn, self.store_id, next_watermark)
+                clear_sync_checkpoint(conn, self.store_id)
+
+            totals = _summarize(self._batches)
+            elapsed = time.monotonic() - started
+            return {
+                'mode': 'resumed' if checkpoint else ('incremental' if watermark else 'full'),
+                'watermark_before': watermark,
+                'watermark_after': get_sync_watermark(conn, self.store_id),
+                'pages': self._pages_written,
+                'batches': self._batches,
+                'totals': totals,
+                'pushes': self._pushes,
+                'stopped': not self._complete,
+                'elapsed_seconds': elapsed,
+                'rows_per_second': (totals['inserted'] + totals['updated'] + totals['unchanged']) / elapsed if elapsed else 0.0,
+                'stage_seconds': dict(self._stage_seconds),
+            }
+        finally:
+            conn.close()
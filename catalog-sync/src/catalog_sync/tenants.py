@@ -0,0 +1,304 @@
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from .amazon_sp_api_client import AmazonSPAPIClient
+from .database import initialize_db, register_content_hash_raw_fields
+from .feed_builder import ListingsFeedBuilder, push_dirty_products
+from .feed_poller import FeedStatusPoller
+from .mapping import compile_mapping, load_mapping
+from .shopify_client import ShopifyAPIClient
+from .sync_engine import SyncPipeline
+from .throttling import ShopifyCallLimitThrottler, SPAPIRateLimiter
+from .token_cache import token_cache_key
+
+# Load environment variables from .env file (tenant configs reference secrets as ${VAR})
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANTS_PATH = os.getenv("CATALOG_SYNC_TENANTS", "tenants.json")
+DEFAULT_SHARD_DIR = "shards" # One catalog database per tenant: <shard_dir>/<name>.db
+
+# Seconds a tenant may sync before yielding its worker; it resumes from its checkpoint later
+DEFAULT_TIME_SLICE = 300.0
+
+_TENANT_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+_SHOPIFY_KEYS = ('store_url', 'api_key', 'api_password')
+_AMAZON_KEYS = ('client_id', 'client_secret', 'refresh_token', 'endpoint', 'seller_id', 'marketplace_ids')
+
+
+def _expand_env(value):
+    """Replace ${VAR} references in every string of a config value with environment variables."""
+    if isinstance(value, str):
+        return os.path.expandvars(value)
+    if isinstance(value, dict):
+        return {key: _expand_env(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_expand_env(item) for item in value]
+    return value
+
+
+def _require(section: dict, keys, where: str):
+    missing = [key for key in keys if not section.get(key) or (isinstance(section[key], str) and "${" in section[key])]
+    if missing:
+        raise ValueError(f"{where} is missing {', '.join(missing)} (or an environment variable it references is unset)")
+
+
+def assign_rate_shares(tenants: list) -> list:
+    """
+    Split shared rate limits between the tenants that draw on them, in proportion to 'weight'.
+
+    Shopify limits apply per store and SP-API limits per selling partner/application pair, but
+    every worker process has its own throttlers. Tenants that share a store (or SP-API
+    credentials) therefore get 'shopify_rate_share' (or 'sp_api_rate_share') below 1.0, so that
+    together they stay within the one budget Shopify or Amazon actually grants.
+    """
+    shopify_weights, sp_api_weights = {}, {}
+    for tenant in tenants:
+        store = tenant['shopify']['store_url']
+        shopify_weights[store] = shopify_weights.get(store, 0) + tenant['weight']
+        if tenant.get('amazon'):
+            key = token_cache_key(tenant['amazon']['client_id'], tenant['amazon']['refresh_token'])
+            sp_api_weights[key] = sp_api_weights.get(key, 0) + tenant['weight']
+    for tenant in tenants:
+        tenant['shopify_rate_share'] = tenant['weight'] / shopify_weights[tenant['shopify']['store_url']]
+        if tenant.get('amazon'):
+            key = token_cache_key(tenant['amazon']['client_id'], tenant['amazon']['refresh_token'])
+            tenant['sp_api_rate_share'] = tenant['weight'] / sp_api_weights[key]
+    return tenants
+
+
+def load_tenants(path: str = DEFAULT_TENANTS_PATH, shard_dir: str = DEFAULT_SHARD_DIR) -> list:
+    """
+    Read and validate the tenant list from a JSON file.
+
+    The file holds {"tenants": [...]} (or just the list). Each tenant is one Shopify store synced
+    into its own database shard and, optionally, pushed to one marketplace of an Amazon seller
+    account:
+
+        {"name": "us-main",
+         "shopify": {"store_url": "main.myshopify.com", "api_key": "${MAIN_KEY}", "api_password": "${MAIN_PASSWORD}"},
+         "amazon": {"client_id": "...", "client_secret": "${SP_SECRET}", "refresh_token": "${US_REFRESH_TOKEN}",
+                    "endpoint": "https://sellingpartnerapi-na.amazon.com", "seller_id": "A1...",
+                    "marketplace_ids": ["ATVPDKIKX0DER"]},
+         "mapping": "mappings/us.json", "weight": 2}
+
+    Optional keys: 'db_path' (default <shard_dir>/<name>.db), 'mapping' (a mapping spec file,
+    DEFAULT_MAPPING otherwise), 'weight' (share of rate limits shared with other tenants,
+    default 1), 'page_size' and 'transform_workers'.
+
+    'marketplace_ids' must hold exactly one marketplace: a shard tracks one pushed state per SKU,
+    and listings are built with marketplace-specific attributes. To list a store on several
+    marketplaces, configure one tenant per marketplace (they share the store's rate budget).
+
+    Returns:
+        list: Tenant dicts with defaults filled in and rate shares assigned.
+
+    Raises:
+        ValueError: If a tenant is incomplete or targets several marketplaces, or two tenants share
+            a name or a database.
+    """
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    entries = config.get("tenants", []) if isinstance(config, dict) else config
+
+    tenants, names, db_paths = [], set(), set()
+    for entry in entries:
+        tenant = _expand_env(dict(entry))
+        name = tenant.get('name')
+        if not name or not _TENANT_NAME_RE.match(name):
+            raise ValueError(f"Tenant name {name!r} must be letters, digits, '.', '_' or '-'")
+        if name in names:
+            raise ValueError(f"Duplicate tenant name '{name}'")
+        _require(tenant.get('shopify') or {}, _SHOPIFY_KEYS, f"Tenant '{name}' shopify config")
+        if tenant.get('amazon'):
+            _require(tenant['amazon'], _AMAZON_KEYS, f"Tenant '{name}' amazon config")
+            if isinstance(tenant['amazon']['marketplace_ids'], str) or len(tenant['amazon']['marketplace_ids']) != 1:
+                raise ValueError(f"Tenant '{name}' must list exactly one marketplace in marketplace_ids; "
+                                 f"configure one tenant per marketplace")
+
+        tenant['db_path'] = str(tenant.get('db_path') or Path(shard_dir) / f"{name}.db")
+        if tenant['db_path'] in db_paths:
+            raise ValueError(f"Tenant '{name}' shares database {tenant['db_path']} with another tenant")
+        tenant['weight'] = float(tenant.get('weight', 1))
+        if tenant['weight'] <= 0:
+            raise ValueError(f"Tenant '{name}' weight must be positive")
+
+        names.add(name)
+        db_paths.add(tenant['db_path'])
+        tenants.append(tenant)
+    return assign_rate_shares(tenants)
+
+
+def _tenant_amazon(tenant: dict):
+    """(AmazonSPAPIClient, pusher) for the tenant; pusher(conn) feeds its dirty products to its marketplace."""
+    amazon = tenant['amazon']
+    marketplace_id = amazon['marketplace_ids'][0]
+    client = AmazonSPAPIClient(client_id=amazon['client_id'], client_secret=amazon['client_secret'],
+                               refresh_token=amazon['refresh_token'], endpoint=amazon['endpoint'],
+                               rate_limiter=SPAPIRateLimiter(share=tenant.get('sp_api_rate_share', 1.0)))
+    spec = load_mapping(tenant['mapping']) if tenant.get('mapping') else None
+    builder = ListingsFeedBuilder(amazon['seller_id'], marketplace_id, mapping=compile_mapping(spec, marketplace_id))
+    if builder.uses_raw_data:
+        # Before the sync writes anything, so edits to raw.* fields the mapping reads make products dirty
+        conn = initialize_db(tenant['db_path'])
+        try:
+            register_content_hash_raw_fields(conn, builder.mapping.raw_fields)
+        finally:
+            conn.close()
+    return client, lambda conn: push_dirty_products(client, conn, builder, [marketplace_id])
+
+
+def settle_tenant_feeds(client, conn, pusher) -> list:
+    """
+    Poll the shard's due feeds once, then push the products that finished feeds left dirty.
+
+    Products stay out of every push while their feed is unsettled (see push_dirty_products), so
+    each shard has to run this regularly; sync_tenant does so after every slice.
+
+    Returns:
+        list: Feed submissions of the follow-up push.
+    """
+    with FeedStatusPoller(client, conn) as poller:
+        poller.poll_once()
+    return pusher(conn)
+
+
+def sync_tenant(tenant: dict, time_slice: float = None) -> dict:
+    """
+    Sync one tenant into its shard with SyncPipeline (runs inside a scheduler worker process).
+
+    Clients and rate limiters are built here from the tenant config rather than from the .env
+    credentials, so every tenant uses its own. After time_slice seconds the pipeline is stopped
+    gracefully; the checkpoint lets the next call continue where this one left off. Tenants with
+    an Amazon account then settle their finished feeds, see settle_tenant_feeds.
+
+    Returns:
+        dict: 'tenant', 'mode', 'pages', 'totals', 'feeds' (feeds submitted), 'stopped',
+            'elapsed_seconds', 'rows_per_second' and 'error' (None, or the error message).
+    """
+    summary = {'tenant': tenant['name'], 'mode': None, 'pages': 0, 'totals': {}, 'feeds': 0, 'stopped': False,
+               'elapsed_seconds': 0.0, 'rows_per_second': 0.0, 'error': None}
+    shopify = tenant['shopify']
+    client = ShopifyAPIClient(store_url=shopify['store_url'], api_key=shopify['api_key'],
+                              api_password=shopify['api_password'],
+                              throttler=ShopifyCallLimitThrottler(share=tenant.get('shopify_rate_share', 1.0)))
+    timer = None
+    try:
+        Path(tenant['db_path']).parent.mkdir(parents=True, exist_ok=True)
+        amazon_client, pusher = _tenant_amazon(tenant) if tenant.get('amazon') else (None, None)
+        pipeline = SyncPipeline(client, tenant['db_path'], page_size=tenant.get('page_size', 250),
+                                transform_workers=tenant.get('transform_workers', 2), pusher=pusher)
+        if time_slice:
+            timer = threading.Timer(time_slice, pipeline.stop)
+            timer.daemon = True
+            timer.start()
+        result = pipeline.run()
+        summary.update({key: result[key] for key in ('mode', 'pages', 'totals', 'stopped', 'elapsed_seconds',
+                                                      'rows_per_second')})
+        summary['feeds'] = sum(len(submissions) for submissions in result['pushes'])
+        if pusher:
+            conn = initialize_db(tenant['db_path'])
+            try:
+                summary['feeds'] += len(settle_tenant_feeds(amazon_client, conn, pusher))
+            finally:
+                conn.close()
+    except Exception as err:
+        logger.exception("Sync of tenant %s failed", tenant['name'])
+        summary['error'] = f"{type(err).__name__}: {err}"
+    finally:
+        if timer is not None:
+            timer.cancel()
+        client.close()
+    return summary
+
+
+def _merge_summary(total: dict, summary: dict):
+    total['slices'] += 1
+    total['pages'] += summary['pages']
+    total['feeds'] += summary['feeds']
+    total['elapsed_seconds'] += summary['elapsed_seconds']
+    total['mode'] = total['mode'] or summary['mode']
+    for key, value in summary['totals'].items():
+        total['totals'][key] = total['totals'].get(key, 0) + value
+    total['error'] = summary['error']
+    total['completed'] = summary['error'] is None and not summary['stopped']
+
+
+class TenantScheduler:
+    """
+    Runs every tenant's sync in parallel on a process pool, round-robin in time slices.
+
+    Each tenant syncs in its own worker process (its own GIL, clients and SQLite shard), so
+    total sync time scales with the number of cores until the APIs become the limit. A tenant
+    that is still running after time_slice seconds stops at a page boundary and is queued
+    again behind the tenants that are waiting, so one very large store delays the others by
+    at most a slice instead of holding a worker for its whole catalog.
+    """
+
+    def __init__(self, tenants: list, max_workers: int = None, time_slice: float = DEFAULT_TIME_SLICE,
+                 worker=sync_tenant, mp_context=None):
+        """
+        Args:
+            tenants (list): Tenant dicts, see load_tenants.
+            max_workers (int, optional): Worker processes; defaults to min(CPU count, tenant count).
+            time_slice (float): Seconds per turn; None lets every tenant run to completion.
+            worker (callable): worker(tenant, time_slice) -> summary dict; must be picklable.
+            mp_context (multiprocessing context, optional): e.g. multiprocessing.get_context("spawn").
+        """
+        self.tenants = tenants
+        self.max_workers = max_workers or max(1, min(os.cpu_count() or 1, len(tenants)))
+        self.time_slice = time_slice
+        self.worker = worker
+        self.mp_context = mp_context
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Let the current slices finish but do not schedule any more."""
+        self._stop.set()
+
+    def run(self) -> dict:
+        """
+        Sync all tenants until each one completes or fails.
+
+        Returns:
+            dict: tenant name -> 'mode' (of the first slice), 'slices', 'pages', 'totals', 'feeds',
+                'elapsed_seconds' (summed over slices), 'completed' and 'error' (of the last slice).
+        """
+        results = {
+            tenant['name']: {'mode': None, 'slices': 0, 'pages': 0, 'totals': {}, 'feeds': 0,
+                             'elapsed_seconds': 0.0, 'completed': False, 'error': None}
+            for tenant in self.tenants
+        }
+        if not self.tenants:
+            return results
+        with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self.mp_context) as pool:
+            pending = {pool.submit(self.worker, tenant, self.time_slice): tenant for tenant in self.tenants}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tenant = pending.pop(future)
+                    try:
+                        summary = future.result()
+                    except Exception as err:
+                        # The worker process itself died (e.g. killed); the tenant is not retried
+                        logger.exception("Worker for tenant %s failed", tenant['name'])
+                        results[tenant['name']]['error'] = f"{type(err).__name__}: {err}"
+                        continue
+                    _merge_summary(results[tenant['name']], summary)
+                    if summary['stopped'] and summary['error'] is None and not self._stop.is_set():
+                        pending[pool.submit(self.worker, tenant, self.time_slice)] = tenant
+        return results
+
+
+def run_tenants(path: str = DEFAULT_TENANTS_PATH, max_workers: int = None,
+                time_slice: float = DEFAULT_TIME_SLICE) -> dict:
+    """Load the tenant config and sync every tenant; see TenantScheduler.run."""
+    return TenantScheduler(load_tenants(path), max_workers=max_workers, time_slice=time_slice).run()
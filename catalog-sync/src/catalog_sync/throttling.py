@@ -0,0 +1,342 @@
+import asyncio
+import threading
+import time
+
+from .metrics import REGISTRY
+
+# Shopify REST Admin API leaky bucket: 40 calls that drain at 2/s on standard plans
+# (Plus stores get a bigger bucket that drains proportionally faster)
+SHOPIFY_DEFAULT_BUCKET_SIZE = 40
+SHOPIFY_BUCKET_DRAIN_SECONDS = 20 # Time for a full bucket to leak out completely
+SHOPIFY_CALL_LIMIT_HEADER = "X-Shopify-Shop-Api-Call-Limit"
+
+
+class ShopifyCallLimitThrottler:
+    """
+    Paces calls to one Shopify store so they run just under its leaky-bucket limit.
+
+    The throttler keeps a local estimate of the bucket fill level, drained at the store's
+    leak rate and corrected from every X-Shopify-Shop-Api-Call-Limit response header.
+    Each acquire() reserves a slot; when the bucket (minus headroom) is full the caller
+    waits until enough has leaked out. Reservations are made under a lock, so any number
+    of threads or asyncio tasks can share one instance and therefore one budget.
+    """
+
+    def __init__(self, capacity=SHOPIFY_DEFAULT_BUCKET_SIZE, leak_rate=None, headroom=2, share=1.0):
+        """
+        Args:
+            capacity (int): Bucket size; updated automatically from response headers.
+            leak_rate (float, optional): Calls drained per second. Derived from capacity when omitted.
+            headroom (int): Slots kept free so calls from other clients of the store do not tip it into 429s.
+            share (float): Fraction of the leak rate this throttler may use, when several processes
+                sync the same store (see tenants.assign_rate_shares).
+        """
+        if not 0 < share <= 1:
+            raise ValueError("share must be in (0, 1]")
+        self._lock = threading.Lock()
+        self._fixed_leak_rate = leak_rate
+        self.share = share
+        self.capacity = capacity
+        self.headroom = headroom
+        self._level = 0.0
+        self._updated_at = time.monotonic()
+
+        self.calls = 0
+        self.throttled_count = 0
+        self.total_wait_seconds = 0.0
+
+    @property
+    def leak_rate(self):
+        if self._fixed_leak_rate is not None:
+            return self._fixed_leak_rate * self.share
+        return self.capacity / SHOPIFY_BUCKET_DRAIN_SECONDS * self.share
+
+    def _level_at(self, now):
+        return max(0.0, self._level - (now - self._updated_at) * self.leak_rate)
+
+    def _wait_for(self, level):
+        limit = max(1, self.capacity - self.headroom)
+        return max(0.0, (level + 1 - limit) / self.leak_rate)
+
+    def _reserve(self):
+        """Reserve one call slot and return how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            level = self._level_at(now)
+            wait = self._wait_for(level)
+            # Count the call immediately so concurrent callers queue up behind it
+            self._level = level + 1
+            self._updated_at = now
+            self.calls += 1
+            self.total_wait_seconds += wait
+            return wait
+
+    def acquire(self):
+        """Block until a call can be made without overflowing the bucket."""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        """asyncio variant of acquire(); shares the same budget as threaded callers."""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def update_from_header(self, header_value):
+        """Correct the local estimate from an X-Shopify-Shop-Api-Call-Limit value such as "32/40"."""
+        if not header_value:
+            return
+        try:
+            used, capacity = (int(part) for part in header_value.split("/", 1))
+        except ValueError:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.capacity = capacity
+            # Keep the larger value: the local estimate includes in-flight reservations,
+            # the header includes calls made by other processes sharing the store
+            self._level = max(self._level_at(now), float(used))
+            self._updated_at = now
+
+    def record_throttled(self):
+        """Note a 429 from the store: treat the bucket as full so callers back off."""
+        with self._lock:
+            now = time.monotonic()
+            self._level = max(self._level_at(now), float(self.capacity))
+            self._updated_at = now
+            self.throttled_count += 1
+
+    @property
+    def fill_level(self):
+        """Estimated number of calls currently in the bucket."""
+        with self._lock:
+            return self._level_at(time.monotonic())
+
+    def metrics(self):
+        """Snapshot of the throttler state for logging or metrics export."""
+        with self._lock:
+            level = self._level_at(time.monotonic())
+            return {
+                'fill_level': level,
+                'capacity': self.capacity,
+                'wait_seconds': self._wait_for(level),
+                'calls': self.calls,
+                'throttled_count': self.throttled_count,
+                'total_wait_seconds': self.total_wait_seconds,
+            }
+
+
+_shopify_throttlers = {}
+_shopify_throttlers_lock = threading.Lock()
+
+
+def get_shopify_throttler(store_url):
+    """Return the process-wide throttler for a store, creating it on first use."""
+    with _shopify_throttlers_lock:
+        throttler = _shopify_throttlers.get(store_url)
+        if throttler is None:
+            throttler = ShopifyCallLimitThrottler()
+            _shopify_throttlers[store_url] = throttler
+        return throttler
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second refill up to `burst`.
+
+    acquire() reserves a token under a lock and sleeps outside it, so the bucket can be
+    shared by threads (and, via acquire_async, asyncio tasks) without serialising their I/O.
+    """
+
+    def __init__(self, rate, burst):
+        self._lock = threading.Lock()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self.total_wait_seconds = 0.0
+
+    def _reserve(self, tokens=1.0):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            # Going negative queues later callers behind this reservation
+            self._tokens -= tokens
+            wait = max(0.0, -self._tokens / self.rate)
+            self.total_wait_seconds += wait
+            return wait
+
+    def acquire(self, tokens=1.0):
+        """Block until `tokens` are available; returns the seconds waited."""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens=1.0):
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    @property
+    def available(self):
+        """Tokens available right now (negative when callers are queued)."""
+        with self._lock:
+            return min(self.burst, self._tokens + (time.monotonic() - self._updated_at) * self.rate)
+
+    def set_rate(self, rate):
+        """Change the refill rate, keeping the tokens accrued so far."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self.rate = float(rate)
+
+    def drain(self):
+        """Empty the bucket, e.g. after a 429, so the next callers wait for a fresh token."""
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0)
+            self._updated_at = time.monotonic()
+
+
+# Default SP-API usage plans as (requests per second, burst). The live rate for an operation is
+# taken from the x-amzn-RateLimit-Limit header once a response has been seen.
+SP_API_DEFAULT_RATE_LIMITS = {
+    'createFeed': (0.0083, 15),
+    'getFeed': (2.0, 15),
+    'getFeeds': (0.0222, 10),
+    'cancelFeed': (2.0, 15),
+    'createFeedDocument': (0.5, 15),
+    'getFeedDocument': (0.0222, 10),
+    'getListingsItem': (5.0, 10),
+    'putListingsItem': (5.0, 10),
+    'patchListingsItem': (5.0, 10),
+    'deleteListingsItem': (5.0, 10),
+}
+SP_API_FALLBACK_RATE_LIMIT = (1.0, 5)
+SP_API_RATE_LIMIT_HEADER = "x-amzn-RateLimit-Limit"
+
+
+class SPAPIRateLimiter:
+    """
+    One TokenBucket per SP-API operation, since each operation has its own rate and burst.
+
+    Buckets start from SP_API_DEFAULT_RATE_LIMITS and follow the x-amzn-RateLimit-Limit
+    header Amazon returns, which reflects the plan actually granted to this selling partner.
+    A 429 empties the operation's bucket so every caller sharing it backs off together,
+    instead of each one hammering the operation into a longer penalty window.
+    """
+
+    def __init__(self, defaults=None, fallback=SP_API_FALLBACK_RATE_LIMIT, share=1.0):
+        """
+        Args:
+            defaults (dict, optional): operation -> (rate, burst); SP_API_DEFAULT_RATE_LIMITS by default.
+            fallback (tuple): (rate, burst) for operations missing from defaults.
+            share (float): Fraction of every rate (and burst) this limiter may use, when several
+                processes call SP-API with the same credentials (see tenants.assign_rate_shares).
+        """
+        if not 0 < share <= 1:
+            raise ValueError("share must be in (0, 1]")
+        self._lock = threading.Lock()
+        self._defaults = dict(SP_API_DEFAULT_RATE_LIMITS if defaults is None else defaults)
+        self._fallback = fallback
+        self.share = share
+        self._buckets = {}
+        self.throttled_counts = {}
+
+    def bucket(self, operation):
+        with self._lock:
+            bucket = self._buckets.get(operation)
+            if bucket is None:
+                rate, burst = self._defaults.get(operation, self._fallback)
+                bucket = self._buckets[operation] = TokenBucket(rate * self.share, max(1.0, burst * self.share))
+            return bucket
+
+    def acquire(self, operation):
+        return self.bucket(operation).acquire()
+
+    async def acquire_async(self, operation):
+        return await self.bucket(operation).acquire_async()
+
+    def update_from_header(self, operation, header_value):
+        """Adopt the rate Amazon reports for the operation (e.g. "0.5000"), scaled by share."""
+        if not header_value:
+            return
+        try:
+            rate = float(header_value) * self.share
+        except ValueError:
+            return
+        if rate > 0:
+            bucket = self.bucket(operation)
+            if rate != bucket.rate:
+                bucket.set_rate(rate)
+
+    def record_throttled(self, operation):
+        self.bucket(operation).drain()
+        with self._lock:
+            self.throttled_counts[operation] = self.throttled_counts.get(operation, 0) + 1
+
+    def metrics(self):
+        with self._lock:
+            buckets = dict(self._buckets)
+            throttled = dict(self.throttled_counts)
+        return {
+            operation: {
+                'rate': bucket.rate,
+                'burst': bucket.burst,
+                'available': bucket.available,
+                'throttled_count': throttled.get(operation, 0),
+                'total_wait_seconds': bucket.total_wait_seconds,
+            }
+            for operation, bucket in buckets.items()
+        }
+
+
+_sp_api_limiters = {}
+_sp_api_limiters_lock = threading.Lock()
+
+
+def get_sp_api_rate_limiter(key):
+    """Return the process-wide limiter for one selling partner/application pair (SP-API limits apply per pair)."""
+    with _sp_api_limiters_lock:
+        limiter = _sp_api_limiters.get(key)
+        if limiter is None:
+            limiter = _sp_api_limiters[key] = SPAPIRateLimiter()
+        return limiter
+
+
+# Exported at scrape time from the process-wide throttlers and limiters above
+_SHOPIFY_FILL_LEVEL = REGISTRY.gauge("shopify_call_limit_fill_level", "Estimated calls in the store's leaky bucket",
+                                     ("store",))
+_SHOPIFY_WAIT = REGISTRY.gauge("shopify_call_limit_wait_seconds", "Wait the next call to the store would have",
+                               ("store",))
+_SP_API_AVAILABLE = REGISTRY.gauge("sp_api_tokens_available", "Tokens left in an SP-API operation's bucket",
+                                   ("limiter", "operation"))
+_SP_API_THROTTLED = REGISTRY.gauge("sp_api_throttled_count", "429 responses seen for an SP-API operation",
+                                   ("limiter", "operation"))
+
+
+def collect_throttling_metrics():
+    """Copy the state of every get_shopify_throttler / get_sp_api_rate_limiter instance into REGISTRY."""
+    with _shopify_throttlers_lock:
+        throttlers = dict(_shopify_throttlers)
+    for store_url, throttler in throttlers.items():
+        state = throttler.metrics()
+        _SHOPIFY_FILL_LEVEL.set(state['fill_level'], store=store_url)
+        _SHOPIFY_WAIT.set(state['wait_seconds'], store=store_url)
+
+    with _sp_api_limiters_lock:
+        limiters = dict(_sp_api_limiters)
+    for key, limiter in limiters.items():
+        for operation, state in limiter.metrics().items():
+            # Limiter keys are credential hashes; a prefix tells accounts apart without bloating labels
+            _SP_API_AVAILABLE.set(state['available'], limiter=key[:12], operation=operation)
+            _SP_API_THROTTLED.set(state['throttled_count'], limiter=key[:12], operation=operation)
+
+
+REGISTRY.register_collector(collect_throttling_metrics)
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# Kept out of catalog.db on purpose: the refresh holds this database's write lock for the
+# duration of the LWA call, which must not stall catalog writes.
+DEFAULT_TOKEN_CACHE_PATH = os.getenv("SP_API_TOKEN_CACHE", ".lwa_token_cache.db")
+
+# Treat tokens as expired this many seconds early, so a request never leaves with a token
+# that lapses in flight (and clock drift between hosts does not matter)
+DEFAULT_EXPIRY_SKEW = 60.0
+
+# Waiters hold on while another process refreshes, so this must outlast a whole LWA exchange
+# (AmazonSPAPIClient allows 5 s to connect plus 30 s to read) with room to spare
+DEFAULT_LOCK_TIMEOUT = 90.0
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS lwa_tokens (
+    cache_key TEXT PRIMARY KEY, -- Hash of client id + refresh token; the secrets themselves are never stored
+    access_token TEXT NOT NULL,
+    expires_at REAL NOT NULL -- Unix time
+);
+"""
+
+
+def token_cache_key(client_id: str, refresh_token: str) -> str:
+    return hashlib.sha256(f"{client_id}:{refresh_token}".encode("utf-8")).hexdigest()
+
+
+class LWATokenCache:
+    """
+    LWA access-token cache shared by every process on the host through a small SQLite file.
+
+    Reads are lock-free. A miss takes the database write lock (BEGIN IMMEDIATE) before
+    refreshing and re-checks the cache once it has the lock, so when many workers find the
+    token expired at the same moment only the first calls LWA; the rest wait for the lock
+    and pick up the token it stored.
+    """
+
+    def __init__(self, path: str = DEFAULT_TOKEN_CACHE_PATH, expiry_skew: float = DEFAULT_EXPIRY_SKEW,
+                 lock_timeout: float = DEFAULT_LOCK_TIMEOUT):
+        """
+        Args:
+            path (str): Cache database file.
+            expiry_skew (float): Seconds before expiry at which a token is no longer handed out.
+            lock_timeout (float): Seconds to wait for another process's refresh to finish; past it,
+                get_or_refresh raises sqlite3.OperationalError ("database is locked").
+        """
+        self.path = Path(path)
+        self.expiry_skew = expiry_skew
+        self.lock_timeout = lock_timeout
+        self._thread_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.lock_timeout, isolation_level=None)
+        if not self._initialized:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(_SCHEMA_SQL)
+            # Access tokens are credentials; keep the file private to the current user
+            os.chmod(self.path, 0o600)
+            self._initialized = True
+        return conn
+
+    def _valid(self, row):
+        if row and row[1] - self.expiry_skew > time.time():
+            return row[0], row[1]
+        return None
+
+    def get(self, key: str):
+        """Return (access_token, expires_at) if a token with enough lifetime left is cached, else None."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT access_token, expires_at FROM lwa_tokens WHERE cache_key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        return self._valid(row)
+
+    def get_or_refresh(self, key: str, refresh):
+        """
+        Return a valid cached token, calling refresh() only if no process has a fresh one.
+
+        Args:
+            refresh (callable): Performs the LWA exchange and returns (access_token, expires_in_seconds).
+
+        Returns:
+            tuple: (access_token, expires_at)
+        """
+        cached = self.get(key)
+        if cached:
+            return cached
+
+        # Threads of this process queue here; other processes queue on BEGIN IMMEDIATE
+        with self._thread_lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT access_token, expires_at FROM lwa_tokens WHERE cache_key = ?", (key,)
+                ).fetchone()
+                cached = self._valid(row)
+                if cached:
+                    conn.execute("ROLLBACK")
+                    return cached
+
+                access_token, expires_in = refresh()
+                expires_at = time.time() + expires_in
+                conn.execute(
+                    """
+                    INSERT INTO lwa_tokens (cache_key, access_token, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT(cache_key) DO UPDATE SET
+                        access_token = excluded.access_token,
+                        expires_at = excluded.expires_at
+                    """,
+                    (key, access_token, expires_at),
+                )
+                conn.execute("COMMIT")
+                return access_token, expires_at
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+    def invalidate(self, key: str, access_token: str = None):
+        """
+        Drop a cached token, e.g. after SP-API rejected it as expired or revoked.
+
+        Args:
+            access_token (str, optional): The rejected token. Only that token is dropped, so a
+                worker holding a stale token cannot delete the fresh one another process just stored.
+        """
+        conn = self._connect()
+        try:
+            if access_token is None:
+                conn.execute("DELETE FROM lwa_tokens WHERE cache_key = ?", (key,))
+            else:
+                conn.execute("DELETE FROM lwa_tokens WHERE cache_key = ? AND access_token = ?", (key, access_token))
+        finally:
+            conn.close()
@@ -0,0 +1,303 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from sqlite3 import Connection
+
+from dotenv import load_dotenv
+
+from .database import DEFAULT_BATCH_SIZE, apply_inventory_levels, delete_product, upsert_products
+from .shopify_client import parse_product_data
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SHOPIFY_WEBHOOK_SECRET = os.getenv("SHOPIFY_WEBHOOK_SECRET") # App client secret that Shopify signs webhooks with
+
+# Separate from catalog.db so accepting a webhook never waits behind a long catalog write
+DEFAULT_WEBHOOK_QUEUE_PATH = os.getenv("SHOPIFY_WEBHOOK_QUEUE", ".webhook_queue.db")
+
+HMAC_HEADER = "X-Shopify-Hmac-Sha256"
+TOPIC_HEADER = "X-Shopify-Topic"
+WEBHOOK_ID_HEADER = "X-Shopify-Webhook-Id"
+SHOP_DOMAIN_HEADER = "X-Shopify-Shop-Domain"
+
+WEBHOOK_TOPICS = ('products/update', 'products/delete', 'inventory_levels/update')
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS webhook_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    webhook_id TEXT UNIQUE, -- X-Shopify-Webhook-Id; Shopify redelivers with the same id
+    topic TEXT NOT NULL,
+    shop_domain TEXT,
+    resource_key TEXT NOT NULL, -- Events with the same key coalesce, e.g. 'product:123'
+    payload TEXT NOT NULL, -- Webhook body as received
+    received_at REAL NOT NULL -- Unix time
+);
+CREATE INDEX IF NOT EXISTS idx_webhook_events_resource ON webhook_events(resource_key, id);
+"""
+
+# Latest event of every resource that has been quiet for the coalesce window, or that has been
+# waiting longer than max_delay (so a product under constant edits is still processed)
+_CLAIM_SQL = """
+SELECT e.id, e.topic, e.shop_domain, e.resource_key, e.payload, g.event_count
+FROM (
+    SELECT resource_key, MAX(id) AS last_id, COUNT(*) AS event_count
+    FROM webhook_events
+    GROUP BY resource_key
+    HAVING MAX(received_at) <= ? OR MIN(received_at) <= ?
+    ORDER BY MIN(id)
+    LIMIT ?
+) AS g
+JOIN webhook_events AS e ON e.id = g.last_id
+ORDER BY e.id
+"""
+
+
+def verify_webhook_hmac(body: bytes, hmac_header: str, secret: str) -> bool:
+    """Check X-Shopify-Hmac-Sha256, the base64 HMAC-SHA256 of the raw request body."""
+    if not hmac_header or not secret:
+        return False
+    digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), hmac_header.strip().encode("utf-8"))
+
+
+def webhook_resource_key(topic: str, payload: dict) -> str:
+    """Coalescing key: product events share one key per product, inventory events one per item and location."""
+    if topic == 'inventory_levels/update':
+        # Each location's level is kept; only updates of the same level supersede each other
+        return f"inventory_level:{payload['inventory_item_id']}:{payload['location_id']}"
+    return f"product:{payload['id']}"
+
+
+class WebhookQueue:
+    """
+    Durable FIFO of webhook events in a small SQLite file.
+
+    enqueue() is a single INSERT in WAL mode with synchronous=NORMAL, which commits without an
+    fsync; an application crash loses nothing, only a power loss can drop the last commits (and
+    Shopify redelivers anything that was not acknowledged). The consumer may run in another
+    process, as long as only one consumer drains the queue at a time.
+    """
+
+    def __init__(self, path: str = DEFAULT_WEBHOOK_QUEUE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # One connection shared by the receiver threads; SQLite serialises the writes anyway
+        self._conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.executescript(_SCHEMA_SQL)
+
+    def enqueue(self, topic: str, body, webhook_id: str = None, shop_domain: str = None) -> bool:
+        """
+        Store one webhook delivery.
+
+        Args:
+            body (bytes | str): Raw JSON body of the webhook.
+
+        Returns:
+            bool: False if a delivery with this webhook_id is already queued.
+
+        Raises:
+            ValueError: If the body is not a JSON object with the id the topic needs.
+        """
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        try:
+            resource_key = webhook_resource_key(topic, json.loads(body))
+        except (KeyError, TypeError) as err:
+            raise ValueError(f"{topic} payload has no resource id") from err
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                INSERT OR IGNORE INTO webhook_events (webhook_id, topic, shop_domain, resource_key, payload, received_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (webhook_id, topic, shop_domain, resource_key, body, time.time()),
+            )
+        return cursor.rowcount == 1
+
+    def claim_due(self, coalesce_window: float, max_delay: float, limit: int = 1000) -> list:
+        """Return the latest event of each resource that is ready to process; see _CLAIM_SQL."""
+        now = time.time()
+        with self._lock:
+            return self._conn.execute(_CLAIM_SQL, (now - coalesce_window, now - max_delay, limit)).fetchall()
+
+    def ack(self, events) -> int:
+        """Delete processed events together with the older events they superseded."""
+        with self._lock:
+            changes_before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "DELETE FROM webhook_events WHERE resource_key = ? AND id <= ?",
+                [(event["resource_key"], event["id"]) for event in events],
+            )
+            self._conn.execute("COMMIT")
+            return self._conn.total_changes - changes_before
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM webhook_events").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    server_version = "catalog-sync-webhooks"
+
+    def _respond(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self._respond(413)
+            return
+        body = self.rfile.read(length)
+        if not verify_webhook_hmac(body, self.headers.get(HMAC_HEADER), self.server.secret):
+            logger.warning("Rejected webhook with an invalid HMAC (topic %s, shop %s)",
+                           self.headers.get(TOPIC_HEADER), self.headers.get(SHOP_DOMAIN_HEADER))
+            self._respond(401)
+            return
+
+        topic = self.headers.get(TOPIC_HEADER)
+        # Other topics are acknowledged and dropped: Shopify deletes subscriptions that keep failing
+        if topic in WEBHOOK_TOPICS:
+            try:
+                self.server.queue.enqueue(topic, body, webhook_id=self.headers.get(WEBHOOK_ID_HEADER),
+                                          shop_domain=self.headers.get(SHOP_DOMAIN_HEADER))
+            except ValueError as err:
+                logger.warning("Rejected %s webhook: %s", topic, err)
+                self._respond(400)
+                return
+            except sqlite3.Error:
+                # Not acknowledged, so Shopify retries the delivery later
+                logger.exception("Could not queue %s webhook", topic)
+                self._respond(503)
+                return
+        self._respond(200)
+
+    def log_message(self, format, *args):
+        pass # One stderr line per delivery is too noisy during bulk edits
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """HTTP endpoint that verifies Shopify webhooks and queues them; processing is left to WebhookConsumer."""
+
+    daemon_threads = True
+
+    def __init__(self, queue: WebhookQueue, secret: str = None, host: str = "0.0.0.0", port: int = 8080):
+        """
+        Args:
+            queue (WebhookQueue): Where verified deliveries are stored.
+            secret (str, optional): Webhook signing secret, SHOPIFY_WEBHOOK_SECRET from .env by default.
+            host, port: Listen address; port 0 picks a free port (see server_address).
+        """
+        self.queue = queue
+        self.secret = secret or SHOPIFY_WEBHOOK_SECRET
+        if not self.secret:
+            raise ValueError("SHOPIFY_WEBHOOK_SECRET must be set to verify webhooks")
+        super().__init__((host, port), _WebhookHandler)
+
+
+class WebhookConsumer:
+    """
+    Drains the webhook queue into the catalog database, one write per product per burst.
+
+    A bulk edit in the Shopify admin fires a products/update for every saved change. Events
+    wait until their product has been quiet for coalesce_window seconds; then only the newest
+    payload is applied and every older event for that product is dropped with it.
+
+    inventory_levels/update carries one location's level; a variant's quantity is the sum over
+    locations (database.apply_inventory_levels). Given a Shopify client, the consumer re-fetches
+    the levels of every updated item at all locations instead, so locations that have not sent a
+    webhook yet are counted too.
+    """
+
+    def __init__(self, queue: WebhookQueue, conn: Connection, coalesce_window: float = 2.0,
+                 max_delay: float = 30.0, batch_size: int = DEFAULT_BATCH_SIZE, shopify_client=None):
+        """
+        Args:
+            queue (WebhookQueue): Queue filled by WebhookServer.
+            conn: Catalog database connection (used only from the consuming thread).
+            coalesce_window (float): Seconds without new events before a product is processed.
+            max_delay (float): Upper bound on how long a continuously edited product waits.
+            batch_size (int): Resources claimed per process_once call.
+            shopify_client (ShopifyAPIClient, optional): Used to re-fetch the levels of updated
+                inventory items at every location.
+        """
+        self.queue = queue
+        self.conn = conn
+        self.coalesce_window = coalesce_window
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.shopify_client = shopify_client
+
+    def process_once(self) -> dict:
+        """
+        Apply every resource that is due and remove its events from the queue.
+
+        Returns:
+            dict: 'events' (queued events consumed), 'resources' (distinct products/items applied),
+                'products' (upsert_products batch summaries), 'deleted_skus' and 'variants_updated'.
+        """
+        events = self.queue.claim_due(self.coalesce_window, self.max_delay, self.batch_size)
+        products, deleted_ids, levels = [], [], []
+        for event in events:
+            try:
+                payload = json.loads(event["payload"])
+                if event["topic"] == 'products/update':
+                    products.append(parse_product_data(payload))
+                elif event["topic"] == 'products/delete':
+                    deleted_ids.append(payload["id"])
+                else:
+                    levels.append({'inventory_item_id': payload["inventory_item_id"],
+                                   'location_id': payload["location_id"], 'available': payload.get("available")})
+            except (ValueError, KeyError):
+                # A malformed payload will never succeed; drop it rather than block the queue
+                logger.exception("Skipping %s webhook %s", event['topic'], event['id'])
+
+        batches = upsert_products(self.conn, products, self.batch_size, with_variants=True) if products else []
+        deleted_skus = [sku for product_id in deleted_ids for sku in delete_product(self.conn, product_id)]
+        variants_updated = 0
+        if levels and self.shopify_client:
+            item_ids = {level['inventory_item_id'] for level in levels}
+            variants_updated = apply_inventory_levels(self.conn, self.shopify_client.get_inventory_levels(item_ids),
+                                                      replace=True)
+        elif levels:
+            variants_updated = apply_inventory_levels(self.conn, levels)
+
+        # Acknowledge only after the catalog commit; a crash in between just replays idempotent writes
+        if events:
+            self.queue.ack(events)
+        return {
+            'events': sum(event["event_count"] for event in events),
+            'resources': len(events),
+            'products': batches,
+            'deleted_skus': deleted_skus,
+            'variants_updated': variants_updated,
+        }
+
+    def run(self, stop_event: threading.Event = None, idle_interval: float = 0.5):
+        """Process the queue until stop_event is set, sleeping idle_interval whenever nothing is due."""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            if not self.process_once()['resources']:
+                stop_event.wait(idle_interval)
@@ -0,0 +1,235 @@
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+import requests
+
+# Ensure catalog-sync package is on path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from catalog_sync import amazon_sp_api_client, database
+from catalog_sync.amazon_sp_api_client import AmazonSPAPIClient, AmazonSPAPIError
+from catalog_sync.throttling import SPAPIRateLimiter
+from catalog_sync.token_cache import LWATokenCache
+
+
+def make_client(cache, **kwargs):
+    return AmazonSPAPIClient(client_id="amzn1.client", client_secret="secret", refresh_token="Atzr|refresh",
+                             endpoint="https://sellingpartnerapi-na.amazon.com", token_cache=cache, **kwargs)
+
+
+def test_lwa_token_is_shared_across_clients_and_refreshed_once(tmp_path):
+    cache_path = tmp_path / "tokens.db"
+    exchanges = []
+
+    def slow_exchange():
+        exchanges.append(threading.get_ident())
+        time.sleep(0.05)
+        return f"token-{len(exchanges)}", 3600
+
+    # Separate cache objects only share the SQLite file, like separate processes would
+    clients = [make_client(LWATokenCache(cache_path)) for _ in range(6)]
+    for client in clients:
+        client._request_lwa_token = slow_exchange
+    tokens = []
+    threads = [threading.Thread(target=lambda c=c: tokens.append(c._get_lwa_access_token())) for c in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(exchanges) == 1
+    assert tokens == ["token-1"] * 6
+
+    # A fresh "process" reuses the cached token without an exchange
+    newcomer = make_client(LWATokenCache(cache_path))
+    newcomer._request_lwa_token = slow_exchange
+    assert newcomer._get_lwa_access_token() == "token-1" and len(exchanges) == 1
+
+
+def test_lwa_token_within_expiry_skew_is_refreshed(tmp_path):
+    cache = LWATokenCache(tmp_path / "tokens.db", expiry_skew=60)
+    client = make_client(cache)
+    responses = iter([("short-lived", 30), ("fresh", 3600)])
+    client._request_lwa_token = lambda: next(responses)
+
+    assert client._get_lwa_access_token() == "short-lived" # first exchange, taken as-is
+    assert client._get_lwa_access_token() == "fresh" # 30s left is inside the 60s skew
+
+
+def test_invalidate_only_drops_the_rejected_token(tmp_path):
+    cache = LWATokenCache(tmp_path / "tokens.db")
+    stale, fresh = make_client(cache), make_client(cache)
+    stale.access_token, stale.access_token_expires_at = "old-token", time.time() + 3600
+    fresh._request_lwa_token = lambda: ("new-token", 3600)
+    assert fresh._get_lwa_access_token() == "new-token"
+
+    # A worker still holding the old token gets a 401; the token stored meanwhile survives
+    stale.invalidate_access_token()
+    assert cache.get(stale._token_cache_key)[0] == "new-token"
+    fresh.invalidate_access_token()
+    assert cache.get(fresh._token_cache_key) is None
+
+
+def test_locked_token_cache_raises_api_error(tmp_path):
+    cache = LWATokenCache(tmp_path / "tokens.db", lock_timeout=0.05)
+    client = make_client(cache)
+    client._request_lwa_token = lambda: ("token", 3600)
+    holder = cache._connect() # Another process in the middle of a refresh
+    holder.execute("BEGIN IMMEDIATE")
+    try:
+        with pytest.raises(AmazonSPAPIError, match="token cache unavailable"):
+            client._get_lwa_access_token()
+    finally:
+        holder.execute("ROLLBACK")
+        holder.close()
+    assert client._get_lwa_access_token() == "token"
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        result = self.responses.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+
+def make_response(status_code, body=None, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body).encode() if body is not None else b""
+    response.headers.update(headers or {})
+    return response
+
+
+def test_make_request_paces_operation_and_retries_429(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(amazon_sp_api_client.time, "sleep", sleeps.append)
+    limiter = SPAPIRateLimiter()
+    session = FakeSession([
+        make_response(429, {"errors": [{"code": "QuotaExceeded"}]}, {"x-amzn-RateLimit-Limit": "1.5"}),
+        make_response(202, {"feedId": "123"}, {"x-amzn-RateLimit-Limit": "1.5"}),
+    ])
+    client = make_client(LWATokenCache(tmp_path / "tokens.db"), session=session, rate_limiter=limiter)
+    client.access_token, client.access_token_expires_at = "cached-token", time.time() + 3600
+
+    assert client.create_feed("JSON_LISTINGS_FEED", "doc-1", ["ATVPDKIKX0DER"]) == {"feedId": "123"}
+    assert session.calls[0][1] == "https://sellingpartnerapi-na.amazon.com/feeds/2021-06-30/feeds"
+    assert session.calls[0][2]["headers"]["x-amz-access-token"] == "cached-token"
+    assert limiter.bucket("createFeed").rate == 1.5
+    assert limiter.metrics()["createFeed"]["throttled_count"] == 1
+    assert sleeps and max(sleeps) >= 0.6 # Retry waits at least one token at the adopted rate
+
+
+def test_create_feed_is_not_resent_after_a_timeout_or_server_error(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(amazon_sp_api_client.time, "sleep", sleeps.append)
+    client = make_client(LWATokenCache(tmp_path / "tokens.db"), rate_limiter=SPAPIRateLimiter())
+    client.access_token, client.access_token_expires_at = "cached-token", time.time() + 3600
+
+    # The feed may have been created even though the response was lost
+    for outcome in (requests.exceptions.ReadTimeout("slow"), make_response(503)):
+        client.session = FakeSession([outcome])
+        with pytest.raises(AmazonSPAPIError):
+            client.create_feed("JSON_LISTINGS_FEED", "doc-1", ["ATVPDKIKX0DER"])
+        assert len(client.session.calls) == 1
+    assert sleeps == []
+
+    # A connection that was never established is safe to retry, as are reads
+    client.session = FakeSession([requests.exceptions.ConnectTimeout("unreachable"), make_response(202, {"feedId": "1"})])
+    assert client.create_feed("JSON_LISTINGS_FEED", "doc-1", ["ATVPDKIKX0DER"]) == {"feedId": "1"}
+    client.session = FakeSession([requests.exceptions.ReadTimeout("slow"), make_response(200, {"feedId": "1"})])
+    assert client.get_feed_status("1") == {"feedId": "1"}
+
+
+def test_make_request_raises_on_client_error(tmp_path):
+    session = FakeSession([make_response(400, {"errors": [{"code": "InvalidInput"}]})])
+    client = make_client(LWATokenCache(tmp_path / "tokens.db"), session=session, rate_limiter=SPAPIRateLimiter())
+    client.access_token, client.access_token_expires_at = "cached-token", time.time() + 3600
+
+    with pytest.raises(AmazonSPAPIError) as excinfo:
+        client.get_feed_status("123")
+    assert excinfo.value.status_code == 400 and "InvalidInput" in excinfo.value.response_text
+
+
+def test_upload_feed_document_goes_through_the_session(tmp_path):
+    session = FakeSession([make_response(200)])
+    client = make_client(LWATokenCache(tmp_path / "tokens.db"), session=session, rate_limiter=SPAPIRateLimiter())
+
+    assert client.upload_feed_document("https://s3.example.com/upload", '{"messages": []}', "application/json") is True
+    method, url, kwargs = session.calls[0]
+    assert (method, url, kwargs["data"]) == ("PUT", "https://s3.example.com/upload", b'{"messages": []}')
+    assert kwargs["headers"] == {"Content-Type": "application/json"}
+
+
+def test_update_offers_patches_small_batches_and_switches_to_feed_above_threshold(tmp_path, monkeypatch):
+    client = make_client(LWATokenCache(tmp_path / "tokens.db"), rate_limiter=SPAPIRateLimiter())
+    patched = []
+    monkeypatch.setattr(client, "patch_listings_item", lambda seller_id, sku, marketplace_ids, patches, product_type:
+                        patched.append((sku, patches)) or {"sku": sku, "status": "ACCEPTED"})
+    updates = [{"sku": "A/1", "price": "12.5"}, {"sku": "B", "quantity": -3}, {"sku": "C"}]
+
+    result = client.update_offers("SELLER", "ATVPDKIKX0DER", updates, feed_threshold=2)
+    assert result["mode"] == "patch"
+    assert [r["sku"] for r in result["results"]] == ["A/1", "B"] # "C" changes nothing
+    assert patched[0][1][0]["value"][0]["our_price"][0]["schedule"][0]["value_with_tax"] == 12.5
+    assert dict(patched)["B"][0]["value"][0]["quantity"] == 0
+
+    uploaded = []
+    monkeypatch.setattr(client, "create_feed_document", lambda content_type: {"feedDocumentId": "doc-1", "url": "u"})
+    monkeypatch.setattr(client, "upload_feed_document",
+                        lambda url, content, content_type: uploaded.append(json.loads(content.read())))
+    monkeypatch.setattr(client, "create_feed", lambda feed_type, feed_document_id, marketplace_ids: {"feedId": "f-1"})
+
+    conn = database.initialize_db(str(tmp_path / "test.db"))
+    with pytest.raises(ValueError):
+        client.update_offers("SELLER", "ATVPDKIKX0DER", updates, feed_threshold=1) # Feeds would go untracked
+    result = client.update_offers("SELLER", "ATVPDKIKX0DER", updates, feed_threshold=1, conn=conn)
+    assert result == {"mode": "feed", "feeds": [{"feedId": "f-1", "feedDocumentId": "doc-1", "message_count": 2,
+                                                 "size": result["feeds"][0]["size"]}]}
+    messages = uploaded[0]["messages"]
+    assert [(m["messageId"], m["sku"], m["operationType"]) for m in messages] == [(1, "A/1", "PATCH"), (2, "B", "PATCH")]
+    assert "content_hash" not in messages[0] and "message" not in messages[0]
+    (feed,) = database.get_pending_feeds(conn)
+    assert (feed["feed_id"], feed["feed_type"], feed["message_count"]) == ("f-1", "JSON_LISTINGS_FEED", 2)
+    conn.close()
+
+
+def test_invalid_patch_submissions_are_reported_as_failures(tmp_path):
+    issues = [{"code": "90220", "message": "'our_price' is required but not supplied.", "severity": "ERROR"}]
+    session = FakeSession([
+        make_response(200, {"sku": "A", "status": "ACCEPTED", "submissionId": "s1", "issues": []}),
+        make_response(200, {"sku": "B", "status": "INVALID", "submissionId": "s2", "issues": issues}),
+    ])
+    client = make_client(LWATokenCache(tmp_path / "tokens.db"), session=session, rate_limiter=SPAPIRateLimiter())
+    client.access_token, client.access_token_expires_at = "cached-token", time.time() + 3600
+
+    result = client.update_offers("SELLER", "ATVPDKIKX0DER", [{"sku": "A", "quantity": 1}, {"sku": "B", "price": "2"}],
+                                  max_workers=1)
+    accepted, invalid = result["results"]
+    assert accepted["error"] is None and accepted["issues"] == []
+    assert isinstance(invalid["error"], AmazonSPAPIError) and "90220" in str(invalid["error"])
+    assert invalid["issues"] == issues and invalid["response"]["status"] == "INVALID"
+
+
+def test_patch_listings_item_targets_listings_api(tmp_path):
+    session = FakeSession([make_response(200, {"sku": "A/1", "status": "ACCEPTED", "submissionId": "s1", "issues": []})])
+    client = make_client(LWATokenCache(tmp_path / "tokens.db"), session=session, rate_limiter=SPAPIRateLimiter())
+    client.access_token, client.access_token_expires_at = "cached-token", time.time() + 3600
+
+    response = client.patch_listings_item("SELLER", "A/1", ["ATVPDKIKX0DER"], [{"op": "replace"}])
+    method, url, kwargs = session.calls[0]
+    assert response["status"] == "ACCEPTED"
+    assert (method, url) == ("PATCH", "https://sellingpartnerapi-na.amazon.com/listings/2021-08-01/items/SELLER/A%2F1")
+    assert kwargs["params"] == {"marketplaceIds": "ATVPDKIKX0DER"}
+    assert kwargs["json"] == {"productType": "PRODUCT", "patches": [{"op": "replace"}]}
@@ -0,0 +1,28 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'benchmarks'))
+
+from fake_services import synthetic_product
+from run_benchmarks import STAGES, format_table, run
+
+
+def test_synthetic_product_is_deterministic():
+    assert synthetic_product(4) == synthetic_product(4)
+    product = synthetic_product(2)
+    assert product['id'] == 3
+    assert [v['sku'] for v in product['variants']] == ["SKU-0000003-0", "SKU-0000003-1", "SKU-0000003-2"]
+
+
+def test_benchmarks_run_every_stage_offline(tmp_path):
+    results = run(product_count=120, page_size=50, batch_size=40, work_dir=str(tmp_path))
+
+    assert list(results) == list(STAGES)
+    assert results['fetch']['items'] == 120
+    assert results['fetch']['pages'] == 3
+    assert results['upsert']['items'] == 120
+    assert results['feed_build']['items'] == 120
+    assert results['end_to_end']['items'] == 120
+    assert results['end_to_end']['feeds'] >= 1
+    assert "end_to_end" in format_table(results)
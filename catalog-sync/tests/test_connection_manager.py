@@ -0,0 +1,53 @@
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+# Ensure catalog-sync package is on path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from catalog_sync import database
+from catalog_sync.connection_manager import CatalogDB
+
+
+def _product(sku):
+    return {'id': 1, 'sku': sku, 'title': sku, 'price': '1.00', 'raw_shopify_data': {'sku': sku}}
+
+
+def test_initialize_db_applies_performance_profile(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1 # NORMAL
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+    conn.close()
+
+
+def test_readers_are_not_blocked_by_an_open_write_transaction(tmp_path):
+    with CatalogDB(str(tmp_path / 'test.db'), readers=2) as db:
+        db.write(database.upsert_product, _product('SKU-1'))
+
+        in_transaction = threading.Event()
+        release = threading.Event()
+
+        def long_write(conn):
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE products SET title = 'pending' WHERE sku = 'SKU-1'")
+            in_transaction.set()
+            release.wait(5)
+            conn.commit()
+
+        pending = db.submit(long_write)
+        assert in_transaction.wait(5)
+        # The writer holds the write lock; a reader still sees the last committed snapshot immediately
+        assert db.read(lambda conn: conn.execute("SELECT title FROM products").fetchone()[0]) == 'SKU-1'
+        release.set()
+        pending.result(5)
+        assert db.read(lambda conn: conn.execute("SELECT title FROM products").fetchone()[0]) == 'pending'
+
+
+def test_reader_connections_are_read_only(tmp_path):
+    with CatalogDB(str(tmp_path / 'test.db'), readers=1) as db:
+        with db.reader() as conn:
+            with pytest.raises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM products")
@@ -3,7 +3,7 @@ import sys
 from pathlib import Path
 
 # Ensure catalog-sync package is on path
-sys.path.append(str(Path(__file__).resolve().parents[1]))
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
 from catalog_sync import database
 
 def test_initialize_db(tmp_path):
@@ -22,5 +22,138 @@ def test_initialize_db(tmp_path):
 
     cursor.execute("PRAGMA index_list(products)")
     indexes = [row[1] for row in cursor.fetchall()]
-    assert 'idx_products_shopify_id' in indexes
+    assert 'idx_products_shopify_product_id' in indexes
+    conn.close()
+
+
+def _product(sku, **overrides):
+    product = {
+        'id': 1001,
+        'title': 'Test Product',
+        'sku': sku,
+        'price': '19.99',
+        'inventory_quantity': 5,
+        'body_html': '<p>Test</p>',
+        'main_image_url': 'https://example.com/image.jpg',
+        'raw_shopify_data': {'id': 1001, 'title': 'Test Product'},
+    }
+    product.update(overrides)
+    return product
+
+
+def test_upsert_product_reports_only_real_changes(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+
+    assert database.upsert_product(conn, _product('SKU-1')) is True
+    assert database.upsert_product(conn, _product('SKU-1')) is False
+    assert database.upsert_product(conn, _product('SKU-1', price='21.00')) is True
+    conn.close()
+
+
+def test_upsert_products_counts_per_batch(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    database.upsert_product(conn, _product('SKU-1'))
+    database.upsert_product(conn, _product('SKU-2'))
+
+    products = (p for p in [
+        _product('SKU-1'),                       # unchanged
+        _product('SKU-2', inventory_quantity=9), # updated
+        _product('SKU-3'),                       # inserted
+        _product(None),                          # skipped, no SKU
+    ])
+    results = database.upsert_products(conn, products, batch_size=2)
+
+    assert results == [
+        {'inserted': 0, 'updated': 1, 'unchanged': 1, 'skipped': 0},
+        {'inserted': 1, 'updated': 0, 'unchanged': 0, 'skipped': 1},
+    ]
+    count = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+    assert count == 3
+    conn.close()
+
+
+def test_unchanged_content_hash_skips_write_and_push(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    database.upsert_product(conn, _product('SKU-1'))
+    database.mark_products_pushed(conn, [
+        (row['sku'], row['content_hash']) for row in database.get_products_needing_push(conn)
+    ])
+    assert database.get_products_needing_push(conn) == []
+
+    # Only non-Amazon fields differ in the raw payload, and the price is formatted differently
+    noisy = _product('SKU-1', price='19.990', raw_shopify_data={'id': 1001, 'updated_at': 'later'})
+    assert database.upsert_product(conn, noisy) is False
+    assert database.get_products_needing_push(conn) == []
+
+    assert database.upsert_product(conn, _product('SKU-1', title='New Title')) is True
+    assert [row['sku'] for row in database.get_products_needing_push(conn)] == ['SKU-1']
+    conn.close()
+
+
+def test_initialize_db_migrates_legacy_products_table(tmp_path):
+    db_path = tmp_path / 'legacy.db'
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY AUTOINCREMENT, shopify_product_id TEXT NOT NULL, "
+                 "sku TEXT UNIQUE NOT NULL, title TEXT, description TEXT, price REAL, quantity INTEGER, "
+                 "main_image_url TEXT, raw_shopify_data TEXT)")
+    conn.close()
+
+    conn = database.initialize_db(str(db_path))
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(products)")]
+    assert 'content_hash' in columns and 'needs_push' in columns
+    assert database.upsert_product(conn, _product('SKU-1')) is True
+    conn.close()
+
+
+def test_variants_are_stored_per_sku_and_updated_in_place(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    product = _product('SKU-1', variants=[
+        {'id': 11, 'sku': 'SKU-1', 'price': '19.99', 'inventory_quantity': 5, 'position': 1, 'inventory_item_id': 111},
+        {'id': 12, 'sku': 'SKU-1-XL', 'price': '21.99', 'inventory_quantity': 2, 'position': 2, 'inventory_item_id': 112},
+        {'id': 13, 'sku': '', 'price': '1.00', 'position': 3},
+    ])
+
+    results = database.upsert_products(conn, [product], with_variants=True)
+    assert results[0]['variants'] == {'inserted': 2, 'updated': 0, 'unchanged': 0}
+    assert [row['sku'] for row in database.get_variants_for_product(conn, 1001)] == ['SKU-1', 'SKU-1-XL']
+    assert database.upsert_variants(conn, [product]) == [{'inserted': 0, 'updated': 0, 'unchanged': 2}]
+
+    raw_before = conn.execute("SELECT raw_shopify_data FROM products WHERE sku = 'SKU-1'").fetchone()[0]
+    changed = database.apply_variant_deltas(conn, [
+        {'sku': 'SKU-1-XL', 'quantity': 0},
+        {'sku': 'SKU-1', 'price': '19.99'}, # already current, not rewritten
+    ])
+    assert changed == 1
+    variant = database.get_variant_by_sku(conn, 'SKU-1-XL')
+    assert variant['quantity'] == 0 and variant['price'] == 21.99
+    assert conn.execute("SELECT raw_shopify_data FROM products WHERE sku = 'SKU-1'").fetchone()[0] == raw_before
+    conn.close()
+
+
+def test_raw_data_compression_round_trips_and_migrates(tmp_path):
+    db_path = str(tmp_path / 'test.db')
+    conn = database.initialize_db(db_path)
+    products = [
+        _product(f'SKU-{i}', raw_shopify_data={
+            'id': i, 'title': f'Product {i}', 'status': 'active', 'vendor': 'Acme', 'tags': 'kitchen, linen',
+            'variants': [{'id': i * 10, 'sku': f'SKU-{i}', 'inventory_policy': 'deny', 'taxable': True}],
+        })
+        for i in range(50)
+    ]
+    database.upsert_products(conn, products)
+    size_before = conn.execute("SELECT SUM(LENGTH(raw_shopify_data)) FROM products").fetchone()[0]
+
+    dictionary = database.train_raw_data_dictionary(conn)
+    assert dictionary
+    assert database.migrate_raw_data_encoding(conn) == 50
+    size_after = conn.execute("SELECT SUM(LENGTH(raw_shopify_data)) FROM products").fetchone()[0]
+    assert size_after < size_before / 2
+    conn.close()
+
+    # The encoding is persisted, and reads decode transparently on a fresh connection
+    conn = database.initialize_db(db_path)
+    assert conn.raw_data_codec.name == 'zlib'
+    assert database.get_product_raw_data(conn, 'SKU-7')['variants'][0]['sku'] == 'SKU-7'
+    database.upsert_product(conn, _product('SKU-NEW', raw_shopify_data={'id': 99, 'status': 'active'}))
+    assert database.get_product_raw_data(conn, 'SKU-NEW') == {'id': 99, 'status': 'active'}
     conn.close()
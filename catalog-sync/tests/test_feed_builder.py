@@ -0,0 +1,73 @@
+import json
+import sys
+from pathlib import Path
+
+# Ensure catalog-sync package is on path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from catalog_sync import database
+from catalog_sync.feed_builder import ListingsFeedBuilder, iter_dirty_product_rows, push_dirty_products
+
+
+def _seed(conn, count):
+    database.upsert_products(conn, ({
+        'id': i, 'sku': f'SKU-{i:04d}', 'title': f'Product {i}', 'body_html': '<p>Desc</p>',
+        'price': '9.99', 'inventory_quantity': i, 'raw_shopify_data': {'id': i},
+    } for i in range(count)))
+
+
+class FakeFeedsClient:
+    def __init__(self):
+        self.uploaded = []
+        self.feeds = []
+
+    def create_feed_document(self, content_type):
+        return {"feedDocumentId": f"doc-{len(self.uploaded)}", "url": "https://s3.example.com/upload"}
+
+    def upload_feed_document(self, upload_url, feed_content, content_type):
+        self.uploaded.append(json.loads(feed_content.read()))
+        return True
+
+    def create_feed(self, feed_type, feed_document_id, marketplace_ids):
+        self.feeds.append((feed_type, feed_document_id, marketplace_ids))
+        return {"feedId": f"feed-{len(self.feeds)}"}
+
+
+def test_builder_splits_documents_at_message_and_byte_limits(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    _seed(conn, 25)
+
+    builder = ListingsFeedBuilder("SELLER", "ATVPDKIKX0DER", max_messages=10)
+    documents = list(builder.iter_documents(iter_dirty_product_rows(conn, page_size=7)))
+    assert [d.message_count for d in documents] == [10, 10, 5]
+    raw = documents[0].file.read()
+    assert len(raw) == documents[0].size
+    feed = json.loads(raw)
+    assert feed["header"]["sellerId"] == "SELLER"
+    assert [m["messageId"] for m in feed["messages"]] == list(range(1, 11))
+
+    small = ListingsFeedBuilder("SELLER", "ATVPDKIKX0DER", max_bytes=2000)
+    for document in small.iter_documents(iter_dirty_product_rows(conn)):
+        assert document.size <= 2000
+        assert len(document.file.read()) == document.size
+    conn.close()
+
+
+def test_push_dirty_products_uploads_each_chunk_and_tracks_the_feeds(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    _seed(conn, 12)
+    client = FakeFeedsClient()
+    builder = ListingsFeedBuilder("SELLER", "ATVPDKIKX0DER", max_messages=5)
+
+    submissions = push_dirty_products(client, conn, builder, ["ATVPDKIKX0DER"], page_size=4)
+    assert [s["message_count"] for s in submissions] == [5, 5, 2]
+    assert [m["sku"] for m in client.uploaded[2]["messages"]] == ["SKU-0010", "SKU-0011"]
+    assert [row["feed_id"] for row in database.get_pending_feeds(conn)] == ["feed-1", "feed-2", "feed-3"]
+    # Still dirty until the poller settles the feeds, but not sent again meanwhile
+    assert len(database.get_products_needing_push(conn)) == 12
+    assert list(iter_dirty_product_rows(conn)) == []
+    assert push_dirty_products(client, conn, builder, ["ATVPDKIKX0DER"]) == []
+
+    # Editing a product in flight makes it eligible again
+    conn.execute("UPDATE products SET content_hash = 'edited' WHERE sku = 'SKU-0003'")
+    assert [row["sku"] for row in iter_dirty_product_rows(conn)] == ["SKU-0003"]
+    conn.close()
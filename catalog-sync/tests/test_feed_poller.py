@@ -0,0 +1,149 @@
+import gzip
+import json
+import sys
+from pathlib import Path
+
+# Ensure catalog-sync package is on path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from catalog_sync import database, feed_poller
+from catalog_sync.feed_poller import FeedStatusPoller
+from catalog_sync.metrics import REGISTRY
+
+
+class FakeFeedsClient:
+    """Each feed reports the statuses queued for it, one per getFeed call."""
+
+    def __init__(self, statuses, issues=()):
+        self.statuses = {feed_id: list(values) for feed_id, values in statuses.items()}
+        self.issues = list(issues)
+        self.status_calls = []
+        self.downloads = []
+
+    def get_feed_status(self, feed_id):
+        self.status_calls.append(feed_id)
+        status = self.statuses[feed_id].pop(0)
+        response = {"feedId": feed_id, "processingStatus": status}
+        if status == "DONE":
+            response["resultFeedDocumentId"] = f"report-{feed_id}"
+        return response
+
+    def get_feed_document(self, feed_document_id):
+        return {"feedDocumentId": feed_document_id, "url": f"https://s3.example.com/{feed_document_id}"}
+
+    def download_feed_document(self, url, compression_algorithm=None):
+        self.downloads.append(url)
+        return json.dumps({"issues": self.issues, "summary": {"errors": 0, "messagesAccepted": 3}}).encode()
+
+
+def test_poller_tracks_feeds_concurrently_and_resumes_after_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(feed_poller.time, "sleep", lambda seconds: None)
+    db_path = str(tmp_path / "test.db")
+    conn = database.initialize_db(db_path)
+    client = FakeFeedsClient({"F1": ["DONE"], "F2": ["IN_QUEUE", "IN_PROGRESS", "DONE"]})
+    finished = []
+
+    with FeedStatusPoller(client, conn, initial_interval=0, on_result=lambda row, report: finished.append(
+            (row["feed_id"], report["summary"]["messagesAccepted"]))) as poller:
+        poller.track("F1", "JSON_LISTINGS_FEED", message_count=3)
+        poller.track("F2", "JSON_LISTINGS_FEED", message_count=3)
+        assert poller.poll_once() == 2
+    assert finished == [("F1", 3)]
+    conn.close()
+
+    # A new process resumes F2 from the database
+    conn = database.initialize_db(db_path)
+    with FeedStatusPoller(client, conn, initial_interval=0, on_result=lambda row, report: finished.append(
+            (row["feed_id"], report["summary"]["messagesAccepted"]))) as poller:
+        assert poller.run(timeout=5) is True
+    assert finished == [("F1", 3), ("F2", 3)]
+    assert client.status_calls.count("F2") == 3
+    row = conn.execute("SELECT * FROM feeds WHERE feed_id = 'F2'").fetchone()
+    assert row["status"] == "DONE" and row["result_fetched"] == 1
+    assert json.loads(row["result_summary"]) == {"errors": 0, "messagesAccepted": 3}
+    conn.close()
+
+
+def test_poll_interval_backs_off_per_feed(tmp_path):
+    conn = database.initialize_db(str(tmp_path / "test.db"))
+    client = FakeFeedsClient({"SLOW": ["IN_PROGRESS"] * 3})
+    with FeedStatusPoller(client, conn, initial_interval=10, max_interval=20, backoff_factor=1.5) as poller:
+        database.record_feed_submission(conn, "SLOW", "JSON_LISTINGS_FEED")
+        intervals = []
+        for _ in range(3):
+            conn.execute("UPDATE feeds SET next_poll_at = 0")
+            poller.poll_once()
+            intervals.append(conn.execute("SELECT poll_interval FROM feeds").fetchone()[0])
+    assert 13.5 <= intervals[0] <= 16.5
+    assert intervals[0] < intervals[1] <= 22
+    assert intervals[2] <= 22
+    conn.close()
+
+
+def test_finished_feeds_settle_their_products(tmp_path):
+    conn = database.initialize_db(str(tmp_path / "test.db"))
+    database.upsert_products(conn, ({'id': i, 'sku': f'SKU-{i}', 'title': f'Product {i}', 'price': '1.00',
+                                     'raw_shopify_data': {'id': i}} for i in range(6)))
+    hashes = dict(conn.execute("SELECT sku, content_hash FROM products").fetchall())
+    database.record_feed_submission(conn, "OK", "JSON_LISTINGS_FEED", message_count=3,
+                                    items=[(i + 1, f'SKU-{i}', hashes[f'SKU-{i}']) for i in range(3)])
+    database.record_feed_submission(conn, "BAD", "JSON_LISTINGS_FEED", message_count=3,
+                                    items=[(i - 2, f'SKU-{i}', hashes[f'SKU-{i}']) for i in range(3, 6)])
+    issues = [{"messageId": 2, "code": "90220", "severity": "ERROR", "message": "price is required"},
+              {"messageId": 3, "code": "18027", "severity": "WARNING", "message": "image not found"}]
+    client = FakeFeedsClient({"OK": ["DONE"], "BAD": ["FATAL"]}, issues=issues)
+
+    with FeedStatusPoller(client, conn, initial_interval=0) as poller:
+        poller.poll_once()
+
+    dirty = [row["sku"] for row in conn.execute("SELECT sku FROM products WHERE needs_push = 1 ORDER BY sku")]
+    assert dirty == ["SKU-1", "SKU-3", "SKU-4", "SKU-5"]
+    pushed = dict(conn.execute("SELECT sku, last_pushed_hash FROM amazon_listings").fetchall())
+    assert pushed == {"SKU-0": hashes["SKU-0"], "SKU-2": hashes["SKU-2"]}
+    assert conn.execute("SELECT COUNT(*) FROM feed_items").fetchone()[0] == 0
+    conn.close()
+
+
+def test_a_failing_feed_backs_off_without_stopping_the_others(tmp_path):
+    conn = database.initialize_db(str(tmp_path / "test.db"))
+    client = FakeFeedsClient({"GOOD": ["DONE"], "CORRUPT": ["DONE"]})
+    download = client.download_feed_document
+
+    def flaky_download(url, compression_algorithm=None):
+        if url.endswith("report-CORRUPT"):
+            raise gzip.BadGzipFile("Not a gzipped file")
+        return download(url, compression_algorithm)
+
+    client.download_feed_document = flaky_download
+    errors = REGISTRY.counter("feed_poll_errors_total", "", ("reason",))
+    errors_before = errors.value(reason="BadGzipFile")
+    with FeedStatusPoller(client, conn, initial_interval=10) as poller:
+        database.record_feed_submission(conn, "GOOD", "JSON_LISTINGS_FEED")
+        database.record_feed_submission(conn, "CORRUPT", "JSON_LISTINGS_FEED")
+        assert poller.poll_once() == 2
+
+    assert [row["feed_id"] for row in database.get_pending_feeds(conn)] == ["CORRUPT"]
+    row = conn.execute("SELECT * FROM feeds WHERE feed_id = 'CORRUPT'").fetchone()
+    assert 18 <= row["poll_interval"] <= 22
+    assert errors.value(reason="BadGzipFile") == errors_before + 1
+    conn.close()
+
+
+def test_a_failing_on_result_callback_does_not_stop_the_batch(tmp_path, caplog):
+    conn = database.initialize_db(str(tmp_path / "test.db"))
+    client = FakeFeedsClient({"F1": ["DONE"], "F2": ["DONE"]})
+    finished = []
+
+    def on_result(row, report):
+        if row["feed_id"] == "F1":
+            raise KeyError("summary")
+        finished.append(row["feed_id"])
+
+    with FeedStatusPoller(client, conn, initial_interval=0, on_result=on_result) as poller:
+        poller.track("F1", "JSON_LISTINGS_FEED")
+        poller.track("F2", "JSON_LISTINGS_FEED")
+        assert poller.poll_once() == 2
+
+    assert finished == ["F2"]
+    assert database.get_pending_feeds(conn) == []
+    assert any(record.levelname == "ERROR" and "F1" in record.getMessage() for record in caplog.records)
+    conn.close()
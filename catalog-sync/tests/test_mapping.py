@@ -0,0 +1,148 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# Ensure catalog-sync package is on path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from catalog_sync import database
+from catalog_sync.feed_builder import ListingsFeedBuilder, iter_dirty_product_rows
+from catalog_sync.mapping import compile_mapping, strip_html
+from catalog_sync.shopify_client import parse_product_data
+
+
+def test_strip_html():
+    assert strip_html("<p>Soft&nbsp;cotton</p>\n<ul><li>Machine wash</li></ul>") == "Soft cotton Machine wash"
+    assert strip_html("<style>p {}</style>Tom &amp; Jerry &lt;b&gt;") == "Tom & Jerry <b>"
+    assert strip_html("No markup") == "No markup" and strip_html(None) is None
+
+
+def test_default_mapping_builds_listing_messages_from_parsed_products():
+    product = parse_product_data({
+        'id': 1, 'title': '  Cotton   Shirt ', 'body_html': '<p>Soft</p>', 'image': {'src': 'https://cdn/x.jpg'},
+        'variants': [{'sku': 'SHIRT-1', 'price': '19.9', 'inventory_quantity': -2}],
+    })
+    bare = parse_product_data({'id': 2, 'title': 'Bare', 'variants': [{'sku': 'BARE-1'}]})
+    messages = compile_mapping(marketplace_id="A1").map_batch([product, bare])
+
+    assert messages[0] == {
+        "sku": "SHIRT-1", "operationType": "UPDATE", "productType": "PRODUCT",
+        "attributes": {
+            "item_name": [{"value": "Cotton Shirt", "language_tag": "en_US", "marketplace_id": "A1"}],
+            "product_description": [{"value": "Soft", "language_tag": "en_US", "marketplace_id": "A1"}],
+            "purchasable_offer": [{"currency": "USD", "marketplace_id": "A1",
+                                   "our_price": [{"schedule": [{"value_with_tax": 19.9}]}]}],
+            "fulfillment_availability": [{"fulfillment_channel_code": "DEFAULT", "quantity": 0}],
+            "main_product_image_locator": [{"media_location": "https://cdn/x.jpg", "marketplace_id": "A1"}],
+        },
+    }
+    assert sorted(messages[1]["attributes"]) == ["fulfillment_availability", "item_name"]
+
+
+def test_category_templates_are_selected_per_product():
+    spec = {
+        "currency": "EUR",
+        "product_type": {"source": "raw.product_type", "transforms": [["lookup", {"Mugs": "KITCHEN"}]],
+                         "default": "PRODUCT"},
+        "templates": {
+            "PRODUCT": {"attributes": {
+                "item_name": {"source": "title", "shape": "text"},
+                "purchasable_offer": {"source": "price", "transforms": [["price", 1.2]], "shape": "offer"},
+            }},
+            "KITCHEN": {"extends": "PRODUCT", "attributes": {
+                "brand": {"value": "Acme", "shape": "value"},
+                "purchasable_offer": None,
+            }},
+        },
+    }
+    products = [parse_product_data({'id': i, 'title': f'T{i}', 'product_type': kind,
+                                    'variants': [{'sku': f'S{i}', 'price': '10.00'}]})
+                for i, kind in enumerate(['Mugs', 'Shirts', 'Mugs'])]
+    messages = compile_mapping(spec, "A1").map_batch(products)
+
+    assert [m["productType"] for m in messages] == ["KITCHEN", "PRODUCT", "KITCHEN"]
+    assert sorted(messages[0]["attributes"]) == ["brand", "item_name"]
+    assert messages[1]["attributes"]["purchasable_offer"][0]["our_price"][0]["schedule"][0]["value_with_tax"] == 12.0
+    assert messages[2]["attributes"]["item_name"][0]["value"] == "T2"
+
+    with pytest.raises(ValueError):
+        compile_mapping({"templates": {"PRODUCT": {"attributes": {"x": {"source": "title", "transforms": ["nope"]}}}}})
+
+
+def test_feed_builder_maps_database_rows_in_batches(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    database.upsert_products(conn, ({
+        'id': i, 'sku': f'SKU-{i:04d}', 'title': f'Product {i}', 'body_html': '<b>Bold</b> text',
+        'price': '9.99', 'inventory_quantity': i, 'raw_shopify_data': {'id': i},
+    } for i in range(7)))
+
+    builder = ListingsFeedBuilder("SELLER", "A1", mapping=compile_mapping(marketplace_id="A1"), mapping_batch_size=3)
+    (document,) = builder.iter_documents(iter_dirty_product_rows(conn))
+    messages = json.loads(document.file.read())["messages"]
+    assert [m["messageId"] for m in messages] == list(range(1, 8))
+    assert messages[6]["attributes"]["product_description"][0]["value"] == "Bold text"
+    assert messages[6]["attributes"]["fulfillment_availability"][0]["quantity"] == 6
+    conn.close()
+
+
+def test_raw_sources_resolve_on_stored_rows_in_every_encoding(tmp_path):
+    spec = {
+        "product_type": {"source": "raw.product_type", "transforms": [["lookup", {"Mugs": "KITCHEN"}]]},
+        "templates": {
+            "PRODUCT": {"attributes": {"item_name": {"source": "title", "shape": "text"}}},
+            "KITCHEN": {"extends": "PRODUCT", "attributes": {"brand": {"source": "raw.vendor", "shape": "value"}}},
+        },
+    }
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    builder = ListingsFeedBuilder("SELLER", "A1", mapping=compile_mapping(spec, "A1"))
+    assert builder.uses_raw_data
+    assert not ListingsFeedBuilder("SELLER", "A1", mapping=compile_mapping(marketplace_id="A1")).uses_raw_data
+
+    for encoding, start in (('json', 0), ('zlib', 2)): # raw_shopify_data stored as JSON text, then as zlib BLOBs
+        database.set_raw_data_encoding(conn, encoding)
+        database.upsert_products(conn, (parse_product_data({
+            'id': i, 'title': f'T{i}', 'product_type': kind, 'vendor': 'Acme',
+            'variants': [{'sku': f'S{i}', 'price': '10.00'}],
+        }) for i, kind in enumerate(['Mugs', 'Shirts'], start)))
+
+    rows = list(iter_dirty_product_rows(conn, with_raw_data=True))
+    assert rows[2]["raw_shopify_data"]["vendor"] == "Acme"
+    (document,) = builder.iter_documents(rows)
+    messages = json.loads(document.file.read())["messages"]
+    assert [m["productType"] for m in messages] == ["KITCHEN", "PRODUCT", "KITCHEN", "PRODUCT"]
+    assert messages[2]["attributes"]["brand"] == [{"value": "Acme", "marketplace_id": "A1"}]
+    conn.close()
+
+
+def test_edits_to_mapped_raw_fields_make_products_dirty(tmp_path):
+    spec = {"templates": {"PRODUCT": {"attributes": {
+        "item_name": {"source": "title", "shape": "text"},
+        "brand": {"source": "raw.vendor", "shape": "value"},
+    }}}}
+    mapping = compile_mapping(spec, "A1")
+    assert mapping.raw_fields == ("vendor",)
+
+    def product(vendor):
+        return parse_product_data({'id': 1, 'title': 'Shirt', 'vendor': vendor, 'variants': [{'sku': 'S1', 'price': '10.00'}]})
+
+    db_path = str(tmp_path / 'test.db')
+    conn = database.initialize_db(db_path)
+    assert database.register_content_hash_raw_fields(conn, mapping.raw_fields) is True
+    assert database.register_content_hash_raw_fields(conn, mapping.raw_fields) is False
+    conn.close()
+
+    conn = database.initialize_db(db_path) # Registered fields persist for later connections
+    database.upsert_product(conn, product('Acme'))
+    database.mark_products_pushed(conn, [(row['sku'], row['content_hash']) for row in conn.execute("SELECT * FROM products")])
+    assert database.upsert_product(conn, product('Acme')) is False
+
+    # Only the vendor changes: the row is rewritten and pushed again with the new brand
+    assert database.upsert_product(conn, product('Globex')) is True
+    assert database.get_product_raw_data(conn, 'S1')['vendor'] == 'Globex'
+    (row,) = iter_dirty_product_rows(conn, with_raw_data=True)
+    builder = ListingsFeedBuilder("SELLER", "A1", mapping=mapping)
+    (document,) = builder.iter_documents([row])
+    (message,) = json.loads(document.file.read())["messages"]
+    assert message["attributes"]["brand"] == [{"value": "Globex", "marketplace_id": "A1"}]
+    conn.close()
@@ -0,0 +1,59 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+import requests
+
+# Ensure catalog-sync package is on path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from catalog_sync import database
+from catalog_sync.metrics import REGISTRY, MetricsRegistry, normalize_endpoint, serve_metrics
+
+
+def test_histogram_renders_prometheus_text_and_quantiles():
+    registry = MetricsRegistry()
+    latency = registry.histogram("request_seconds", "Latency", ("endpoint",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.05, 0.5, 2.0):
+        latency.observe(value, endpoint="products.json")
+    registry.counter("retries_total", "Retries", ("reason",)).inc(reason="429")
+
+    text = registry.render_prometheus()
+    assert '# TYPE request_seconds histogram' in text
+    assert 'request_seconds_bucket{endpoint="products.json",le="0.1"} 2' in text
+    assert 'request_seconds_bucket{endpoint="products.json",le="+Inf"} 4' in text
+    assert 'request_seconds_count{endpoint="products.json"} 4' in text
+    assert 'retries_total{reason="429"} 1' in text
+
+    (series,) = registry.snapshot()["request_seconds"]["series"]
+    assert series["count"] == 4 and series["sum"] == pytest.approx(2.6)
+    assert series["p50"] == pytest.approx(0.1) and series["p95"] == 1.0
+
+    with pytest.raises(ValueError):
+        latency.observe(1.0)
+    with pytest.raises(ValueError):
+        registry.counter("request_seconds", "Latency")
+
+
+def test_normalize_endpoint():
+    assert normalize_endpoint("products/632910392.json") == "products/{id}.json"
+    assert normalize_endpoint("/feeds/2021-06-30/feeds/123") == "/feeds/2021-06-30/feeds/{id}"
+
+
+def test_database_writes_are_recorded_and_served(tmp_path):
+    rows = REGISTRY.counter("db_rows_total", "", ("table", "outcome"))
+    inserted_before = rows.value(table="products", outcome="inserted")
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    database.upsert_products(conn, [{'id': i, 'sku': f'SKU-{i}', 'raw_shopify_data': {}} for i in range(3)])
+    conn.close()
+    assert rows.value(table="products", outcome="inserted") == inserted_before + 3
+
+    server = serve_metrics(port=0, host="127.0.0.1")
+    try:
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        assert 'db_write_seconds_count{operation="upsert_products"}' in requests.get(f"{base}/metrics").text
+        report = json.loads(requests.get(f"{base}/metrics.json").text)
+        assert report["db_rows_total"]["type"] == "counter"
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,109 @@
+import gzip
+import sys
+from pathlib import Path
+
+import pytest
+
+# Ensure catalog-sync package is on path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from catalog_sync import database, reconciliation
+
+REPORT_HEADER = "item-name\titem-description\tlisting-id\tseller-sku\tprice\tquantity\topen-date\tasin1\tstatus\n"
+
+
+def _report(*rows):
+    lines = [REPORT_HEADER]
+    for sku, asin, price, quantity, status in rows:
+        lines.append(f'Item "{sku}"\t\tL-{sku}\t{sku}\t{price}\t{quantity}\t2024-01-01 10:00:00 PST\t{asin}\t{status}\n')
+    return "".join(lines).encode("cp1252")
+
+
+def _product(sku, title='Shirt'):
+    return {'id': 1, 'sku': sku, 'title': title, 'price': '10.00', 'inventory_quantity': 3,
+            'raw_shopify_data': {'id': 1}}
+
+
+def _diff(conn):
+    return {row['sku']: row['action'] for row in reconciliation.iter_listing_diff(conn)}
+
+
+def test_report_rows_are_parsed_with_optional_fields():
+    stream = reconciliation._open_report(_report(('A', 'B0A', '9.99', '', 'Active'),
+                                                 ('', 'B0X', '1.00', '1', 'Active')), "cp1252")
+    # The row without a SKU is skipped; FBA offers have an empty quantity
+    assert list(reconciliation.iter_merchant_listings_report(stream)) == [
+        ('A', 'B0A', 'Active', 9.99, None, '2024-01-01 10:00:00 PST'),
+    ]
+
+
+def test_load_report_merges_keeps_pushed_hash_and_removes_missing_skus(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    database.mark_products_pushed(conn, [('A', 'hash-a'), ('PENDING', 'hash-p')])
+
+    first = reconciliation.load_merchant_listings_report(
+        conn, _report(('A', 'B0A', '9.99', '5', 'Active'), ('B', 'B0B', '5.00', '0', 'Inactive')))
+    assert first == {'rows': 2, 'inserted': 1, 'updated': 1, 'unchanged': 0, 'removed': 0}
+    row = conn.execute("SELECT * FROM amazon_listings WHERE sku = 'A'").fetchone()
+    assert (row['asin'], row['status'], row['price'], row['quantity'], row['last_pushed_hash']) == \
+        ('B0A', 'Active', 9.99, 5, 'hash-a')
+
+    path = tmp_path / 'report.txt.gz'
+    path.write_bytes(gzip.compress(_report(('A', 'B0A', '9.99', '5', 'Active'))))
+    second = reconciliation.load_merchant_listings_report(conn, str(path))
+    # B was seen before and is gone now; PENDING was only pushed, so it stays
+    assert second == {'rows': 1, 'inserted': 0, 'updated': 0, 'unchanged': 1, 'removed': 1}
+    skus = [r['sku'] for r in conn.execute("SELECT sku FROM amazon_listings ORDER BY sku")]
+    assert skus == ['A', 'PENDING']
+    conn.close()
+
+
+def test_bad_downloads_leave_the_listings_untouched(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    report = _report(('A', 'B0A', '9.99', '5', 'Active'), ('B', 'B0B', '5.00', '0', 'Inactive'))
+    reconciliation.load_merchant_listings_report(conn, report)
+
+    bad_downloads = [
+        b'',                                  # empty body
+        b'\n',                                # no header
+        REPORT_HEADER.encode(),               # header only
+        report[:-20],                         # cut off mid-row
+        gzip.compress(report)[:-12],          # truncated gzip stream
+    ]
+    for download in bad_downloads:
+        with pytest.raises((ValueError, EOFError)):
+            reconciliation.load_merchant_listings_report(conn, download)
+        assert [r['sku'] for r in conn.execute("SELECT sku FROM amazon_listings ORDER BY sku")] == ['A', 'B']
+
+    # A genuinely empty account is still possible, but only when asked for
+    result = reconciliation.load_merchant_listings_report(conn, REPORT_HEADER.encode(), allow_empty=True)
+    assert (result['rows'], result['removed']) == (0, 2)
+    conn.close()
+
+
+def test_listing_diff_finds_new_changed_and_deleted_skus(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    database.upsert_products(conn, [_product('SAME'), _product('EDITED'), _product('UNPUSHED'), _product('NEW')])
+    database.mark_products_pushed(conn, [
+        (row['sku'], row['content_hash']) for row in database.get_products_needing_push(conn)
+        if row['sku'] in ('SAME', 'EDITED')
+    ])
+    database.upsert_products(conn, [_product('EDITED', title='Shirt v2')])
+    reconciliation.load_merchant_listings_report(conn, _report(
+        ('SAME', 'B01', '10.00', '3', 'Active'),
+        ('EDITED', 'B02', '10.00', '3', 'Active'),
+        ('UNPUSHED', 'B03', '10.00', '3', 'Active'), # Listed on Amazon by hand
+        ('GONE', 'B04', '10.00', '3', 'Active'),
+    ))
+
+    assert _diff(conn) == {'EDITED': 'changed', 'UNPUSHED': 'changed', 'NEW': 'new', 'GONE': 'deleted'}
+    assert reconciliation.summarize_listing_diff(conn) == {'new': 1, 'changed': 2, 'deleted': 1, 'in_sync': 1}
+
+    database.mark_products_pushed(conn, [
+        (row['sku'], row['content_hash']) for row in database.get_products_needing_push(conn)
+    ])
+    assert _diff(conn) == {'GONE': 'deleted'}
+    # A listing changed behind our back (hash forgotten) is flagged for the next push again
+    conn.execute("UPDATE amazon_listings SET last_pushed_hash = NULL WHERE sku = 'SAME'")
+    assert reconciliation.flag_listing_diff(conn) == 1
+    assert [row['sku'] for row in database.get_products_needing_push(conn)] == ['SAME']
+    conn.close()
@@ -0,0 +1,72 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Ensure catalog-sync package is on path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from catalog_sync import shopify_bulk
+from catalog_sync.shopify_bulk import ShopifyBulkOperationClient, ShopifyBulkOperationError, iter_bulk_products
+from catalog_sync.shopify_client import ShopifyAPIClient
+
+FIXTURE = Path(__file__).parent / "fixtures" / "shopify_bulk_products.jsonl"
+
+
+class StandInShopify:
+    """Answers the GraphQL calls of a bulk export and serves the JSONL fixture as its result file."""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.queries = []
+
+    def _request(self, method, endpoint, params=None, json_data=None):
+        self.queries.append(json_data)
+        if "bulkOperationRunQuery" in json_data["query"]:
+            return {"data": {"bulkOperationRunQuery": {
+                "bulkOperation": {"id": "gid://shopify/BulkOperation/1", "status": "CREATED"}, "userErrors": []}}}
+        status = self.statuses.pop(0)
+        return {"data": {"currentBulkOperation": {
+            "id": "gid://shopify/BulkOperation/1", "status": status, "errorCode": None,
+            "url": "https://storage.example.com/export.jsonl" if status == "COMPLETED" else None}}}
+
+
+@pytest.fixture
+def bulk_client(monkeypatch):
+    monkeypatch.setattr(shopify_bulk.time, "sleep", lambda seconds: None)
+    parser = ShopifyAPIClient.__new__(ShopifyAPIClient) # only _parse_product_data is needed
+
+    def make(statuses):
+        stand_in = StandInShopify(statuses)
+        stand_in._parse_product_data = parser._parse_product_data
+        client = ShopifyBulkOperationClient(stand_in)
+        client.iter_result_lines = lambda url: FIXTURE.open("rb")
+        return client, stand_in
+    return make
+
+
+def test_iter_bulk_products_groups_variants_under_parent():
+    with FIXTURE.open() as lines:
+        products = list(iter_bulk_products(lines))
+
+    assert [p["id"] for p in products] == [101, 102]
+    assert [v["sku"] for v in products[0]["variants"]] == ["APRON-NAT", "APRON-BLK"]
+    assert [v["inventory_item_id"] for v in products[0]["variants"]] == [5001, 5002]
+    assert products[0]["image"] == {"src": "https://cdn.example.com/apron.jpg"}
+    assert products[1]["tags"] == "" and products[1]["status"] == "draft"
+
+
+def test_bulk_client_yields_rest_shaped_parsed_products(bulk_client):
+    client, stand_in = bulk_client(["RUNNING", "RUNNING", "COMPLETED"])
+
+    products = list(client.iter_all_products())
+    assert [(p["sku"], p["price"], p["inventory_quantity"]) for p in products] == [
+        ("APRON-NAT", "29.00", 12), ("BOARD-OAK", "45.50", 3)]
+    assert products[0]["main_image_url"] == "https://cdn.example.com/apron.jpg"
+    assert len(stand_in.queries) == 4 # submit + three polls
+
+
+def test_bulk_client_raises_when_operation_fails(bulk_client):
+    client, _ = bulk_client(["RUNNING", "FAILED"])
+
+    with pytest.raises(ShopifyBulkOperationError):
+        list(client.iter_all_products())
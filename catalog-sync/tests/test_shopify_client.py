@@ -0,0 +1,197 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+import requests
+
+# Ensure catalog-sync package is on path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from catalog_sync import shopify_client
+from catalog_sync.shopify_client import ShopifyAPIClient, ShopifyAPIError
+from catalog_sync.throttling import ShopifyCallLimitThrottler
+
+
+def make_response(status_code=200, body=None, headers=None, url="https://example.myshopify.com/"):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body if body is not None else {}).encode("utf-8")
+    response.headers.update(headers or {})
+    response.url = url
+    return response
+
+
+class FakeSession:
+    """Stands in for requests.Session, replaying queued responses (or exceptions) in order."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.headers = {}
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        result = self.responses.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        pass
+
+
+class NullThrottler:
+    """Unlimited rate budget so only the retry backoff shows up in recorded sleeps."""
+
+    def acquire(self):
+        return 0
+
+    def update_from_header(self, header_value):
+        pass
+
+    def record_throttled(self):
+        pass
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(shopify_client.time, "sleep", recorded.append)
+    return recorded
+
+
+def make_client(responses, **kwargs):
+    session = FakeSession(responses)
+    kwargs.setdefault("throttler", NullThrottler())
+    client = ShopifyAPIClient("example.myshopify.com", "key", "secret", session=session, **kwargs)
+    return client, session
+
+
+def test_request_retries_429_honouring_retry_after(sleeps):
+    client, session = make_client([
+        make_response(429, headers={"Retry-After": "2.0"}),
+        requests.exceptions.ConnectionError("reset"),
+        make_response(200, {"product": {"id": 1}}),
+    ])
+
+    assert client._request("GET", "products/1.json") == {"product": {"id": 1}}
+    assert len(session.calls) == 3
+    assert sleeps[0] == 2.0
+    assert 0 <= sleeps[1] <= client.backoff_factor * 2
+    assert session.calls[0][2]["timeout"] == client.timeout
+
+
+def test_request_raises_after_retries_exhausted(sleeps):
+    client, _ = make_client([make_response(503)] * 3, max_retries=2)
+
+    with pytest.raises(ShopifyAPIError) as excinfo:
+        client._request("GET", "products.json")
+    assert excinfo.value.status_code == 503
+    assert len(sleeps) == 2
+
+
+def test_non_retryable_error_is_not_retried(sleeps):
+    client, session = make_client([make_response(404)])
+
+    with pytest.raises(ShopifyAPIError) as excinfo:
+        client.get_product_details(42)
+    assert excinfo.value.status_code == 404
+    assert len(session.calls) == 1 and sleeps == []
+
+
+def test_post_is_not_retried_after_a_server_error_or_timeout(sleeps):
+    client, session = make_client([make_response(502)])
+    with pytest.raises(ShopifyAPIError):
+        client._request("POST", "graphql.json", json_data={"query": "mutation"})
+    assert len(session.calls) == 1
+
+    client, session = make_client([requests.exceptions.ReadTimeout("slow")])
+    with pytest.raises(ShopifyAPIError):
+        client._request("POST", "graphql.json", json_data={"query": "mutation"})
+    assert len(session.calls) == 1 and sleeps == []
+
+    # Throttled requests were rejected before running, so they are safe to resend
+    client, session = make_client([make_response(429, headers={"Retry-After": "0"}), make_response(200, {"data": {}})])
+    assert client._request("POST", "graphql.json", json_data={"query": "mutation"}) == {"data": {}}
+    assert len(session.calls) == 2
+
+
+def test_iter_all_products_follows_link_header_cursors():
+    base = "https://example.myshopify.com/admin/api/2023-10/products.json"
+    client, session = make_client([
+        make_response(200, {"products": [{"id": 1, "variants": [{"sku": "A"}]}]},
+                      headers={"Link": f'<{base}?limit=1&page_info=abc>; rel="next"'}),
+        make_response(200, {"products": [{"id": 2, "variants": [{"sku": "B"}]}]},
+                      headers={"Link": f'<{base}?limit=1&page_info=xyz>; rel="previous"'}),
+    ])
+
+    products = client.iter_all_products(page_size=1, params={"updated_at_min": "2024-01-01"})
+    assert [p["sku"] for p in products] == ["A", "B"]
+    assert session.calls[0][2]["params"] == {"updated_at_min": "2024-01-01", "limit": 1}
+    assert session.calls[1][2]["params"] == {"limit": 1, "page_info": "abc"}
+
+
+@pytest.mark.parametrize("body", [{"errors": "Not Found"}, None])
+def test_iter_all_products_raises_on_a_page_without_products(body):
+    page = make_response(200, body)
+    if body is None:
+        page._content = b"<html>Service unavailable</html>"
+    client, _ = make_client([page])
+
+    with pytest.raises(ShopifyAPIError):
+        list(client.iter_all_products())
+
+
+def test_get_inventory_levels_batches_items_and_follows_cursors():
+    base = "https://example.myshopify.com/admin/api/2023-10/inventory_levels.json"
+    level = {"inventory_item_id": 1, "location_id": 7, "available": 2}
+    client, session = make_client([
+        make_response(200, {"inventory_levels": [level]}, headers={"Link": f'<{base}?page_info=abc>; rel="next"'}),
+        make_response(200, {"inventory_levels": [dict(level, location_id=8)]}),
+        make_response(200, {"inventory_levels": [dict(level, inventory_item_id=60)]}),
+    ])
+
+    levels = client.get_inventory_levels(range(1, 61))
+    assert [(l["inventory_item_id"], l["location_id"]) for l in levels] == [(1, 7), (1, 8), (60, 7)]
+    assert session.calls[0][2]["params"] == {"inventory_item_ids": ",".join(map(str, range(1, 51))), "limit": 250}
+    assert session.calls[1][2]["params"] == {"limit": 250, "page_info": "abc"}
+    assert session.calls[2][2]["params"]["inventory_item_ids"] == ",".join(map(str, range(51, 61)))
+
+
+def test_request_feeds_call_limit_header_to_throttler(sleeps):
+    throttler = ShopifyCallLimitThrottler()
+    client, _ = make_client([make_response(200, {}, headers={"X-Shopify-Shop-Api-Call-Limit": "39/40"})],
+                            throttler=throttler)
+
+    client._request("GET", "shop.json")
+    assert throttler.metrics()['wait_seconds'] > 0
+
+
+def test_get_product_details_many_keeps_input_order_and_reports_errors(sleeps):
+    class RoutingSession(FakeSession):
+        def request(self, method, url, **kwargs):
+            self.calls.append((method, url, kwargs))
+            product_id = int(url.rsplit("/", 1)[1].split(".")[0])
+            if product_id == 2:
+                return make_response(404, {"errors": "Not Found"})
+            return make_response(200, {"product": {"id": product_id, "variants": [{"sku": f"SKU-{product_id}"}]}})
+
+    client = ShopifyAPIClient("example.myshopify.com", "key", "secret",
+                              session=RoutingSession([]), throttler=NullThrottler())
+
+    results = client.get_product_details_many([3, 2, 1], concurrency=3)
+    assert [r['id'] for r in results] == [3, 2, 1]
+    assert results[0]['product']['sku'] == "SKU-3" and results[0]['error'] is None
+    assert results[1]['product'] is None and results[1]['error'].status_code == 404
+
+
+def test_get_product_details_many_reports_non_json_bodies_as_api_errors(sleeps):
+    maintenance_page = requests.Response()
+    maintenance_page.status_code = 200
+    maintenance_page._content = b"<html><body>Down for maintenance</body></html>"
+    session = FakeSession([maintenance_page])
+    client = ShopifyAPIClient("example.myshopify.com", "key", "secret", session=session, throttler=NullThrottler())
+
+    results = client.get_product_details_many([7])
+    assert results[0]['product'] is None
+    assert isinstance(results[0]['error'], ShopifyAPIError) and "maintenance" in results[0]['error'].response_text
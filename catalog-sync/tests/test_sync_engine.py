@@ -0,0 +1,166 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# Ensure catalog-sync package is on path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from catalog_sync import database, sync_engine
+
+
+class FakeShopifyClient:
+    store_url = "example.myshopify.com"
+
+    def __init__(self, products):
+        self.products = products
+        self.requested_params = []
+
+    def iter_all_products(self, page_size=250, params=None):
+        self.requested_params.append(params)
+        yield from self.products
+
+
+def _product(sku, updated_at, **overrides):
+    product = {'id': 1, 'sku': sku, 'title': sku, 'price': '1.00',
+               'raw_shopify_data': {'id': 1, 'updated_at': updated_at}}
+    product.update(overrides)
+    return product
+
+
+def test_incremental_sync_uses_and_advances_watermark(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+
+    first = FakeShopifyClient([
+        _product('A', '2024-01-01T10:00:00-05:00'),
+        _product('B', '2024-01-01T14:30:00+00:00'),
+    ])
+    result = sync_engine.run_incremental_sync(first, conn)
+    assert result['mode'] == 'full' and first.requested_params == [None]
+    assert result['totals']['inserted'] == 2
+    assert result['watermark_after'] == '2024-01-01T15:00:00+00:00'
+
+    second = FakeShopifyClient([
+        _product('A', '2024-01-01T10:00:00-05:00'), # boundary product re-sent, unchanged
+        _product('C', '2024-01-02T09:00:00+00:00'),
+    ])
+    result = sync_engine.run_incremental_sync(second, conn)
+    assert second.requested_params == [{'updated_at_min': '2024-01-01T15:00:00+00:00'}]
+    assert result['totals'] == {'inserted': 1, 'updated': 0, 'unchanged': 1, 'skipped': 0}
+    assert database.get_sync_watermark(conn, 'example.myshopify.com') == '2024-01-02T09:00:00+00:00'
+    conn.close()
+
+
+def test_failed_sync_does_not_advance_watermark(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    database.advance_sync_watermark(conn, 'example.myshopify.com', '2024-01-01T00:00:00+00:00')
+
+    class FailingClient(FakeShopifyClient):
+        def iter_all_products(self, page_size=250, params=None):
+            yield _product('A', '2024-02-01T00:00:00+00:00')
+            raise RuntimeError("connection dropped")
+
+    with pytest.raises(RuntimeError):
+        sync_engine.run_incremental_sync(FailingClient([]), conn)
+    assert database.get_sync_watermark(conn, 'example.myshopify.com') == '2024-01-01T00:00:00+00:00'
+    conn.close()
+
+
+def test_watermark_is_capped_at_walk_start(tmp_path, monkeypatch):
+    conn = database.initialize_db(str(tmp_path / 'test.db'))
+    monkeypatch.setattr(sync_engine, '_walk_started_at', lambda: '2024-01-01T12:00:00+00:00')
+
+    # B was saved after the walk began; an edit to A on an already fetched page would be older than B
+    client = FakeShopifyClient([_product('A', '2024-01-01T10:00:00+00:00'), _product('B', '2024-01-01T12:30:00+00:00')])
+    result = sync_engine.run_incremental_sync(client, conn)
+    assert result['watermark_after'] == '2024-01-01T12:00:00+00:00'
+    conn.close()
+
+
+class FakePagedClient:
+    """Serves products.json pages by cursor like ShopifyAPIClient.iter_product_pages."""
+
+    store_url = "example.myshopify.com"
+
+    def __init__(self, pages, fail_at=None, on_page=None):
+        self.pages = pages
+        self.fail_at = fail_at
+        self.on_page = on_page
+        self.requested = []
+
+    def iter_product_pages(self, page_size=250, params=None, page_info=None):
+        self.requested.append((params, page_info))
+        index = int(page_info) if page_info else 0
+        while True:
+            if index == self.fail_at:
+                raise RuntimeError("connection dropped")
+            next_page_info = str(index + 1) if index + 1 < len(self.pages) else None
+            yield json.dumps({'products': self.pages[index]}).encode(), next_page_info
+            if self.on_page:
+                self.on_page(index)
+            if next_page_info is None:
+                return
+            index += 1
+
+
+def _raw_pages(page_count, per_page):
+    return [[{'id': p * per_page + i, 'title': f'P{p}-{i}', 'updated_at': f'2024-01-{p + 1:02d}T00:00:00+00:00',
+              'variants': [{'sku': f'SKU-{p}-{i}', 'price': '5.00', 'inventory_quantity': i}]}
+             for i in range(per_page)] for p in range(page_count)]
+
+
+def test_pipeline_syncs_all_pages_and_pushes(tmp_path):
+    db_path = str(tmp_path / 'test.db')
+    pushed = []
+    pipeline = sync_engine.SyncPipeline(
+        FakePagedClient(_raw_pages(6, 5)), db_path, transform_workers=3, queue_size=2, push_threshold=12,
+        pusher=lambda conn: pushed.append(conn.execute("SELECT COUNT(*) FROM products WHERE needs_push = 1").fetchone()[0]),
+    )
+    result = pipeline.run()
+
+    assert result['mode'] == 'full' and result['pages'] == 6 and not result['stopped']
+    assert result['totals']['inserted'] == 30
+    assert result['watermark_after'] == '2024-01-06T00:00:00+00:00'
+    # However the pushes interleave with the writes, the last one runs after the last commit
+    assert len(result['pushes']) == len(pushed) and pushed[-1] == 30
+    conn = database.initialize_db(db_path)
+    assert database.get_sync_checkpoint(conn, 'example.myshopify.com') is None
+    assert database.get_variant_by_sku(conn, 'SKU-5-4')['quantity'] == 4
+    conn.close()
+
+
+def test_pipeline_stops_gracefully_and_resumes_from_checkpoint(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'test.db')
+    monkeypatch.setattr(sync_engine, '_walk_started_at', lambda: '2024-01-04T12:00:00+00:00')
+    pages = _raw_pages(5, 3)
+    client = FakePagedClient(pages)
+    pipeline = sync_engine.SyncPipeline(client, db_path)
+    client.on_page = lambda index: index == 1 and pipeline.stop()
+
+    result = pipeline.run()
+    # Page 2 was already in flight when stop() was called, so it is still written
+    assert result['stopped'] and result['pages'] == 3 and result['watermark_after'] is None
+    conn = database.initialize_db(db_path)
+    assert database.get_sync_checkpoint(conn, 'example.myshopify.com') == \
+        ('3', '2024-01-03T00:00:00+00:00', '2024-01-04T12:00:00+00:00')
+    conn.close()
+
+    # The resumed run starts later, but keeps the first run's ceiling
+    monkeypatch.setattr(sync_engine, '_walk_started_at', lambda: '2024-02-01T00:00:00+00:00')
+    resumed = FakePagedClient(pages)
+    result = sync_engine.SyncPipeline(resumed, db_path).run()
+    assert resumed.requested == [(None, '3')]
+    assert result['mode'] == 'resumed' and result['pages'] == 2 and result['totals']['inserted'] == 6
+    assert result['watermark_after'] == '2024-01-04T12:00:00+00:00'
+
+
+def test_pipeline_error_keeps_checkpoint_of_committed_pages(tmp_path):
+    db_path = str(tmp_path / 'test.db')
+    with pytest.raises(RuntimeError):
+        sync_engine.SyncPipeline(FakePagedClient(_raw_pages(4, 2), fail_at=3), db_path, transform_workers=2).run()
+
+    conn = database.initialize_db(db_path)
+    assert database.get_sync_checkpoint(conn, 'example.myshopify.com')[0] == '3'
+    assert database.get_sync_watermark(conn, 'example.myshopify.com') is None
+    assert conn.execute("SELECT COUNT(*) FROM products").fetchone()[0] == 6
+    conn.close()
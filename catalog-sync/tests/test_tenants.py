@@ -0,0 +1,160 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# Ensure catalog-sync package is on path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from catalog_sync import database, tenants
+from catalog_sync.feed_builder import ListingsFeedBuilder, push_dirty_products
+
+
+def _tenant(name, store, **extra):
+    tenant = {'name': name, 'shopify': {'store_url': store, 'api_key': 'key', 'api_password': 'pw'}}
+    tenant.update(extra)
+    return tenant
+
+
+def _amazon(refresh_token):
+    return {'client_id': 'app', 'client_secret': 'secret', 'refresh_token': refresh_token,
+            'endpoint': 'https://sellingpartnerapi-na.amazon.com', 'seller_id': 'A1', 'marketplace_ids': ['ATVPDKIKX0DER']}
+
+
+def _write_config(path, entries):
+    path.write_text(json.dumps({'tenants': entries}))
+    return str(path)
+
+
+def test_load_tenants_expands_env_assigns_shards_and_rate_shares(tmp_path, monkeypatch):
+    monkeypatch.setenv('US_PASSWORD', 'from-env')
+    us = _tenant('us', 'main.myshopify.com', amazon=_amazon('rt-na'), weight=3)
+    us['shopify']['api_password'] = '${US_PASSWORD}'
+    config = _write_config(tmp_path / 'tenants.json', [
+        us,
+        _tenant('ca', 'main.myshopify.com', amazon=_amazon('rt-na')),
+        _tenant('outlet', 'outlet.myshopify.com', db_path=str(tmp_path / 'outlet.db')),
+    ])
+
+    loaded = {t['name']: t for t in tenants.load_tenants(config, shard_dir=str(tmp_path / 'shards'))}
+
+    assert loaded['us']['shopify']['api_password'] == 'from-env'
+    assert loaded['us']['db_path'] == str(tmp_path / 'shards' / 'us.db')
+    assert loaded['outlet']['db_path'] == str(tmp_path / 'outlet.db')
+    # us and ca share one store and one SP-API credential pair, split 3:1
+    assert loaded['us']['shopify_rate_share'] == 0.75 and loaded['ca']['shopify_rate_share'] == 0.25
+    assert loaded['us']['sp_api_rate_share'] == 0.75 and loaded['ca']['sp_api_rate_share'] == 0.25
+    assert loaded['outlet']['shopify_rate_share'] == 1.0 and 'sp_api_rate_share' not in loaded['outlet']
+
+
+def test_load_tenants_rejects_incomplete_or_duplicate_tenants(tmp_path, monkeypatch):
+    monkeypatch.delenv('UNSET_PASSWORD', raising=False)
+    missing = _tenant('us', 'main.myshopify.com')
+    missing['shopify']['api_password'] = '${UNSET_PASSWORD}'
+    with pytest.raises(ValueError, match='api_password'):
+        tenants.load_tenants(_write_config(tmp_path / 'a.json', [missing]))
+
+    duplicate = [_tenant('us', 'a.myshopify.com'), _tenant('us', 'b.myshopify.com')]
+    with pytest.raises(ValueError, match='Duplicate'):
+        tenants.load_tenants(_write_config(tmp_path / 'b.json', duplicate))
+
+    # Listings carry marketplace-specific attributes; one tenant per marketplace instead
+    two_marketplaces = _tenant('eu', 'eu.myshopify.com', amazon=dict(_amazon('rt-eu'),
+                                                                     marketplace_ids=['A1PA6795UKMFR9', 'A13V1IB3VIYZZH']))
+    with pytest.raises(ValueError, match='exactly one marketplace'):
+        tenants.load_tenants(_write_config(tmp_path / 'c.json', [two_marketplaces]))
+
+
+class FakeAmazon:
+    """Feeds API stand-in: every feed finishes on its first poll, rejecting the SKUs in reject."""
+
+    def __init__(self, reject=()):
+        self.reject = set(reject)
+        self.feeds = {}
+
+    def create_feed_document(self, content_type):
+        return {"feedDocumentId": f"doc-{len(self.feeds) + 1}", "url": "https://s3.example.com/upload"}
+
+    def upload_feed_document(self, upload_url, feed_content, content_type):
+        self.uploaded = json.loads(feed_content.read())["messages"]
+
+    def create_feed(self, feed_type, feed_document_id, marketplace_ids):
+        feed_id = f"feed-{len(self.feeds) + 1}"
+        self.feeds[feed_id] = self.uploaded
+        return {"feedId": feed_id}
+
+    def get_feed_status(self, feed_id):
+        return {"feedId": feed_id, "processingStatus": "DONE", "resultFeedDocumentId": f"report-{feed_id}"}
+
+    def get_feed_document(self, feed_document_id):
+        return {"feedDocumentId": feed_document_id, "url": feed_document_id}
+
+    def download_feed_document(self, url, compression_algorithm=None):
+        messages = self.feeds[url[len("report-"):]]
+        issues = [{"messageId": m["messageId"], "severity": "ERROR", "code": "90220", "message": "rejected"}
+                  for m in messages if m["sku"] in self.reject]
+        self.reject.clear() # Accepted on the next attempt
+        return json.dumps({"issues": issues, "summary": {}}).encode()
+
+
+def test_settle_tenant_feeds_settles_and_repushes_rejected_products(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'shard.db'))
+    database.upsert_products(conn, [{'id': i, 'sku': f'SKU-{i}', 'title': 'Shirt', 'raw_shopify_data': {}}
+                                    for i in range(3)])
+    client = FakeAmazon(reject={'SKU-1'})
+    builder = ListingsFeedBuilder("A1", "ATVPDKIKX0DER")
+    pusher = lambda c: push_dirty_products(client, c, builder, ["ATVPDKIKX0DER"])
+    assert len(pusher(conn)) == 1
+
+    # The rejected product is sent again right away; the others are settled as pushed
+    resubmitted = tenants.settle_tenant_feeds(client, conn, pusher)
+    assert [s["message_count"] for s in resubmitted] == [1]
+    assert [m["sku"] for m in client.feeds["feed-2"]] == ['SKU-1']
+    assert tenants.settle_tenant_feeds(client, conn, pusher) == []
+    assert database.get_products_needing_push(conn) == []
+    assert database.get_pending_feeds(conn) == []
+    conn.close()
+
+
+def fake_worker(tenant, time_slice):
+    """Needs tenant['slices'] turns to finish; counts its turns in a file since each runs in a fresh process."""
+    counter = Path(tenant['db_path'])
+    turn = int(counter.read_text()) + 1 if counter.exists() else 1
+    counter.write_text(str(turn))
+    if tenant.get('fail'):
+        return {'tenant': tenant['name'], 'mode': 'full', 'pages': 0, 'totals': {}, 'feeds': 0, 'stopped': False,
+                'elapsed_seconds': 0.0, 'rows_per_second': 0.0, 'error': 'ShopifyAPIError: 401'}
+    return {'tenant': tenant['name'], 'mode': 'full' if turn == 1 else 'resumed', 'pages': 2,
+            'totals': {'inserted': 10, 'updated': 0, 'unchanged': 0, 'skipped': 0}, 'feeds': 1,
+            'stopped': turn < tenant['slices'], 'elapsed_seconds': 0.5, 'rows_per_second': 20.0, 'error': None}
+
+
+def crashing_worker(tenant, time_slice):
+    raise RuntimeError("worker crashed")
+
+
+def test_scheduler_logs_worker_failures_with_traceback(tmp_path, caplog):
+    scheduled = [dict(_tenant('us', 'main.myshopify.com'), db_path=str(tmp_path / 'us'))]
+    with caplog.at_level("ERROR", logger="catalog_sync.tenants"):
+        results = tenants.TenantScheduler(scheduled, max_workers=1, worker=crashing_worker).run()
+    assert results['us']['error'] == 'RuntimeError: worker crashed'
+    (record,) = caplog.records
+    assert record.getMessage() == "Worker for tenant us failed" and record.exc_info is not None
+
+
+def test_scheduler_requeues_stopped_tenants_until_complete(tmp_path):
+    scheduled = [
+        dict(_tenant('big', 'big.myshopify.com'), db_path=str(tmp_path / 'big'), slices=3),
+        dict(_tenant('small', 'small.myshopify.com'), db_path=str(tmp_path / 'small'), slices=1),
+        dict(_tenant('broken', 'broken.myshopify.com'), db_path=str(tmp_path / 'broken'), fail=True),
+    ]
+
+    results = tenants.TenantScheduler(scheduled, max_workers=2, time_slice=0.1, worker=fake_worker).run()
+
+    assert results['big']['slices'] == 3 and results['big']['completed']
+    assert results['big']['pages'] == 6 and results['big']['totals']['inserted'] == 30
+    assert results['big']['mode'] == 'full'
+    assert results['small']['slices'] == 1 and results['small']['completed']
+    # Failures are reported, not retried
+    assert results['broken']['slices'] == 1 and not results['broken']['completed']
+    assert results['broken']['error'] == 'ShopifyAPIError: 401'
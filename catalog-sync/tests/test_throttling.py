@@ -0,0 +1,85 @@
+import sys
+import threading
+from pathlib import Path
+
+# Ensure catalog-sync package is on path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from catalog_sync import throttling
+from catalog_sync.metrics import REGISTRY
+from catalog_sync.throttling import (SPAPIRateLimiter, ShopifyCallLimitThrottler, get_shopify_throttler,
+                                     get_sp_api_rate_limiter)
+
+
+def test_throttler_waits_when_bucket_is_nearly_full(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(throttling.time, "sleep", sleeps.append)
+    throttler = ShopifyCallLimitThrottler(headroom=2)
+
+    throttler.update_from_header("37/40")
+    assert throttler.acquire() == 0 # 37 + 1 still fits under 40 - 2
+    wait = throttler.acquire()
+    assert wait > 0 and sleeps == [wait]
+    assert throttler.metrics()['total_wait_seconds'] == wait
+
+
+def test_throttler_reservations_are_thread_safe(monkeypatch):
+    monkeypatch.setattr(throttling.time, "sleep", lambda seconds: None)
+    throttler = ShopifyCallLimitThrottler(capacity=1000, leak_rate=0.001)
+
+    threads = [threading.Thread(target=lambda: [throttler.acquire() for _ in range(50)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert throttler.calls == 400
+    assert 399 < throttler.fill_level <= 400
+
+
+def test_throttlers_are_shared_per_store():
+    assert get_shopify_throttler("a.myshopify.com") is get_shopify_throttler("a.myshopify.com")
+    assert get_shopify_throttler("a.myshopify.com") is not get_shopify_throttler("b.myshopify.com")
+
+
+def test_sp_api_limiter_keeps_one_bucket_per_operation_and_follows_header():
+    limiter = SPAPIRateLimiter()
+
+    assert limiter.bucket("getFeed").rate == 2.0
+    assert limiter.bucket("createFeed").rate == 0.0083
+    assert limiter.bucket("getFeed") is limiter.bucket("getFeed")
+
+    limiter.update_from_header("getFeed", "0.5000")
+    assert limiter.bucket("getFeed").rate == 0.5
+
+    limiter.record_throttled("getFeed")
+    assert limiter.bucket("getFeed").available <= 0.5
+    assert limiter.metrics()["getFeed"]["throttled_count"] == 1
+
+
+def test_rate_shares_scale_shopify_and_sp_api_budgets():
+    assert ShopifyCallLimitThrottler(share=0.5).leak_rate == 1.0
+
+    limiter = SPAPIRateLimiter(share=0.25)
+    assert limiter.bucket("getFeed").rate == 0.5
+    assert limiter.bucket("getFeed").burst == 3.75
+    limiter.update_from_header("getFeed", "4.0")
+    assert limiter.bucket("getFeed").rate == 1.0
+
+
+def test_throttler_state_is_exported_on_every_scrape():
+    throttler = get_shopify_throttler("metrics-test.myshopify.com")
+    throttler.update_from_header("39/40")
+    limiter = get_sp_api_rate_limiter("0123456789abcdef-metrics-test")
+    limiter.record_throttled("getFeed")
+
+    series = {name: report["series"] for name, report in REGISTRY.snapshot().items()}
+    store = {"store": "metrics-test.myshopify.com"}
+    (fill,) = [s["value"] for s in series["shopify_call_limit_fill_level"] if s["labels"] == store]
+    (wait,) = [s["value"] for s in series["shopify_call_limit_wait_seconds"] if s["labels"] == store]
+    assert 38 < fill <= 39 and wait > 0
+    get_feed = {"limiter": "0123456789ab", "operation": "getFeed"}
+    assert {"labels": get_feed, "value": 1} in series["sp_api_throttled_count"]
+    assert any(s["labels"] == get_feed for s in series["sp_api_tokens_available"])
+
+    limiter.record_throttled("getFeed")
+    assert 'sp_api_throttled_count{limiter="0123456789ab",operation="getFeed"} 2' in REGISTRY.render_prometheus()
@@ -0,0 +1,127 @@
+import base64
+import hashlib
+import hmac
+import json
+import sys
+import threading
+from pathlib import Path
+
+import requests
+
+# Ensure catalog-sync package is on path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from catalog_sync import database
+from catalog_sync.webhooks import WebhookConsumer, WebhookQueue, WebhookServer
+
+SECRET = "shpss_test"
+
+
+def _sign(body):
+    return base64.b64encode(hmac.new(SECRET.encode(), body, hashlib.sha256).digest()).decode()
+
+
+def _product(product_id, title, quantity=5, inventory_item_id=900):
+    return {
+        'id': product_id, 'title': title, 'body_html': '<p>Desc</p>',
+        'variants': [{'id': product_id * 10, 'product_id': product_id, 'sku': f'SKU-{product_id}', 'price': '10.00',
+                      'inventory_quantity': quantity, 'inventory_item_id': inventory_item_id}],
+    }
+
+
+def test_server_verifies_hmac_and_queues_each_delivery_once(tmp_path, caplog):
+    queue = WebhookQueue(tmp_path / 'webhooks.db')
+    server = WebhookServer(queue, secret=SECRET, host='127.0.0.1', port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/webhooks"
+    body = json.dumps(_product(1, 'Shirt')).encode()
+    headers = {'X-Shopify-Topic': 'products/update', 'X-Shopify-Webhook-Id': 'wh-1',
+               'X-Shopify-Shop-Domain': 'test.myshopify.com'}
+    try:
+        assert requests.post(url, data=body, headers={**headers, 'X-Shopify-Hmac-Sha256': _sign(body)}).status_code == 200
+        # Shopify redelivery of the same webhook id
+        assert requests.post(url, data=body, headers={**headers, 'X-Shopify-Hmac-Sha256': _sign(body)}).status_code == 200
+        assert requests.post(url, data=body, headers={**headers, 'X-Shopify-Hmac-Sha256': _sign(b'other')}).status_code == 401
+        assert any(record.levelname == 'WARNING' and 'invalid HMAC' in record.getMessage() for record in caplog.records)
+        unhandled = {**headers, 'X-Shopify-Topic': 'orders/create', 'X-Shopify-Webhook-Id': 'wh-2',
+                     'X-Shopify-Hmac-Sha256': _sign(body)}
+        assert requests.post(url, data=body, headers=unhandled).status_code == 200
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert queue.pending_count() == 1
+
+
+def test_consumer_coalesces_bursts_per_product(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'catalog.db'))
+    queue = WebhookQueue(tmp_path / 'webhooks.db')
+    for i in range(50):
+        queue.enqueue('products/update', json.dumps(_product(1, f'Shirt v{i}')))
+    queue.enqueue('products/update', json.dumps(_product(2, 'Hat', inventory_item_id=901)))
+
+    consumer = WebhookConsumer(queue, conn, coalesce_window=0)
+    result = consumer.process_once()
+    assert (result['events'], result['resources']) == (51, 2)
+    assert result['products'][0]['inserted'] == 2
+    assert conn.execute("SELECT title FROM products WHERE sku = 'SKU-1'").fetchone()[0] == 'Shirt v49'
+    assert queue.pending_count() == 0
+
+    queue.enqueue('inventory_levels/update', json.dumps({'inventory_item_id': 900, 'location_id': 1, 'available': 3}))
+    queue.enqueue('inventory_levels/update', json.dumps({'inventory_item_id': 900, 'location_id': 1, 'available': 7}))
+    queue.enqueue('products/delete', json.dumps({'id': 2}))
+    result = consumer.process_once()
+    assert result['variants_updated'] == 1 and result['deleted_skus'] == ['SKU-2']
+    assert database.get_variant_by_sku(conn, 'SKU-1')['quantity'] == 7
+    assert database.get_variant_by_sku(conn, 'SKU-2') is None
+
+
+def test_inventory_levels_are_summed_across_locations(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'catalog.db'))
+    queue = WebhookQueue(tmp_path / 'webhooks.db')
+    queue.enqueue('products/update', json.dumps(_product(1, 'Shirt', quantity=20)))
+    consumer = WebhookConsumer(queue, conn, coalesce_window=0)
+    consumer.process_once()
+
+    for location_id, available in ((1, 4), (2, 6), (1, 5)):
+        queue.enqueue('inventory_levels/update', json.dumps(
+            {'inventory_item_id': 900, 'location_id': location_id, 'available': available}))
+    result = consumer.process_once()
+    assert (result['events'], result['resources']) == (3, 2) # Location 1's two updates coalesce
+    assert database.get_variant_by_sku(conn, 'SKU-1')['quantity'] == 11
+
+    queue.enqueue('inventory_levels/update', json.dumps({'inventory_item_id': 900, 'location_id': 2, 'available': 0}))
+    consumer.process_once()
+    assert database.get_variant_by_sku(conn, 'SKU-1')['quantity'] == 5
+
+
+def test_consumer_refetches_levels_at_every_location(tmp_path):
+    class FakeShopify:
+        def __init__(self):
+            self.requested = []
+
+        def get_inventory_levels(self, inventory_item_ids):
+            self.requested.append(sorted(inventory_item_ids))
+            return [{'inventory_item_id': 900, 'location_id': 1, 'available': 3},
+                    {'inventory_item_id': 900, 'location_id': 2, 'available': 8}]
+
+    conn = database.initialize_db(str(tmp_path / 'catalog.db'))
+    queue = WebhookQueue(tmp_path / 'webhooks.db')
+    queue.enqueue('products/update', json.dumps(_product(1, 'Shirt', quantity=20)))
+    shopify = FakeShopify()
+    consumer = WebhookConsumer(queue, conn, coalesce_window=0, shopify_client=shopify)
+    consumer.process_once()
+
+    # Only location 1 sent a webhook; location 2's stock still counts
+    queue.enqueue('inventory_levels/update', json.dumps({'inventory_item_id': 900, 'location_id': 1, 'available': 3}))
+    assert consumer.process_once()['variants_updated'] == 1
+    assert shopify.requested == [[900]]
+    assert database.get_variant_by_sku(conn, 'SKU-1')['quantity'] == 11
+
+
+def test_consumer_waits_for_the_coalesce_window(tmp_path):
+    conn = database.initialize_db(str(tmp_path / 'catalog.db'))
+    queue = WebhookQueue(tmp_path / 'webhooks.db')
+    queue.enqueue('products/update', json.dumps(_product(1, 'Shirt')))
+
+    assert WebhookConsumer(queue, conn, coalesce_window=60, max_delay=120).process_once()['resources'] == 0
+    assert WebhookConsumer(queue, conn, coalesce_window=60, max_delay=0).process_once()['resources'] == 1